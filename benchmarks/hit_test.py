@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Hit testing benchmark. Compares point queries of per-layer spatial
+index with linear scan of layer objects (previous click handling)
+on generated page, and measures reindexing of moved objects.
+
+Usage:  python benchmarks/hit_test.py [objects count]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from uc2 import libgeom
+
+from sk1.document.geometry import get_visual_bbox
+from sk1.document.spatial import SpatialIndex
+
+OBJECTS_COUNT = 50000
+PAGE_SIZE = 2000.0
+OBJECT_SIZE = 20.0
+STROKE_WIDTH = 0.5
+QUERIES = 1000
+MOVED = 100
+
+
+class Node(object):
+    """
+    Page object with attributes used by indexing only.
+    """
+    is_layer = False
+    is_curve = False
+    parent = None
+    childs = None
+    cache_bbox = None
+    cache_arrows = None
+    stroke_trafo = None
+    style = None
+
+    def __init__(self, parent, bbox=None):
+        self.parent = parent
+        self.cache_bbox = bbox
+        self.stroke_trafo = []
+        self.style = [[], [0, STROKE_WIDTH]]
+
+
+def get_random_bbox():
+    x = random.uniform(0.0, PAGE_SIZE - OBJECT_SIZE)
+    y = random.uniform(0.0, PAGE_SIZE - OBJECT_SIZE)
+    w = random.uniform(1.0, OBJECT_SIZE)
+    h = random.uniform(1.0, OBJECT_SIZE)
+    return [x, y, x + w, y + h]
+
+
+def create_layer(count):
+    layer = Node(None)
+    layer.is_layer = True
+    layer.childs = [Node(layer, get_random_bbox()) for _i in xrange(count)]
+    return layer
+
+
+def scan_at_point(layer, point):
+    return [obj for obj in reversed(layer.childs)
+            if libgeom.is_point_in_bbox(point, get_visual_bbox(obj))]
+
+
+def draw_layer(index, count):
+    """
+    Fills empty layer object by object, as on interactive drawing.
+    """
+    layer = create_layer(0)
+    index.get_layer_index(layer)
+    for _i in xrange(count):
+        obj = Node(layer, get_random_bbox())
+        layer.childs.append(obj)
+        index.update([obj])
+        index.get_objs_at_point(layer, obj.cache_bbox[:2])
+    return layer
+
+
+def measure(func, points):
+    start = time.time()
+    for point in points:
+        func(point)
+    return (time.time() - start) / len(points) * 1000.0
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else OBJECTS_COUNT
+    random.seed(0)
+    layer = create_layer(count)
+    points = [[random.uniform(0.0, PAGE_SIZE),
+               random.uniform(0.0, PAGE_SIZE)] for _i in xrange(QUERIES)]
+    index = SpatialIndex(None)
+
+    start = time.time()
+    index.get_layer_index(layer)
+    build_time = (time.time() - start) * 1000.0
+
+    for point in points[:100]:
+        assert index.get_objs_at_point(layer, point) == \
+            scan_at_point(layer, point)
+
+    def index_at_point(point):
+        index.get_objs_at_point(layer, point)
+
+    def scan_point(point):
+        scan_at_point(layer, point)
+
+    def move_objects(point):
+        objs = random.sample(layer.childs, MOVED)
+        for obj in objs:
+            obj.cache_bbox = get_random_bbox()
+        index.update(objs)
+        index.get_objs_at_point(layer, point)
+
+    print 'Objects on page:        %d' % count
+    print 'Index build:            %.2f ms' % build_time
+    print 'Linear scan click:      %.3f ms' % measure(scan_point, points[:50])
+    print 'Indexed click:          %.3f ms' % measure(index_at_point, points)
+    print 'Reindex of %d moved:     %.3f ms' % \
+          (MOVED, measure(move_objects, points[:100]))
+
+    start = time.time()
+    drawn = draw_layer(index, count)
+    draw_time = (time.time() - start) / max(count, 1) * 1000.0
+
+    def drawn_at_point(point):
+        index.get_objs_at_point(drawn, point)
+
+    print 'Drawn object + click:   %.3f ms' % draw_time
+    print 'Click on drawn page:    %.3f ms' % measure(drawn_at_point, points)
+
+
+if __name__ == '__main__':
+    main()
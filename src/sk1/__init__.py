@@ -72,8 +72,18 @@ def init_config(cfgdir='~'):
 
 def check_server(cfgdir):
     cfg_dir = os.path.join(cfgdir, '.config', 'sk1-wx')
+    if not config.app_server:
+        return
+    from sk1 import app_ipc
+    if app_ipc.is_supported():
+        files = [os.path.abspath(item) for item in sys.argv[1:]]
+        path = app_ipc.get_socket_path(cfg_dir)
+        if fsutils.exists(path) and \
+                app_ipc.send_request(path, app_ipc.make_request(files)):
+            sys.exit(0)
+        return
     lock = os.path.join(cfg_dir, 'lock')
-    if config.app_server and fsutils.exists(lock):
+    if fsutils.exists(lock):
         socket = os.path.join(cfg_dir, 'socket')
         with fsutils.uopen(socket, 'wb') as fp:
             for item in sys.argv[1:]:
@@ -85,6 +95,33 @@ def check_server(cfgdir):
             sys.exit(0)
 
 
+def render_server_run(cfgdir, pkgdir):
+    """Headless render/export server launch routine"""
+    from sk1.headless import RenderServer
+
+    server = RenderServer(pkgdir, cfgdir)
+    server.run()
+    server.destroy()
+
+
+def render_client_run(cfgdir, args):
+    """Headless render server client routine"""
+    import json
+    import socket
+    from sk1.headless import request_server, STATUS_OK
+
+    try:
+        request = json.loads(args[0] if args else sys.stdin.read())
+        reply = request_server(cfgdir, request)
+    except (ValueError, socket.error) as e:
+        sys.stderr.write('Render request failed: %s\n' % e)
+        sys.exit(1)
+    sys.stdout.write(json.dumps(reply) + '\n')
+    if any(item.get('status') != STATUS_OK
+           for item in reply.get('results', [])):
+        sys.exit(1)
+
+
 def sk1_run(cfgdir='~'):
     """sK1 application launch routine"""
 
@@ -92,6 +129,13 @@ def sk1_run(cfgdir='~'):
     _pkgdir = get_utf8_path(__path__[0])
 
     init_config(cfgdir)
+    if '--render-server' in sys.argv[1:]:
+        render_server_run(cfgdir, _pkgdir)
+        return
+    if '--render-request' in sys.argv[1:]:
+        index = sys.argv.index('--render-request')
+        render_client_run(cfgdir, sys.argv[index + 1:index + 2])
+        return
     check_server(cfgdir)
     os.environ["NO_AT_BRIDGE"] = "1"
     os.environ["GTK_CSD"] = "0"
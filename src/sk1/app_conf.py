@@ -37,6 +37,8 @@ class AppData(UCData):
     plugin_dir = ''
     app_palette_dir = ''
     app_temp_dir = ''
+    app_journal_dir = ''
+    app_font_cache_dir = ''
     plugin_dirs = []
 
     def __init__(self, app, cfgdir='~'):
@@ -50,9 +52,12 @@ class AppData(UCData):
         self.app_palette_dir = os.path.join(path, 'palettes')
         self.plugin_dir = os.path.join(path, 'sk1_custom_plugins')
         self.app_temp_dir = os.path.join(path, 'temp')
+        self.app_journal_dir = os.path.join(path, 'journal')
+        self.app_font_cache_dir = os.path.join(path, 'font_cache')
 
         # --- Check config directories
-        paths = (self.app_palette_dir, self.plugin_dir, self.app_temp_dir)
+        paths = (self.app_palette_dir, self.plugin_dir, self.app_temp_dir,
+                 self.app_journal_dir, self.app_font_cache_dir)
         [fsutils.makedirs(item) for item in paths if not fsutils.exists(item)]
 
         plugin_dir_init = os.path.join(self.plugin_dir, '__init__.py')
@@ -85,6 +90,12 @@ class AppConfig(UCConfig):
     os_name = system.UBUNTU
     system_encoding = 'utf-8'  # default encoding (GUI uses utf-8 only)
     log_level = 'INFO'
+    log_max_size = 10 * 1024 * 1024  # in bytes, 0 means unlimited
+    log_rotate_interval = 0  # in seconds, 0 means no time based rotation
+    log_backup_count = 5  # number of kept rotated logs
+    log_compress = True  # compress rotated logs with gzip
+    log_json = False  # write log records as JSON lines
+    log_status_rate = 10  # status records per second, 0 means unlimited
     language = 'system'
     app_server = True
 
@@ -93,6 +104,18 @@ class AppConfig(UCConfig):
     new_doc_on_start = False
     history_size = 100
     history_list_size = 10
+    undo_memory_limit = 64 * 1024 * 1024  # in bytes, 0 means unlimited
+    undo_coalesce_time = 1.0  # in seconds
+    undo_journal = True  # crash recovery journal
+    journal_checkpoint_interval = 60.0  # in seconds
+    journal_sync_interval = 5.0  # in seconds
+    async_loading = True  # foreign formats are parsed by separate process
+    async_loading_size = 0  # min file size to parse it so, 0 - disabled
+    batch_open_workers = 0  # 0 means number of CPUs
+    batch_open_timeout = 300.0  # in seconds without converted file
+    render_server_workers = 0  # 0 means number of CPUs
+    render_server_socket = ''  # empty means 'render.sock' in config dir
+    render_server_timeout = 600.0  # in seconds for jobs of request
     spin_overlay = True
     spin_sep = False
     spin_width = 0
@@ -106,6 +129,10 @@ class AppConfig(UCConfig):
     tab_style = 0
 
     printer_config = {}
+    print_workers = 0  # 0 means number of CPUs
+    print_chunk_pages = 16  # pages rendered by single process at once
+    print_chunk_timeout = 300.0  # in seconds without rendered chunk
+    print_streaming = True  # chunks are sent to CUPS as they are ready
 
     # ===Ubuntu features
     ubuntu_global_menu = False
@@ -133,6 +160,8 @@ class AppConfig(UCConfig):
     print_preview_dlg_size = (850, 650)
     print_preview_dlg_minsize = (850, 650)
     print_preview_dlg_maximized = False
+    print_preview_prefetch = 2  # pages pre-rendered around current one
+    print_preview_cache_size = 128 * 1024 * 1024  # in bytes
 
     prnprops_dlg_size = (400, 500)
     prnprops_dlg_minsize = (400, 500)
@@ -207,6 +236,13 @@ class AppConfig(UCConfig):
     obj_jump = 1.0 * uc2const.mm_to_pt
     page_border = 0.0
 
+    tiled_rendering = True
+    tile_size = 256  # in pixels
+    tile_cache_size = 256  # max number of cached tiles
+    threaded_rendering = True  # tiles are rendered by background thread
+    lod_rendering = True  # simplified rendering of tiny and complex objects
+    lod_object_size = 1.0  # in pixels, smaller objects are drawn as bbox
+
     sel_frame_visible = 1
     sel_frame_offset = 0.0
     sel_frame_color = (0.0, 0.0, 0.0)
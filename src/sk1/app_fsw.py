@@ -15,51 +15,123 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import Queue
+import logging
 import os
 
 import wal
 from uc2.utils import fsutils
-from sk1 import config, events
+from sk1 import app_ipc, config, events
+
+LOG = logging.getLogger(__name__)
+
+# polling interval of socket file, in ms
+POLL_DELAY = 1000
 
 
 class AppFileWatcher(object):
+    """
+    Single instance server. On POSIX systems open requests are received
+    by listening thread of Unix domain socket and passed to UI thread
+    through in-memory queue, dispatching is scheduled by thread-safe
+    wal.call_after(), so idle server has no timer wakeups and performs
+    no file I/O. Other systems use polling of socket file in config
+    directory.
+    """
     app = None
     mw = None
+    server = None
+    requests = None
 
     def __init__(self, app, mw):
         self.app = app
         self.mw = mw
-        self.timer = wal.CanvasTimer(mw, 1000)
+        cfg_dir = self.app.appdata.app_config_dir
+        self.socket = os.path.join(cfg_dir, 'socket')
+        self.lock = os.path.join(cfg_dir, 'lock')
+        self.ipc_path = app_ipc.get_socket_path(cfg_dir)
+        self.requests = Queue.Queue()
+        self.timer = wal.CanvasTimer(mw, POLL_DELAY)
         self.mw.bind_timer(self.on_timer)
-        self.socket = os.path.join(self.app.appdata.app_config_dir, 'socket')
-        self.lock = os.path.join(self.app.appdata.app_config_dir, 'lock')
         events.connect(events.CONFIG_MODIFIED, self.check_config)
         if config.app_server:
+            self.start()
+
+    def destroy(self):
+        self.stop()
+
+    def start(self):
+        if not app_ipc.is_supported():
             self.timer.start()
             with fsutils.uopen(self.lock, 'wb') as fp:
                 fp.write('\n')
+            return
+        server = app_ipc.IPCServer(self.ipc_path, self.on_request)
+        try:
+            if not server.bind():
+                return
+        except Exception as e:
+            LOG.error('Cannot start IPC server <%s> %s', self.ipc_path, e)
+            return
+        self.server = server
+        self.server.start()
 
-    def destroy(self):
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
         if fsutils.exists(self.lock):
             fsutils.remove(self.lock)
         if self.timer.is_running():
             self.timer.stop()
 
+    def is_running(self):
+        return self.server is not None or \
+            (not app_ipc.is_supported() and self.timer.is_running())
+
     def check_config(self, *_args):
-        if config.app_server and not self.timer.is_running():
-            self.timer.start()
-        elif not config.app_server and self.timer.is_running():
-            self.timer.stop()
+        if config.app_server and not self.is_running():
+            self.start()
+        elif not config.app_server and self.is_running():
+            self.stop()
+
+    def on_request(self, request):
+        # listening thread side
+        self.requests.put(request)
+        wal.call_after(self.dispatch)
 
     def on_timer(self, *_args):
+        self.check_socket_file()
+
+    def dispatch(self):
+        if self.server is None:
+            # server is stopped before queued call
+            return
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except Queue.Empty:
+                break
+            self.process_request(request)
+
+    def process_request(self, request):
+        files = [item for item in request['files'] if fsutils.isfile(item)]
+        if request['raise'] and (files or not request['files']):
+            self.mw.raise_window()
+        if request['action'] == app_ipc.IMPORT and self.app.current_doc:
+            for item in files:
+                self.app.import_file(item)
+        elif files:
+            self.app.open_files(files)
+
+    def check_socket_file(self):
         if fsutils.exists(self.socket):
             self.mw.raise_window()
             with fsutils.uopen(self.socket, 'rb') as fp:
                 lines = fp.readlines()
             fsutils.remove(self.socket)
-            [self.app.open(item.strip('\n'))
-             for item in lines
-             if fsutils.exists(item.strip('\n'))]
+            self.app.open_files([item.strip('\n') for item in lines
+                                 if fsutils.exists(item.strip('\n'))])
         if not fsutils.exists(self.lock):
             with fsutils.uopen(self.lock, 'wb') as fp:
                 fp.write('\n')
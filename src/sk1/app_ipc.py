@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Single instance IPC over Unix domain socket.
+
+Request is JSON object sent by client in one connection:
+{'action': 'open'|'import', 'files': [path, ...], 'raise': bool}
+Server replies 'OK' line after request is queued.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_NAME = 'sk1.sock'
+REPLY = 'OK\n'
+TIMEOUT = 2.0
+MAX_REQUEST = 1024 * 1024
+
+OPEN = 'open'
+IMPORT = 'import'
+ACTIONS = (OPEN, IMPORT)
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def get_socket_path(cfg_dir):
+    return os.path.join(cfg_dir, SOCKET_NAME)
+
+
+def make_request(files, action=OPEN, raise_window=True):
+    return {'action': action, 'files': files, 'raise': raise_window}
+
+
+def parse_request(data):
+    """
+    Returns validated request dict or None for malformed data.
+    """
+    try:
+        request = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(request, dict) or \
+            request.get('action', OPEN) not in ACTIONS:
+        return None
+    files = request.get('files', [])
+    if not isinstance(files, list):
+        return None
+    files = [item.encode('utf-8') if isinstance(item, unicode) else item
+             for item in files if isinstance(item, basestring)]
+    return make_request(files, request.get('action', OPEN),
+                        bool(request.get('raise', True)))
+
+
+def is_listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def recv_data(conn):
+    """
+    Reads message until client shuts down its side of connection.
+    """
+    chunks = []
+    size = 0
+    while size < MAX_REQUEST:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return ''.join(chunks)
+
+
+def call(path, message, timeout=TIMEOUT):
+    """
+    Sends JSON message and returns decoded JSON reply.
+    Raises socket.error if server is not available and ValueError
+    for malformed reply.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(message))
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(recv_data(sock))
+    finally:
+        sock.close()
+
+
+def send_request(path, request):
+    """
+    Sends request to running instance. Returns True if request
+    is accepted, False if there is no running instance.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request))
+        sock.shutdown(socket.SHUT_WR)
+        return sock.recv(len(REPLY)) == REPLY
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class IPCServer(threading.Thread):
+    """
+    Listening thread of single instance socket. Thread sleeps in
+    accept() while idle, received requests are passed to callback
+    from the listening thread.
+    """
+    path = ''
+    callback = None
+    sock = None
+
+    def __init__(self, path, callback):
+        threading.Thread.__init__(self, name='IPCServer')
+        self.daemon = True
+        self.path = path
+        self.callback = callback
+
+    def bind(self):
+        """
+        Creates listening socket. Returns False if socket path is owned
+        by another running instance.
+        """
+        if os.path.exists(self.path):
+            if send_request(self.path, make_request([], raise_window=False)):
+                return False
+            # stale socket of terminated instance
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(5)
+        return True
+
+    def stop(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+        self.sock = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def run(self):
+        while self.sock is not None:
+            try:
+                conn = self.sock.accept()[0]
+            except (socket.error, AttributeError):
+                break
+            try:
+                conn.settimeout(TIMEOUT)
+                self.process(conn)
+            except socket.error as e:
+                LOG.warn('IPC connection error %s', e)
+            finally:
+                conn.close()
+
+    def process(self, conn):
+        request = parse_request(recv_data(conn))
+        if request is None:
+            LOG.warn('Malformed IPC request is rejected')
+            return
+        self.callback(request)
+        conn.sendall(REPLY)
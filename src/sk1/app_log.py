@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Application logging pipeline.
+
+Records are put into bounded in-memory queue by QueueHandler and are
+written by LogWriter thread, so caller never waits for disk I/O.
+Log file is rotated by size and/or age, rotated files are compressed.
+"""
+
+import Queue
+import atexit
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+from uc2.utils import fsutils
+
+LOG_FORMAT = ' %(levelname)-8s | %(asctime)s | %(name)s --> %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# records over this limit are dropped until writer catches up
+QUEUE_SIZE = 10000
+# writer thread shutdown timeout, in seconds
+STOP_TIMEOUT = 2.0
+
+WRITER = None
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats record as JSON object in single line.
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, DATE_FORMAT),
+            'level': record.levelname,
+            'name': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data)
+
+
+class RotatingLogHandler(logging.FileHandler):
+    """
+    Appends records to log file. File is rotated when its size
+    exceeds max_size or when it is older than interval (both values
+    are optional), previous files are kept as gzip compressed
+    'sk1.log.1.gz' ... 'sk1.log.N.gz'.
+    """
+    max_size = 0
+    interval = 0
+    backup_count = 0
+    compress = True
+    rollover_at = 0
+
+    def __init__(self, filename, max_size=0, interval=0, backup_count=0,
+                 compress=True):
+        logging.FileHandler.__init__(self, filename, 'a')
+        self.max_size = max_size
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.rollover_at = self.get_rollover_time()
+
+    def get_rollover_time(self):
+        if not self.interval:
+            return 0
+        start = time.time()
+        # log of previous sessions is aged since its last record
+        if os.path.exists(self.baseFilename) and \
+                os.path.getsize(self.baseFilename):
+            start = min(start, os.stat(self.baseFilename).st_mtime)
+        return start + self.interval
+
+    def get_backup_name(self, index):
+        name = '%s.%d' % (self.baseFilename, index)
+        return name + '.gz' if self.compress else name
+
+    def should_rollover(self):
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        if self.max_size and self.stream is not None:
+            self.stream.seek(0, 2)
+            return self.stream.tell() >= self.max_size
+        return False
+
+    def rollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.backup_count:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = self.get_backup_name(index)
+                if os.path.exists(src):
+                    dst = self.get_backup_name(index + 1)
+                    if os.path.exists(dst):
+                        os.remove(dst)
+                    os.rename(src, dst)
+            dst = self.get_backup_name(1)
+            if os.path.exists(dst):
+                os.remove(dst)
+            if self.compress:
+                with open(self.baseFilename, 'rb') as src_fp:
+                    with gzip.open(dst, 'wb') as dst_fp:
+                        shutil.copyfileobj(src_fp, dst_fp)
+                os.remove(self.baseFilename)
+            else:
+                os.rename(self.baseFilename, dst)
+        elif os.path.exists(self.baseFilename):
+            os.remove(self.baseFilename)
+        self.stream = self._open()
+        self.rollover_at = time.time() + self.interval if self.interval else 0
+
+    def emit(self, record):
+        try:
+            if self.should_rollover():
+                self.rollover()
+        except (IOError, OSError):
+            self.handleError(record)
+        logging.FileHandler.emit(self, record)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts records into queue of log writer. Message arguments and
+    exception info are rendered in caller thread, so queued records
+    do not refer to mutable objects.
+    """
+    queue = None
+    dropped = 0
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter(threading.Thread):
+    """
+    Background thread which passes queued records to file handler.
+    """
+    queue = None
+    handler = None
+    queue_handler = None
+
+    def __init__(self, handler):
+        threading.Thread.__init__(self, name='LogWriter')
+        self.daemon = True
+        self.queue = Queue.Queue(QUEUE_SIZE)
+        self.handler = handler
+        self.queue_handler = QueueHandler(self.queue)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.write(record)
+        self.handler.close()
+
+    def write(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped:
+            self.queue_handler.dropped = 0
+            self.handler.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'msg': '%d log records are dropped' % dropped}))
+        self.handler.handle(record)
+
+    def stop(self):
+        try:
+            self.queue.put(None, True, STOP_TIMEOUT)
+        except Queue.Full:
+            return
+        self.join(STOP_TIMEOUT)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes not more than 'rate' records of logger per 'period' seconds.
+    Warnings and errors are always passed. Number of suppressed records
+    is reported with next passed one.
+    """
+    rate = 0
+    period = 1.0
+    window_start = 0.0
+    count = 0
+    suppressed = 0
+
+    def __init__(self, rate, period=1.0):
+        logging.Filter.__init__(self)
+        self.rate = rate
+        self.period = period
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+        now = time.time()
+        if now - self.window_start >= self.period:
+            self.window_start = now
+            self.count = 0
+        if self.count >= self.rate:
+            self.suppressed += 1
+            return False
+        self.count += 1
+        if self.suppressed:
+            record.msg = '%s (%d similar records are suppressed)' % \
+                         (record.getMessage(), self.suppressed)
+            record.args = None
+            self.suppressed = 0
+        return True
+
+
+def set_rate_limit(logger, rate, period=1.0):
+    """
+    Limits records rate of logger channel.
+    """
+    for item in logger.filters[:]:
+        if isinstance(item, RateLimitFilter):
+            logger.removeFilter(item)
+    logger.addFilter(RateLimitFilter(rate, period))
+
+
+def config_logging(filepath, cfg):
+    """
+    Configures root logger to write into rotated log file through
+    writer thread. Options are taken from application config.
+    """
+    global WRITER
+    stop_logging()
+    # handler errors are printed to redirected stderr, i.e. logged again
+    logging.raiseExceptions = False
+    handler = RotatingLogHandler(fsutils.get_sys_path(filepath),
+                                 cfg.log_max_size, cfg.log_rotate_interval,
+                                 cfg.log_backup_count, cfg.log_compress)
+    if cfg.log_json:
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    WRITER = LogWriter(handler)
+    WRITER.start()
+    root = logging.getLogger()
+    for item in root.handlers[:]:
+        root.removeHandler(item)
+    root.addHandler(WRITER.queue_handler)
+    root.setLevel(getattr(logging, cfg.log_level, logging.INFO))
+
+
+def reset_locks():
+    """
+    Recreates logging module and handler locks in forked process.
+    Locks held by other threads of parent at fork time are never
+    released in child.
+    """
+    logging._lock = threading.RLock()
+    for ref in logging._handlerList[:]:
+        handler = ref()
+        if handler is not None:
+            handler.createLock()
+
+
+def config_worker_logging():
+    """
+    Configures logging of forked worker process. Writer thread is not
+    inherited by fork, so inherited queue handler is replaced by plain
+    handler which appends records to log file directly.
+    """
+    global WRITER
+    reset_locks()
+    root = logging.getLogger()
+    for item in root.handlers[:]:
+        root.removeHandler(item)
+    if WRITER is None:
+        root.addHandler(logging.StreamHandler(sys.__stderr__))
+        return
+    handler = logging.FileHandler(WRITER.handler.baseFilename, 'a')
+    handler.setFormatter(WRITER.handler.formatter)
+    root.addHandler(handler)
+    WRITER = None
+
+
+def stop_logging():
+    """
+    Writes queued records and closes log file.
+    """
+    global WRITER
+    if WRITER is None:
+        return
+    logging.getLogger().removeHandler(WRITER.queue_handler)
+    WRITER.stop()
+    WRITER = None
+
+
+# writer is daemon thread, queued records are written on exit
+atexit.register(stop_logging)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Process pool which detects lost tasks.
+
+multiprocessing.Pool replaces terminated worker process, but task
+executed by that worker is never finished. Each task reports its key
+and worker pid to parent process when it is started, so task of dead
+worker is known as lost.
+"""
+
+import errno
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing.queues import SimpleQueue
+
+from sk1 import app_log
+
+LOG = logging.getLogger(__name__)
+
+# time to get result of task which worker is dead, in seconds
+LOST_DELAY = 0.5
+
+# queue of started tasks in worker process
+STARTED = None
+
+
+def init_worker(started, initializer, initargs):
+    global STARTED
+    STARTED = started
+    app_log.config_worker_logging()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def run_task(key, func, args):
+    STARTED.put((key, os.getpid()))
+    return func(*args)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class WorkerPool(object):
+    """
+    Wraps multiprocessing.Pool. Tasks of terminated worker processes
+    are reported as lost, all pending tasks are lost if no task is
+    finished till timeout.
+    """
+    pool = None
+    started = None
+    tasks = None
+    pids = None
+    count = 0
+    timeout = 0.0
+    deadline = 0.0
+    expired = False
+
+    def __init__(self, processes=None, initializer=None, initargs=(),
+                 timeout=0.0):
+        self.started = SimpleQueue()
+        self.tasks = {}
+        self.pids = {}
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.pool = multiprocessing.Pool(
+            processes, init_worker, (self.started, initializer, initargs))
+
+    def destroy(self):
+        self.terminate()
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def submit(self, func, args=(), callback=None):
+        """
+        Submits func(*args) task, returns task key.
+        """
+        key = self.count
+        self.count += 1
+        self.tasks[key] = self.pool.apply_async(run_task, (key, func, args),
+                                                callback=callback)
+        return key
+
+    def close(self):
+        self.pool.close()
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def check(self):
+        """
+        Returns keys of lost tasks, reported tasks are not checked
+        anymore. Expired flag is set if tasks are lost by timeout.
+        """
+        while not self.started.empty():
+            key, pid = self.started.get()
+            self.pids[key] = pid
+        finished = [key for key, result in self.tasks.items()
+                    if result.ready()]
+        for key in finished:
+            self.forget(key)
+        if finished or not self.tasks:
+            self.deadline = time.time() + self.timeout
+        if time.time() > self.deadline:
+            LOG.error('No task is finished in %s sec', self.timeout)
+            self.expired = True
+            lost = self.tasks.keys()
+        else:
+            lost = [key for key in self.tasks
+                    if key in self.pids and not is_alive(self.pids[key])]
+            for key in lost[:]:
+                # result can be sent just before worker is terminated
+                self.tasks[key].wait(LOST_DELAY)
+                if self.tasks[key].ready():
+                    lost.remove(key)
+            if lost:
+                LOG.error('Worker process of %d task(s) is terminated',
+                          len(lost))
+        for key in lost:
+            self.forget(key)
+        return lost
+
+    def forget(self, key):
+        self.tasks.pop(key, None)
+        self.pids.pop(key, None)
@@ -22,24 +22,27 @@ LOG = logging.getLogger(__name__)
 
 
 class StreamLogger:
-    msg = ''
+    msg = None
     counter = 0
 
     def __init__(self):
         self.logger = LOG.critical
+        # fragments are joined once on logging
+        self.msg = []
 
     def write(self, msg):
         msg = fsutils.get_utf8_path(msg)
         if not msg.endswith('\n') and not msg.startswith(' '):
             if self.counter < 2:
-                self.msg += msg
+                self.msg.append(msg)
                 self.counter += 1
             else:
-                self.logger(self.msg + msg)
-                self.msg = ''
+                self.msg.append(msg)
+                self.logger(''.join(self.msg))
+                self.msg = []
                 self.counter = 0
         else:
-            self.msg += msg
+            self.msg.append(msg)
 
     def close(self):
         pass
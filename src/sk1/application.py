@@ -24,7 +24,7 @@ from base64 import b64decode
 import uc2.events
 import wal
 from sk1 import _, config, events, modes, dialogs, appconst
-from sk1 import app_plugins, app_actions
+from sk1 import app_log, app_plugins, app_actions
 from sk1.app_cms import AppColorManager
 from sk1.app_conf import AppData
 from sk1.app_fsw import AppFileWatcher
@@ -34,6 +34,8 @@ from sk1.app_palettes import AppPaletteManager
 from sk1.app_proxy import AppProxy
 from sk1.app_stdout import StreamLogger
 from sk1.clipboard import AppClipboard
+from sk1.document import journal
+from sk1.document.asyncload import BatchLoader, LoadingCancelled
 from sk1.document.presenter import SK1Presenter
 from sk1.parts.artprovider import create_artprovider
 from sk1.parts.mw import AppMainWindow
@@ -42,9 +44,11 @@ from uc2 import uc2const, libimg, msgconst
 from uc2.application import UCApplication
 from uc2.formats import get_saver_by_id, get_loader
 from uc2.utils import fsutils
-from uc2.utils import mixutils
 
 LOG = logging.getLogger(__name__)
+# chatty event channels are logged with rate limit
+STATUS_LOG = logging.getLogger('sk1.status')
+MESSAGES_LOG = logging.getLogger('uc2.messages')
 
 
 class SK1Application(wal.Application, UCApplication):
@@ -81,9 +85,10 @@ class SK1Application(wal.Application, UCApplication):
             sys.exit()
 
         self.appdata = AppData(self, cfgdir)
-        log_level = config.log_level
         self.log_filepath = os.path.join(self.appdata.app_config_dir, 'sk1.log')
-        mixutils.config_logging(fsutils.get_sys_path(self.log_filepath), log_level)
+        app_log.config_logging(self.log_filepath, config)
+        app_log.set_rate_limit(STATUS_LOG, config.log_status_rate)
+        app_log.set_rate_limit(MESSAGES_LOG, config.log_status_rate)
         sys.stderr = StreamLogger()
         LOG.info('Logging started')
 
@@ -149,8 +154,49 @@ class SK1Application(wal.Application, UCApplication):
             if not wal.IS_WX2:
                 events.emit(events.NO_DOCS)
         self.update_actions()
-        for item in docs:
-            self.open(item)
+        self.open_files(docs)
+        self.recover_documents()
+
+    def recover_documents(self):
+        recovered = []
+        for path in journal.get_orphan_journals(self.appdata.app_journal_dir):
+            try:
+                meta, data, transactions = journal.read_journal(path)
+                if data:
+                    recovered.append((path, meta, data, transactions))
+                    continue
+            except Exception as e:
+                LOG.warn('Cannot read journal <%s> %s', path, e)
+            fsutils.remove(path)
+        if not recovered:
+            return
+        msg = _('sK1 was terminated unexpectedly.') + '\n'
+        msg += _('Do you want to recover %d unsaved document(s)?') % \
+            len(recovered)
+        if not dialogs.yesno_dialog(self.mw, self.appdata.app_name, msg):
+            [fsutils.remove(item[0]) for item in recovered]
+            return
+        doc_file = os.path.join(self.appdata.app_temp_dir, 'recovered.sk2')
+        for path, meta, data, transactions in recovered:
+            try:
+                lost = journal.restore_document(self.appdata, data,
+                                                transactions, doc_file)
+                doc = SK1Presenter(self, doc_file, template=True)
+            except Exception as e:
+                LOG.error('Cannot recover document from <%s> %s',
+                          path, e, exc_info=True)
+                continue
+            finally:
+                if fsutils.exists(doc_file):
+                    fsutils.remove(doc_file)
+            self.docs.append(doc)
+            self.set_current_doc(doc)
+            doc.modified()
+            if doc.journal:
+                doc.journal.checkpoint()
+            fsutils.remove(path)
+            LOG.info('Document <%s> is recovered, %d last changes are lost',
+                     meta.get('doc_name', ''), lost)
 
     def update_config(self):
         config.resource_dir = ''
@@ -178,6 +224,7 @@ class SK1Application(wal.Application, UCApplication):
             self.fsw.destroy()
             wal.Application.exit(self)
             LOG.info('Application terminated')
+            app_log.stop_logging()
             return True
         return False
 
@@ -227,6 +274,9 @@ class SK1Application(wal.Application, UCApplication):
             try:
                 doc = SK1Presenter(self, doc_file, silent)
 
+            except LoadingCancelled:
+                events.emit(events.APP_STATUS, _('Opening is cancelled'))
+                return
             except RuntimeError:
                 msg = _('Cannot open file:')
                 msg = "%s\n'%s'" % (msg, doc_file) + '\n'
@@ -251,6 +301,40 @@ class SK1Application(wal.Application, UCApplication):
             self.set_current_doc(doc)
             events.emit(events.APP_STATUS, _('Document opened'))
 
+    def open_files(self, doc_files):
+        """
+        Opens list of files. Several files are loaded concurrently
+        with single progress dialog.
+        """
+        doc_files = [item for item in doc_files if fsutils.isfile(item)]
+        if len(doc_files) < 2 or not config.async_loading:
+            [self.open(item) for item in doc_files]
+            return
+        batch = BatchLoader(self.appdata, doc_files)
+        pd = dialogs.ProgressDialog(_('Opening files...'), self.mw,
+                                    cancelable=True)
+        try:
+            pd.run(batch.load, [pd, self.attach_document])
+        except LoadingCancelled:
+            events.emit(events.APP_STATUS, _('Opening is cancelled'))
+        finally:
+            pd.destroy()
+        if batch.errors:
+            msg = _('Cannot open files:') + '\n'
+            msg += '\n'.join(batch.errors) + '\n'
+            msg += _('Details see in application logs.')
+            dialogs.error_dialog(self.mw, self.appdata.app_name, msg)
+        batch.destroy()
+
+    def attach_document(self, doc_presenter):
+        doc_file = doc_presenter.doc_file
+        doc = SK1Presenter(self, doc_file, doc_presenter=doc_presenter)
+        self.docs.append(doc)
+        config.open_dir = str(os.path.dirname(doc_file))
+        self.history.add_entry(doc_file)
+        self.set_current_doc(doc)
+        events.emit(events.APP_STATUS, _('Document opened'))
+
     def save(self, doc=None):
         doc = doc or self.current_doc
         if not doc.doc_file:
@@ -606,18 +690,18 @@ class SK1Application(wal.Application, UCApplication):
     @staticmethod
     def uc2_event_logging(*args):
         log_map = {
-            msgconst.JOB: LOG.info,
-            msgconst.INFO: LOG.info,
-            msgconst.OK: LOG.info,
-            msgconst.WARNING: LOG.warn,
-            msgconst.ERROR: LOG.error,
-            msgconst.STOP: LOG.critical,
+            msgconst.JOB: MESSAGES_LOG.info,
+            msgconst.INFO: MESSAGES_LOG.info,
+            msgconst.OK: MESSAGES_LOG.info,
+            msgconst.WARNING: MESSAGES_LOG.warn,
+            msgconst.ERROR: MESSAGES_LOG.error,
+            msgconst.STOP: MESSAGES_LOG.critical,
         }
         log_map[args[0]](args[1])
 
     @staticmethod
     def sk1_event_logging(msg):
-        LOG.info(msg)
+        STATUS_LOG.info(msg)
 
     @staticmethod
     def open_url(url):
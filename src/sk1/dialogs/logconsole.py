@@ -15,12 +15,14 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import datetime
 import os
 import wal
 
 from sk1 import _, config, appconst
 from sk1.dialogs import filedlgs
+from sk1.dialogs.logindex import LEVELS, NO_LEVEL, LogIndex
 from sk1.resources import icons
 from uc2 import uc2const
 from uc2.utils import fsutils
@@ -40,27 +42,152 @@ COLOR_MAP = {
     'INFO': LIGHT,
     'DEBUG': DARK,
 }
+LEVEL_COLORS = [DARK] + [COLOR_MAP[name] for name in LEVELS]
 
 FG_COLOR = LIGHT
 BG_COLOR = (43, 43, 43)
 LEFT_PANEL = (49, 51, 53)
 SEP = (85, 85, 85)
+MATCH_BG = (60, 63, 65)
+CURRENT_BG = (50, 89, 61)
+
+# vertical padding and left margin of log rows
+ROW_PADDING = 1
+TEXT_X = 5
+# indexing, search and log following interval, in ms
+UPDATE_DELAY = 100
+# log file is checked for new records each FOLLOW_TICKS timer tick
+FOLLOW_TICKS = 10
+
+
+class LogViewer(wal.ScrolledCanvas, wal.SensitiveDrawableWidget):
+    """
+    Virtual list of log lines. Only visible rows are read from
+    log index and painted. Rows are all indexed lines or lines
+    of filtered view.
+    """
+    index = None
+    view = None
+    level = NO_LEVEL
+    matches = None
+    current = None
+    zoom = 0
+    row_height = 16
+    sb_width = 1
+
+    def __init__(self, parent, zoom=0):
+        self.zoom = zoom
+        self.matches = set()
+        wal.ScrolledCanvas.__init__(self, parent)
+        wal.SensitiveDrawableWidget.__init__(self, True)
+        sb = wal.ScrollBar(self)
+        self.sb_width = sb.get_size()[0]
+        sb.destroy()
+        self.set_bg(BG_COLOR)
+
+    def set_index(self, index):
+        self.index = index
+        self.matches = set()
+        self.current = None
+        self.set_level(self.level)
+
+    def set_level(self, level):
+        self.level = level
+        self.view = self.index.get_view(level) if self.index else None
+        self.refresh()
+
+    def is_visible(self, line):
+        return self.view is None or self.index.get_level(line) >= self.level
+
+    def get_count(self):
+        if self.index is None:
+            return 0
+        return self.index.get_count() if self.view is None else len(self.view)
+
+    def get_line(self, row):
+        return row if self.view is None else self.view[row]
+
+    def get_row(self, line):
+        return line if self.view is None else \
+            bisect.bisect_left(self.view, line)
+
+    def get_row_range(self):
+        h = self.get_size()[1]
+        first = max(int(self.win_to_doc(0, 0)[1] // self.row_height), 0)
+        last = min(first + h // self.row_height + 2, self.get_count())
+        return first, last
+
+    def is_at_end(self):
+        h = self.get_size()[1]
+        first = self.get_row_range()[0]
+        return first + h // self.row_height >= self.get_count()
+
+    def scroll_to_row(self, row):
+        h = self.get_size()[1]
+        first, last = self.get_row_range()
+        if not first <= row < first + h // self.row_height:
+            self.Scroll(0, max(row - h // self.row_height // 2, 0))
+        self.refresh()
+
+    def scroll_to_end(self):
+        self.Scroll(0, self.get_count())
+
+    def set_zoom(self, zoom):
+        self.zoom = zoom
+        self.refresh()
+
+    def mouse_move(self, point):
+        self.set_tooltip()
+        row = int(self.win_to_doc(*point)[1] // self.row_height)
+        if 0 <= row < self.get_count():
+            self.set_tooltip(self.index.get_line(self.get_line(row)))
+
+    def _mouse_wheel(self, event):
+        event.Skip()
+
+    def paint(self):
+        w = self.get_size()[0]
+        self.row_height = self.set_font(False, self.zoom) + 2 * ROW_PADDING
+        count = self.get_count()
+        self.set_virtual_size((max(w - self.sb_width, 1),
+                               count * self.row_height))
+        self.set_scroll_rate(1, self.row_height)
+        self.prepare_dc(self.pdc)
+        if not count:
+            return
+        first, last = self.get_row_range()
+        index = self.index
+        self.set_stroke()
+        for row in xrange(first, last):
+            line = self.get_line(row)
+            y = row * self.row_height
+            if line in self.matches:
+                self.set_fill(CURRENT_BG if line == self.current
+                              else MATCH_BG)
+                self.draw_rect(0, y, w, self.row_height)
+            self.set_text_color(LEVEL_COLORS[index.get_level(line)])
+            self.draw_text(index.get_line(line), TEXT_X, y + ROW_PADDING)
 
 
 class ConsoleDialog(wal.SimpleDialog):
     presenter = None
-    entry = None
+    viewer = None
     lpanel = None
     log_path = None
     zoom = 0
     toolbar = None
-    logs = []
+    index = None
+    search = None
+    search_text = ''
+    match_lines = None
+    timer = None
+    ticks = 0
 
     def __init__(self, parent, title):
         self.app = parent.app
         self.title = title
         self.zoom = config.console_dlg_zoom
-        self.logs = []
+        self.match_lines = []
         size = config.console_dlg_size
         wal.SimpleDialog.__init__(self, parent, title, size,
                                   style=wal.VERTICAL, resizable=True,
@@ -77,20 +204,20 @@ class ConsoleDialog(wal.SimpleDialog):
         self.lpanel.pack((26, 26))
         hpanel.pack(self.lpanel, fill=True)
         hpanel.pack(wal.PLine(hpanel, SEP), fill=True)
-        self.entry = wal.Entry(hpanel, '', multiline=True, editable=False,
-                               richtext=True, no_border=True)
-        self.entry.set_bg(BG_COLOR)
-        hpanel.pack(self.entry, fill=True, expand=True)
+        self.viewer = LogViewer(hpanel, self.zoom)
+        hpanel.pack(self.viewer, fill=True, expand=True)
+        self.timer = wal.CanvasTimer(self.viewer, delay=UPDATE_DELAY,
+                                     on_timer=self.on_timer)
         self.log_path = os.path.join(self.app.appdata.app_config_dir, 'sk1.log')
         self.load_logs(self.log_path)
 
     def zoom_in(self):
         self.zoom = self.zoom + 1 if self.zoom < 7 else self.zoom
-        self.parse_logs()
+        self.viewer.set_zoom(self.zoom)
 
     def zoom_out(self):
         self.zoom = self.zoom - 1 if self.zoom > -3 else self.zoom
-        self.parse_logs()
+        self.viewer.set_zoom(self.zoom)
 
     def change_title(self, log_path):
         self.log_path = log_path
@@ -99,35 +226,96 @@ class ConsoleDialog(wal.SimpleDialog):
     def load_logs(self, log_path):
         if not fsutils.exists(log_path):
             return
-        fileptr = fsutils.get_fileptr(log_path)
-        self.logs = []
-        while True:
-            line = fileptr.readline()
-            if not line:
-                break
-            self.logs.append(line)
-        self.parse_logs()
+        self.close_index()
+        self.index = LogIndex(log_path)
+        self.index.index_chunk()
+        self.viewer.set_index(self.index)
+        self.viewer.scroll_to_end()
         self.change_title(log_path)
+        if not self.timer.is_running():
+            self.timer.start()
 
-    def parse_logs(self):
-        self.entry.clear()
-        self.entry.set_monospace(self.zoom)
-        for line in self.logs:
-            color = COLOR_MAP.get(line[:9].strip(), None)
-            if not color:
-                for item in COLOR_MAP:
-                    if item in line:
-                        color = COLOR_MAP[item]
-                        break
-            color = color or DARK
-            self.entry.set_text_colors(color)
-            self.entry.append(line)
+    def close_index(self):
+        self.stop_search()
+        if self.index is not None:
+            self.index.destroy()
+            self.index = None
+
+    def on_timer(self):
+        self.ticks += 1
+        if self.index is None:
+            return
+        if not self.ticks % FOLLOW_TICKS and self.index.update():
+            # log is rotated or truncated
+            self.stop_search()
+            self.viewer.set_index(self.index)
+        viewer = self.viewer
+        following = viewer.is_at_end()
+        if self.index.index_chunk():
+            if following:
+                viewer.scroll_to_end()
+            viewer.refresh()
+        self.check_search()
+
+    def change_level(self):
+        self.viewer.set_level(self.toolbar.level.get_active())
+
+    def stop_search(self):
+        if self.search is not None:
+            self.search.cancel()
+            self.search = None
+        self.search_text = ''
+        self.match_lines = []
+        self.viewer.matches = set()
+        self.viewer.current = None
+
+    def find(self):
+        text = self.toolbar.search.get_value()
+        if text and text == self.search_text:
+            self.find_next()
+            return
+        self.stop_search()
+        self.viewer.refresh()
+        if text and self.index is not None:
+            self.search_text = text
+            self.search = self.index.search(text)
+
+    def check_search(self):
+        if self.search is None:
+            return
+        lines, finished = self.search.get_results()
+        if finished:
+            self.search = None
+        if lines:
+            self.match_lines += lines
+            self.viewer.matches.update(lines)
+            if self.viewer.current is None:
+                self.find_next()
+            else:
+                self.viewer.refresh()
+
+    def find_next(self):
+        """
+        Selects next search match of current view.
+        """
+        viewer = self.viewer
+        lines = self.match_lines
+        if not lines:
+            return
+        current = -1 if viewer.current is None else viewer.current
+        start = bisect.bisect_right(lines, current)
+        for line in lines[start:] + lines[:start]:
+            if viewer.is_visible(line):
+                viewer.current = line
+                viewer.scroll_to_row(viewer.get_row(line))
+                return
 
     def write_log(self, log_path):
+        if self.index is None:
+            return
         fileptr = fsutils.get_fileptr(log_path, True)
-        fileptr.write(self.entry.get_value())
+        self.index.write(fileptr, self.viewer.view)
         fileptr.close()
-        self.change_title(log_path)
 
     def open_log(self):
         log_file = filedlgs.get_open_file_name(self, config.log_dir,
@@ -153,10 +341,14 @@ class ConsoleDialog(wal.SimpleDialog):
             h = max(h - 28, config.console_dlg_minsize[1])
         config.console_dlg_size = (w, h)
         config.console_dlg_zoom = self.zoom
+        self.timer.stop()
+        self.close_index()
         self.destroy()
 
 
 class ConsoleToolbar(wal.HPanel):
+    level = None
+    search = None
 
     def __init__(self, parent, dlg):
         self.dlg = dlg
@@ -183,6 +375,15 @@ class ConsoleToolbar(wal.HPanel):
             else:
                 self.pack((5, 5), expand=True)
 
+        self.pack((5, 5), expand=True)
+        self.level = wal.Combolist(self, items=[_('All levels')] + LEVELS,
+                                   onchange=self.dlg.change_level)
+        self.level.set_active(NO_LEVEL)
+        self.pack(self.level, padding=5)
+        self.search = wal.Entry(self, '', width=25, onenter=self.dlg.find)
+        self.search.set_tooltip(_('Find text (Enter for next match)'))
+        self.pack(self.search, padding=5)
+
 
 def logconsole_dlg(parent, title='Logs'):
     dlg = ConsoleDialog(parent, title)
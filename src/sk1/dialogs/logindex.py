@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import Queue
+import bisect
+import logging
+import mmap
+import os
+import re
+import threading
+from array import array
+
+from uc2.utils import fsutils
+
+LOG = logging.getLogger(__name__)
+
+NO_LEVEL = 0
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+LEVEL_CODES = dict((name, code + 1) for code, name in enumerate(LEVELS))
+
+# log records start with level name field
+LEVEL_FIELD = 9
+# level of JSON formatted record
+JSON_LEVEL = re.compile(r'"level": "([A-Z]+)"')
+# bytes indexed per call of index_chunk()
+INDEX_CHUNK = 4 * 1024 * 1024
+# search results are passed to UI thread by such portions
+SEARCH_BATCH = 1000
+COPY_CHUNK = 1024 * 1024
+
+
+class LogIndex(object):
+    """
+    Line index of memory mapped log file. Index stores end offset
+    and level code of each line, plus filtered views, i.e. line numbers
+    of each level and higher ones. Views are appended along with
+    the index, so level filtering costs nothing. Lines are indexed
+    by portions, so large files are indexed without UI freezing,
+    and appended records are indexed on update(). Incomplete last
+    line is indexed when it is finished.
+    """
+    path = ''
+    fileptr = None
+    mm = None
+    mapped = 0
+    size = 0
+    ends = None
+    levels = None
+    views = None
+    last_level = NO_LEVEL
+    generation = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.open()
+
+    def destroy(self):
+        self.close()
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def open(self):
+        self.fileptr = fsutils.get_fileptr(self.path)
+        self.mm = None
+        self.mapped = self.size = 0
+        self.ends = array('l')
+        self.levels = bytearray()
+        self.views = dict((code, array('l'))
+                          for code in range(1, len(LEVELS) + 1))
+        self.last_level = NO_LEVEL
+        self.generation += 1
+        self.remap()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fileptr is not None:
+            self.fileptr.close()
+            self.fileptr = None
+
+    def remap(self):
+        size = os.fstat(self.fileptr.fileno()).st_size
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        # empty file cannot be mapped
+        if size:
+            self.mm = mmap.mmap(self.fileptr.fileno(), size,
+                                access=mmap.ACCESS_READ)
+        self.mapped = size
+
+    def is_replaced(self):
+        """
+        Checks whether log file is truncated or replaced
+        by rotation.
+        """
+        try:
+            stat = os.stat(fsutils.get_sys_path(self.path))
+        except OSError:
+            return False
+        current = os.fstat(self.fileptr.fileno())
+        return stat.st_ino != current.st_ino or \
+            current.st_size < self.mapped
+
+    def update(self):
+        """
+        Follows log file. Returns True if index is reset.
+        """
+        if self.is_replaced():
+            self.close()
+            self.open()
+            return True
+        if os.fstat(self.fileptr.fileno()).st_size > self.mapped:
+            self.remap()
+        return False
+
+    def is_indexed(self):
+        return self.mm is None or self.mm.find('\n', self.size) < 0
+
+    def index_chunk(self, limit=INDEX_CHUNK):
+        """
+        Indexes next portion of mapped data. Returns number
+        of indexed lines.
+        """
+        if self.mm is None:
+            return 0
+        mm = self.mm
+        ends = self.ends
+        levels = self.levels
+        views = self.views
+        level = self.last_level
+        pos = self.size
+        end = min(pos + limit, self.mapped)
+        count = len(ends)
+        while pos < end:
+            line_end = mm.find('\n', pos)
+            if line_end < 0:
+                break
+            # continuation lines (tracebacks) inherit record level
+            if mm[pos] == '{':
+                match = JSON_LEVEL.search(mm[pos:line_end])
+                if match:
+                    level = LEVEL_CODES.get(match.group(1), level)
+            else:
+                level = LEVEL_CODES.get(mm[pos:pos + LEVEL_FIELD].strip(),
+                                        level)
+            for code in xrange(1, level + 1):
+                views[code].append(len(ends))
+            ends.append(line_end + 1)
+            levels.append(level)
+            pos = line_end + 1
+        self.size = pos
+        self.last_level = level
+        return len(ends) - count
+
+    def get_count(self):
+        return len(self.ends)
+
+    def get_line(self, index):
+        start = self.ends[index - 1] if index else 0
+        line = self.mm[start:self.ends[index]].rstrip('\r\n')
+        return line.decode('utf-8', 'replace')
+
+    def get_level(self, index):
+        return self.levels[index]
+
+    def get_view(self, level):
+        """
+        Returns sorted array of line numbers which level is not
+        lower than provided one or None for all lines. Array is
+        extended by indexing, so it should not be modified by caller.
+        """
+        if level <= NO_LEVEL:
+            return None
+        return self.views[level]
+
+    def write(self, fileptr, view=None):
+        if self.mm is None:
+            return
+        if view is None:
+            for pos in range(0, self.size, COPY_CHUNK):
+                fileptr.write(self.mm[pos:min(pos + COPY_CHUNK, self.size)])
+            return
+        ends = self.ends
+        for index in view:
+            fileptr.write(self.mm[ends[index - 1] if index else 0:ends[index]])
+
+    def search(self, text):
+        """
+        Starts search of text in indexed lines.
+        Returns LogSearch thread.
+        """
+        search = LogSearch(self, text)
+        search.start()
+        return search
+
+
+class LogSearch(threading.Thread):
+    """
+    Searches text in log file by separate thread. Thread maps
+    indexed part of file by duplicated descriptor, so index can be
+    remapped or reopened meanwhile. Matched line numbers are put
+    into results queue by portions, None means that search is
+    finished.
+    """
+    fd = None
+    text = ''
+    size = 0
+    ends = None
+    generation = 0
+    results = None
+    cancelled = False
+
+    def __init__(self, index, text):
+        threading.Thread.__init__(self, name='LogSearch')
+        self.daemon = True
+        self.fd = os.dup(index.fileptr.fileno())
+        self.text = text.encode('utf-8') if isinstance(text, unicode) else text
+        self.size = index.size
+        # index arrays are append-only, reset index has new ones
+        self.ends = index.ends
+        self.generation = index.generation
+        self.results = Queue.Queue()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def get_results(self):
+        """
+        Returns (list of line numbers, finished flag).
+        """
+        lines = []
+        finished = False
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except Queue.Empty:
+                break
+            if item is None:
+                finished = True
+                break
+            lines += item
+        return lines, finished
+
+    def run(self):
+        try:
+            if self.text and self.size:
+                self.find()
+        except Exception as e:
+            LOG.error('Log search failed %s', e)
+        finally:
+            os.close(self.fd)
+        self.results.put(None)
+
+    def find(self):
+        ends = self.ends
+        batch = []
+        mm = mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ)
+        try:
+            pos = mm.find(self.text)
+            while pos >= 0 and not self.cancelled:
+                index = bisect.bisect_right(ends, pos)
+                batch.append(index)
+                if len(batch) == SEARCH_BATCH:
+                    self.results.put(batch)
+                    batch = []
+                pos = mm.find(self.text, ends[index])
+        finally:
+            mm.close()
+        if batch:
+            self.results.put(batch)
@@ -17,18 +17,33 @@
 
 
 import wal
+from sk1 import _
 from uc2 import events
 
 
 class ProgressDialog(wal.CustomProgressDialog):
-    def __init__(self, title, parent):
+    cancelable = False
+    cancelled = False
+
+    def __init__(self, title, parent, cancelable=False):
+        self.cancelable = cancelable
         wal.CustomProgressDialog.__init__(self, parent, title)
 
+    def build(self):
+        wal.CustomProgressDialog.build(self)
+        if self.cancelable:
+            self.panel.pack(wal.Button(self.panel, _('Cancel'),
+                                       onclick=self.cancel), padding=5)
+
+    def cancel(self):
+        self.cancelled = True
+
     def run(self, callback, args):
         events.connect(events.FILTER_INFO, self.listener)
-        result = wal.CustomProgressDialog.run(self, callback, args)
-        events.disconnect(events.FILTER_INFO, self.listener)
-        return result
+        try:
+            return wal.CustomProgressDialog.run(self, callback, args)
+        finally:
+            events.disconnect(events.FILTER_INFO, self.listener)
 
     def listener(self, *args):
         self.update_data(int(round(args[1] * 100.0)), args[0])
@@ -16,12 +16,37 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import math
+import sys
+import time
 from copy import deepcopy
 
 from uc2 import libgeom, uc2const, libimg, sk2const
 from uc2.formats.sk2 import sk2_model
 
 from sk1 import events, config, modes
+from sk1.document.geometry import get_visual_bbox
+
+CONTAINERS = (list, tuple, dict, set)
+
+
+def get_history_size(item, seen=None):
+    """
+    Returns estimated memory size of history record in bytes.
+    Containers are counted recursively, document objects and other
+    instances are counted shallowly as they are shared with document.
+    """
+    seen = set() if seen is None else seen
+    if id(item) in seen:
+        return 0
+    seen.add(id(item))
+    size = sys.getsizeof(item)
+    if isinstance(item, dict):
+        for key, value in item.items():
+            size += get_history_size(key, seen) + get_history_size(value, seen)
+    elif isinstance(item, CONTAINERS):
+        for value in item:
+            size += get_history_size(value, seen)
+    return size
 
 
 class AbstractAPI:
@@ -34,15 +59,78 @@ class AbstractAPI:
     undo = []
     redo = []
     undo_marked = False
+    history_size = 0
+    history_sizes = {}
+    last_move = None
+    last_text = None
     selection = None
     callback = None
     sk2_cfg = None
+    damage = []
+    damage_full = False
 
     def __init__(self):
         pass
 
+    def _add_damage(self, objs):
+        for obj in objs:
+            self.damage.append((obj, get_visual_bbox(obj)))
+        self._objs_changed(objs)
+
+    def _add_full_damage(self):
+        self.damage_full = True
+        self._doc_changed()
+        if self.presenter.journal:
+            self.presenter.journal.invalidate()
+
+    def _add_layers_damage(self, layers):
+        # childs lists of layers are replaced
+        self.damage_full = True
+        self._doc_changed()
+        if self.presenter.journal:
+            self.presenter.journal.update_layers(layers)
+
+    def _objs_changed(self, objs):
+        self.presenter.spatial.update(objs)
+        self.presenter.stats.update(objs)
+        self.presenter.snap.update_objects(objs)
+        if self.presenter.journal:
+            self.presenter.journal.update(objs)
+
+    def _doc_changed(self):
+        self.presenter.spatial.invalidate()
+        self.presenter.stats.invalidate()
+        self.presenter.snap.invalidate_objects()
+
+    def _check_damage(self, actions):
+        # Only API helpers (underscore methods) report damage,
+        # other callables change document in unknown way
+        for action in actions:
+            name = getattr(action[0], '__name__', '') if action else '_'
+            if not name.startswith('_'):
+                self._add_full_damage()
+                return
+
+    def pop_damage(self):
+        """
+        Returns list of (object, visual bbox) pairs collected since
+        previous call. Both old and new object bboxes are reported.
+        None means that changes are not localized and whole
+        document view should be repainted.
+        """
+        damage = None if self.damage_full else self.damage
+        self.damage = []
+        self.damage_full = False
+        if not damage:
+            # document is changed without damage tracking
+            self._doc_changed()
+        return damage or None
+
     def do_undo(self):
         transaction_list = self.undo[-1][0]
+        self.last_move = None
+        self.last_text = None
+        self._check_damage(transaction_list)
         for transaction in transaction_list:
             self._do_action(transaction)
         tr = self.undo[-1]
@@ -56,6 +144,9 @@ class AbstractAPI:
 
     def do_redo(self):
         action_list = self.redo[-1][1]
+        self.last_move = None
+        self.last_text = None
+        self._check_damage(action_list)
         for action in action_list:
             self._do_action(action)
         tr = self.redo[-1]
@@ -75,13 +166,115 @@ class AbstractAPI:
 
     def _clear_history_stack(self, stack):
         for obj in stack:
+            self.history_size -= self.history_sizes.pop(id(obj), 0)
             if isinstance(obj, list):
                 self._clear_history_stack(obj)
         return []
 
+    def _compact_transaction(self, transaction):
+        undo_list, redo_list = transaction[:2]
+        self._compact_layers(undo_list, redo_list)
+        self._compact_styles(undo_list, redo_list)
+        self._compact_paths(undo_list, redo_list)
+
+    def _compact_layers(self, undo_list, redo_list):
+        # replaces pair of layers snapshots by delta of changed childs
+        undo_items = [item for item in undo_list
+                      if item and item[0] == self._set_layers_snapshot]
+        redo_items = [item for item in redo_list
+                      if item and item[0] == self._set_layers_snapshot]
+        if not len(undo_items) == len(redo_items) == 1:
+            return
+        delta = self._get_layers_delta(undo_items[0][1], redo_items[0][1])
+        if delta is None:
+            return
+        undo_list[undo_list.index(undo_items[0])] = \
+            [self._set_layers_delta, delta, True]
+        redo_list[redo_list.index(redo_items[0])] = \
+            [self._set_layers_delta, delta, False]
+
+    def _compact_styles(self, undo_list, redo_list):
+        # drops records of unchanged objects, equal values are stored once
+        undo_items = [item for item in undo_list
+                      if item and item[0] == self._set_objs_styles]
+        redo_items = [item for item in redo_list
+                      if item and item[0] == self._set_objs_styles]
+        if len(undo_items) == len(redo_items) == 1:
+            pairs = zip(undo_items[0][1], redo_items[0][1])
+            if len(undo_items[0][1]) == len(redo_items[0][1]) and \
+                    all(old[0] is new[0] for old, new in pairs):
+                pairs = [pair for pair in pairs
+                         if not pair[0][1:] == pair[1][1:]]
+                undo_items[0][1] = [old for old, new in pairs]
+                redo_items[0][1] = [new for old, new in pairs]
+        values = {}
+        for item in undo_items + redo_items:
+            for record in item[1]:
+                for index in range(1, len(record)):
+                    key = repr(record[index])
+                    record[index] = values.setdefault(key, record[index])
+
+    def _compact_paths(self, undo_list, redo_list):
+        # unchanged subpaths of previous paths refer to current ones
+        current = {}
+        for item in redo_list:
+            if not item:
+                continue
+            if item[0] in (self._set_paths, self._set_paths_and_trafo):
+                current[id(item[1])] = item[2]
+            elif item[0] == self._set_paths_trafo_snapshots:
+                for snapshot in item[1]:
+                    current[id(snapshot[0])] = snapshot[1]
+        if not current:
+            return
+        for item in undo_list:
+            if not item:
+                continue
+            if item[0] in (self._set_paths, self._set_paths_and_trafo):
+                item[2] = self._share_paths(item[2], current.get(id(item[1])))
+            elif item[0] == self._set_paths_trafo_snapshots:
+                snapshots = []
+                for obj, paths, trafo in item[1]:
+                    paths = self._share_paths(paths, current.get(id(obj)))
+                    snapshots.append((obj, paths, trafo))
+                item[1] = snapshots
+
+    @staticmethod
+    def _share_paths(paths, current):
+        if not current or paths is current:
+            return paths
+        shared = [new if old == new else old
+                  for old, new in zip(paths, current)]
+        return shared + paths[len(shared):]
+
+    def _update_history_size(self, transaction):
+        size = get_history_size(transaction[:2])
+        self.history_size += size - self.history_sizes.get(id(transaction), 0)
+        self.history_sizes[id(transaction)] = size
+
+    def _trim_history(self):
+        limit = config.undo_memory_limit
+        while limit and self.history_size > limit and len(self.undo) > 1:
+            transaction = self.undo.pop(0)
+            self.history_size -= self.history_sizes.pop(id(transaction), 0)
+            # initial document state is not reachable anymore
+            self.undo_marked = True
+
+    def get_history_size(self):
+        """
+        Returns estimated size of undo/redo history in bytes.
+        """
+        return self.history_size
+
     def add_undo(self, transaction):
         self.redo = self._clear_history_stack(self.redo)
+        self._compact_transaction(transaction)
         self.undo.append(transaction)
+        self._update_history_size(transaction)
+        self._trim_history()
+        self.last_move = None
+        self.last_text = None
+        self._check_damage(transaction[1])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
 
     def save_mark(self):
@@ -99,6 +292,7 @@ class AbstractAPI:
 
     def _set_page_format(self, page, page_format):
         self.methods.set_page_format(page, page_format)
+        self._add_full_damage()
 
     def _set_default_page_format(self, page_format):
         self.methods.set_default_page_format(page_format)
@@ -108,12 +302,15 @@ class AbstractAPI:
 
     def _set_page_border(self, border):
         self.methods.set_page_border(border)
+        self._add_full_damage()
 
     def _set_page_fill(self, page_fill):
         self.methods.set_page_fill(page_fill)
+        self._add_full_damage()
 
     def _set_layer_properties(self, layer, prop):
         layer.properties = prop
+        self._add_full_damage()
 
     def _set_layer_name(self, layer, name):
         layer.name = name
@@ -141,12 +338,14 @@ class AbstractAPI:
         self.selection.update()
 
     def _delete_object(self, obj):
+        self._add_damage([obj])
         self.methods.delete_object(obj)
         if obj in self.selection.objs:
             self.selection.remove([obj])
 
     def _insert_object(self, obj, parent, index):
         self.methods.insert_object(obj, parent, index)
+        self._add_damage([obj])
 
     def _get_pages_snapshot(self):
         return [] + self.presenter.get_pages()
@@ -155,10 +354,12 @@ class AbstractAPI:
         model = self.presenter.model
         parent = model.childs[0]
         parent.childs = snapshot
+        self._add_full_damage()
 
     def _set_page_snapshot(self, layers):
         page = self.presenter.active_page
         page.childs = layers
+        self._add_full_damage()
 
     def _get_layers_snapshot(self):
         layers_snapshot = []
@@ -170,6 +371,41 @@ class AbstractAPI:
     def _set_layers_snapshot(self, layers_snapshot):
         for layer, childs in layers_snapshot:
             layer.childs = childs
+        self._add_layers_damage([item[0] for item in layers_snapshot])
+
+    def _get_layers_delta(self, before, after):
+        """
+        Returns compact difference of two layers snapshots. Only changed
+        middle part of each changed childs list is stored as
+        (layer, start index, old items, new items) record.
+        None means that snapshots contain different layers.
+        """
+        after_dict = dict((id(layer), childs) for layer, childs in after)
+        delta = []
+        for layer, old in before:
+            new = after_dict.pop(id(layer), None)
+            if new is None:
+                return None
+            size = min(len(old), len(new))
+            start = 0
+            while start < size and old[start] is new[start]:
+                start += 1
+            end = 0
+            while end < size - start and old[-end - 1] is new[-end - 1]:
+                end += 1
+            if start == len(old) == len(new):
+                continue
+            delta.append((layer, start, old[start:len(old) - end],
+                          new[start:len(new) - end]))
+        if after_dict:
+            return None
+        return delta
+
+    def _set_layers_delta(self, delta, undo=True):
+        for layer, start, old, new in delta:
+            items, current = (old, new) if undo else (new, old)
+            layer.childs[start:start + len(current)] = items
+        self._add_layers_damage([item[0] for item in delta])
 
     def _set_active_layer(self, layer):
         self.presenter.active_layer = layer
@@ -177,6 +413,7 @@ class AbstractAPI:
     def _delete_objects(self, objs_list):
         for item in objs_list:
             obj = item[0]
+            self._add_damage([obj])
             self.methods.delete_object(obj)
             if obj in self.selection.objs:
                 self.selection.remove([obj])
@@ -184,6 +421,7 @@ class AbstractAPI:
     def _insert_objects(self, objs_list):
         for obj, parent, index in objs_list:
             self.methods.insert_object(obj, parent, index)
+            self._add_damage([obj])
 
     def _normalize_rect(self, rect):
         x0, y0, x1, y1 = rect
@@ -206,8 +444,10 @@ class AbstractAPI:
         self.model.set_def_style(style)
 
     def _set_obj_style(self, obj, style):
+        self._add_damage([obj])
         obj.style = style
         obj.update()
+        self._add_damage([obj])
 
     def _get_objs_styles(self, objs):
         result = []
@@ -219,13 +459,17 @@ class AbstractAPI:
         return result
 
     def _set_objs_styles(self, objs_styles):
+        # values of history records can be shared by objects
         for obj, style, fill_trafo, stroke_trafo in objs_styles:
-            obj.style = style
-            obj.fill_trafo = fill_trafo
-            obj.stroke_trafo = stroke_trafo
+            self._add_damage([obj])
+            obj.style = deepcopy(style)
+            obj.fill_trafo = deepcopy(fill_trafo)
+            obj.stroke_trafo = deepcopy(stroke_trafo)
             obj.clear_color_cache()
+            self._add_damage([obj])
 
     def _fill_objs(self, objs, color):
+        self._add_damage(objs)
         for obj in objs:
             style = deepcopy(obj.style)
             obj.clear_color_cache()
@@ -251,6 +495,7 @@ class AbstractAPI:
             obj.fill_trafo = []
 
     def _set_objs_fill_style(self, objs, fill_style):
+        self._add_damage(objs)
         for obj in objs:
             if not obj.is_pixmap:
                 style = deepcopy(obj.style)
@@ -259,29 +504,39 @@ class AbstractAPI:
                 obj.clear_color_cache()
 
     def _set_paths_and_trafo(self, obj, paths, trafo):
+        self._add_damage([obj])
         obj.paths = paths
         obj.trafo = trafo
         obj.update()
+        self._add_damage([obj])
 
     def _set_paths(self, obj, paths):
+        self._add_damage([obj])
         obj.paths = paths
         obj.update()
+        self._add_damage([obj])
 
     def _set_text_trafos(self, obj, trafos):
+        self._add_damage([obj])
         obj.trafos = trafos
         obj.update()
+        self._add_damage([obj])
 
     def _set_text_markup(self, obj, markup):
+        self._add_damage([obj])
         obj.markup = markup
         obj.update()
+        self._add_damage([obj])
 
     def _apply_trafo(self, objs, trafo):
         before = []
         after = []
+        self._add_damage(objs)
         for obj in objs:
             before.append(obj.get_trafo_snapshot())
             obj.apply_trafo(trafo)
             after.append(obj.get_trafo_snapshot())
+        self._add_damage(objs)
         self.selection.update_bbox()
         return before, after
 
@@ -289,21 +544,26 @@ class AbstractAPI:
         before = []
         after = []
         for obj, trafo in obj_trafo_list:
+            self._add_damage([obj])
             before.append(obj.get_trafo_snapshot())
             obj.apply_trafo(trafo)
             after.append(obj.get_trafo_snapshot())
+            self._add_damage([obj])
         self.selection.update_bbox()
         return before, after
 
     def _set_bitmap_trafo(self, obj, trafo):
+        self._add_damage([obj])
         obj.trafo = trafo
         obj.update()
+        self._add_damage([obj])
 
     def _clear_trafo(self, objs):
         normal_trafo = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
         before = []
         after = []
         for obj in objs:
+            self._add_damage([obj])
             before.append(obj.get_trafo_snapshot())
             if obj.is_circle or obj.is_polygon or obj.is_text:
                 obj.trafo = [] + obj.initial_trafo
@@ -313,6 +573,7 @@ class AbstractAPI:
             obj.stroke_trafo = []
             obj.update()
             after.append(obj.get_trafo_snapshot())
+            self._add_damage([obj])
         self.selection.update_bbox()
         return before, after
 
@@ -321,18 +582,22 @@ class AbstractAPI:
         before = []
         after = []
         for obj in objs:
+            self._add_damage([obj])
             before.append((obj, obj.paths, obj.trafo))
             obj.paths = libgeom.apply_trafo_to_paths(obj.paths, obj.trafo)
             obj.trafo = [] + normal_trafo
             obj.update()
             after.append((obj, obj.paths, obj.trafo))
+            self._add_damage([obj])
         self.selection.update_bbox()
         return before, after
 
     def _set_snapshots(self, snapshots):
         for snapshot in snapshots:
             obj = snapshot[0]
+            self._add_damage([obj])
             obj.set_trafo_snapshot(snapshot)
+            self._add_damage([obj])
         self.selection.update_bbox()
 
     def _set_paths_trafo_snapshots(self, snapshots):
@@ -341,6 +606,7 @@ class AbstractAPI:
         self.selection.update_bbox()
 
     def _stroke_objs(self, objs, color):
+        self._add_damage(objs)
         for obj in objs:
             style = deepcopy(obj.style)
             obj.clear_color_cache()
@@ -363,14 +629,17 @@ class AbstractAPI:
                     obj.stroke_trafo = []
             obj.style = style
             obj.update_stroke()
+        self._add_damage(objs)
 
     def _set_objs_stroke_style(self, objs, stroke_style):
+        self._add_damage(objs)
         for obj in objs:
             if not obj.is_pixmap:
                 style = deepcopy(obj.style)
                 style[1] = deepcopy(stroke_style)
                 obj.style = style
                 obj.update_stroke()
+        self._add_damage(objs)
 
     def _set_parent(self, objs, parent):
         for obj in objs:
@@ -385,12 +654,15 @@ class AbstractAPI:
         obj.clear_color_cache()
         if colorspace:
             obj.colorspace = colorspace
+        self._add_damage([obj])
 
     def _set_alpha(self, obj, alphastr):
         obj.set_alpha_channel(alphastr)
+        self._add_damage([obj])
 
     def _set_handler(self, obj, handler):
         obj.handler = handler
+        self._add_damage([obj])
 
     def _get_text_data(self, text_obj):
         text = text_obj.get_text()
@@ -399,10 +671,12 @@ class AbstractAPI:
         return text, trafos, markup
 
     def _set_text_data(self, text_obj, text, trafos, markup):
+        self._add_damage([text_obj])
         text_obj.set_text(text)
         text_obj.trafos = trafos
         text_obj.markup = markup
         text_obj.update()
+        self._add_damage([text_obj])
 
     def _set_tpgroup_data(self, tpgroup, text_obj, data):
         index = tpgroup.childs.index(text_obj)
@@ -410,6 +684,7 @@ class AbstractAPI:
         path = tpgroup.childs[0]
         tpgroup.set_text_on_path(path, text_obj, data)
         tpgroup.do_update()
+        self._add_full_damage()
 
 
 class PresenterAPI(AbstractAPI):
@@ -426,6 +701,8 @@ class PresenterAPI(AbstractAPI):
         self.app = presenter.app
         self.undo = []
         self.redo = []
+        self.history_sizes = {}
+        self.damage = []
 
     def destroy(self):
         self.undo = self._clear_history_stack(self.undo)
@@ -438,6 +715,8 @@ class PresenterAPI(AbstractAPI):
     def clear_history(self):
         self.undo = self._clear_history_stack(self.undo)
         self.redo = self._clear_history_stack(self.redo)
+        self.last_move = None
+        self.last_text = None
         events.emit(events.DOC_MODIFIED, self.presenter)
         self.presenter.reflect_saving()
 
@@ -1138,7 +1417,37 @@ class PresenterAPI(AbstractAPI):
 
     def move_selected(self, x, y, copy=False):
         trafo = [1.0, 0.0, 0.0, 1.0, x, y]
+        if not copy and self._can_coalesce_move():
+            self._coalesce_move(trafo)
+            return
         self.transform_selected(trafo, copy)
+        if not copy and self.selection.objs:
+            self.last_move = (self.undo[-1], time.time())
+
+    def _can_coalesce_move(self):
+        # repeated moves (keyboard nudges) are merged into one transaction
+        if not self.last_move or self.redo or not self.undo:
+            return False
+        transaction, timestamp = self.last_move
+        if transaction is not self.undo[-1] or transaction[2]:
+            return False
+        if time.time() - timestamp > config.undo_coalesce_time:
+            return False
+        sel_after = transaction[1][1][1]
+        objs = self.selection.objs
+        return len(sel_after) == len(objs) and \
+               all(a is b for a, b in zip(sel_after, objs))
+
+    def _coalesce_move(self, trafo):
+        transaction = self.undo[-1]
+        center_offset = self.selection.center_offset
+        after = self._apply_trafo([] + self.selection.objs, trafo)[1]
+        transaction[1][0][1] = after
+        self._update_history_size(transaction)
+        self.last_move = (transaction, time.time())
+        self.eventloop.emit(self.eventloop.DOC_MODIFIED)
+        self.selection.update()
+        self.selection.center_offset = center_offset
 
     def duplicate_selected(self):
         trafo = [1.0, 0.0, 0.0, 1.0, config.obj_jump, config.obj_jump]
@@ -1315,7 +1624,9 @@ class PresenterAPI(AbstractAPI):
             self.selection.update()
 
     def set_temp_style(self, obj, style):
+        self._add_damage([obj])
         obj.style = style
+        self._add_damage([obj])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
@@ -1789,7 +2100,9 @@ class PresenterAPI(AbstractAPI):
         self.insert_object(obj, parent, len(parent.childs))
 
     def set_rect(self, obj, rect):
+        self._add_damage([obj])
         self.methods.set_rect(obj, rect)
+        self._add_damage([obj])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
@@ -1808,7 +2121,9 @@ class PresenterAPI(AbstractAPI):
 
     def set_rect_corners(self, corners, obj=None):
         obj = obj or self.selection.objs[0]
+        self._add_damage([obj])
         self.methods.set_rect_corners(obj, corners)
+        self._add_damage([obj])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
@@ -1841,7 +2156,9 @@ class PresenterAPI(AbstractAPI):
             sel = [] + self.selection.objs
             obj = sel[0]
         mtds = self.methods
+        self._add_damage([obj])
         mtds.set_circle_properties(obj, circle_type, angle1, angle2)
+        self._add_damage([obj])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
@@ -1892,7 +2209,9 @@ class PresenterAPI(AbstractAPI):
 
     def set_polygon_properties(self, props, obj=None):
         obj = obj or self.selection.objs[0]
+        self._add_damage([obj])
         self.methods.set_polygon_properties(obj, *props)
+        self._add_damage([obj])
         self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
@@ -1975,7 +2294,11 @@ class PresenterAPI(AbstractAPI):
         self.insert_object(obj, parent, len(parent.childs))
         return obj
 
-    def change_text(self, obj, text_after, trafos_after, markup_after):
+    def change_text(self, obj, text_after, trafos_after, markup_after,
+                    coalesce=False):
+        if coalesce and self._can_coalesce_text(obj):
+            self._coalesce_text(obj, text_after, trafos_after, markup_after)
+            return
         sel_before = [] + self.selection.objs
         text_before, trafos_before, markup_before = self._get_text_data(obj)
         self._set_text_data(obj, text_after, trafos_after, markup_after)
@@ -1987,6 +2310,29 @@ class PresenterAPI(AbstractAPI):
              [self._set_selection, sel_before]],
             False]
         self.add_undo(transaction)
+        if coalesce:
+            self.last_text = (transaction, obj, time.time())
+        self.selection.update()
+
+    def _can_coalesce_text(self, obj):
+        # typing burst is merged into one transaction
+        if not self.last_text or self.redo or not self.undo:
+            return False
+        transaction, text_obj, timestamp = self.last_text
+        if transaction is not self.undo[-1] or transaction[2]:
+            return False
+        if time.time() - timestamp > config.undo_coalesce_time:
+            return False
+        return text_obj is obj
+
+    def _coalesce_text(self, obj, text_after, trafos_after, markup_after):
+        transaction = self.undo[-1]
+        self._set_text_data(obj, text_after, trafos_after, markup_after)
+        transaction[1][0] = [self._set_text_data, obj, text_after,
+                             trafos_after, markup_after]
+        self._update_history_size(transaction)
+        self.last_text = (transaction, obj, time.time())
+        self.eventloop.emit(self.eventloop.DOC_MODIFIED)
         self.selection.update()
 
     def set_temp_text_trafos(self, obj, trafos):
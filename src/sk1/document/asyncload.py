@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import Queue
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+
+from uc2 import events, uc2const
+from uc2.formats import get_loader, get_saver_by_id
+from uc2.utils import fsutils
+
+from sk1 import _, app_log, app_pool, config
+
+LOG = logging.getLogger(__name__)
+
+# polling interval of loading process, in seconds
+POLL_INTERVAL = 0.05
+
+MSG_INFO = 'info'
+MSG_DONE = 'done'
+MSG_ERROR = 'error'
+
+# application data of batch loading process
+WORKER_APPDATA = None
+
+
+class LoadingCancelled(Exception):
+    pass
+
+
+def is_async_supported(doc_file):
+    """
+    Large foreign format files are parsed by forked process, native
+    SK2 files are loaded directly. Parsed document is saved and loaded
+    again as SK2 file, so the round trip pays off for files which parsing
+    is much slower than SK2 loading only.
+    """
+    ext = os.path.splitext(doc_file)[1].lower()
+    sk2_ext = '.' + uc2const.FORMAT_EXTENSION[uc2const.SK2][0]
+    if not os.name == 'posix' or ext == sk2_ext or \
+            not config.async_loading_size:
+        return False
+    try:
+        size = os.path.getsize(fsutils.get_sys_path(doc_file))
+    except OSError:
+        return False
+    return size >= config.async_loading_size
+
+
+def get_temp_name(appdata):
+    name = '%d-%s.sk2' % (os.getpid(), uuid.uuid4().hex[:8])
+    return os.path.join(appdata.app_temp_dir, name)
+
+
+def save_as_sk2(appdata, doc_file, sk2_file):
+    loader = get_loader(doc_file)
+    if not loader:
+        raise IOError(_('Loader is not found for <%s>') % doc_file)
+    doc = loader(appdata, doc_file)
+    if not doc:
+        raise IOError(_('Cannot load <%s>') % doc_file)
+    get_saver_by_id(uc2const.SK2)(doc, sk2_file)
+    doc.close()
+
+
+def load_sk2(appdata, doc_file, sk2_file):
+    """
+    Loads converted document and restores its original file name.
+    """
+    doc_presenter = get_loader(sk2_file)(appdata, sk2_file)
+    if not doc_presenter:
+        raise IOError(_('Cannot load <%s>') % doc_file)
+    doc_presenter.doc_file = doc_file
+    return doc_presenter
+
+
+def convert_file(appdata, doc_file, sk2_file, queue):
+    """
+    Loading process entry. Parses document and saves it as SK2 file.
+    """
+    app_log.config_worker_logging()
+    # receivers inherited from parent process are not valid here
+    events.clean_channel(events.FILTER_INFO)
+    events.connect(events.FILTER_INFO,
+                   lambda *args: queue.put((MSG_INFO, args[0], args[1])))
+    try:
+        save_as_sk2(appdata, doc_file, sk2_file)
+    except Exception as e:
+        queue.put((MSG_ERROR, str(e), 0.0))
+        return
+    queue.put((MSG_DONE, '', 1.0))
+
+
+def init_batch_worker(appdata):
+    global WORKER_APPDATA
+    WORKER_APPDATA = appdata
+    events.clean_channel(events.FILTER_INFO)
+
+
+def convert_batch_file(doc_file, sk2_file):
+    """
+    Batch loading pool task. Returns (doc_file, sk2_file, error message).
+    """
+    try:
+        save_as_sk2(WORKER_APPDATA, doc_file, sk2_file)
+    except Exception as e:
+        return doc_file, sk2_file, str(e) or _('Cannot load <%s>') % doc_file
+    return doc_file, sk2_file, ''
+
+
+class AsyncLoader(object):
+    """
+    Loads foreign format documents in separate process, so heavy
+    parsing does not block UI and can be cancelled by killing process.
+    Parsed document is passed back as temporary SK2 file.
+    """
+    appdata = None
+    doc_file = ''
+    sk2_file = ''
+    process = None
+    queue = None
+
+    def __init__(self, appdata, doc_file):
+        self.appdata = appdata
+        self.doc_file = doc_file
+        self.sk2_file = get_temp_name(appdata)
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def start(self):
+        self.queue = multiprocessing.Queue()
+        args = (self.appdata, self.doc_file, self.sk2_file, self.queue)
+        self.process = multiprocessing.Process(target=convert_file, args=args)
+        self.process.daemon = True
+        self.process.start()
+
+    def cancel(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.remove_temp()
+
+    def remove_temp(self):
+        if fsutils.exists(self.sk2_file):
+            fsutils.remove(self.sk2_file)
+
+    def get_messages(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except Queue.Empty:
+                return messages
+
+    def load(self, pd):
+        """
+        Progress dialog callback. Polls loading process, reflects its
+        progress and loads resulting SK2 file. Raises LoadingCancelled
+        if dialog is cancelled.
+        """
+        self.start()
+        msg, value = _('Parsing file...'), 0.0
+        done = False
+        try:
+            while not done:
+                for kind, info, val in self.get_messages():
+                    if kind == MSG_ERROR:
+                        raise IOError(info)
+                    elif kind == MSG_DONE:
+                        done = True
+                    else:
+                        msg, value = info, val
+                if done:
+                    break
+                if not self.process.is_alive() and self.queue.empty():
+                    raise IOError(_('Cannot load <%s>') % self.doc_file)
+                # processes dialog events as well
+                pd.update_data(int(round(value * 100.0)), msg)
+                if pd.cancelled:
+                    LOG.info('Loading of <%s> is cancelled', self.doc_file)
+                    raise LoadingCancelled()
+                time.sleep(POLL_INTERVAL)
+            self.process.join()
+            return load_sk2(self.appdata, self.doc_file, self.sk2_file)
+        finally:
+            self.cancel()
+
+
+class BatchLoader(object):
+    """
+    Opens many documents at once. Foreign formats are parsed
+    concurrently by process pool, converted documents are loaded
+    and passed to callback as soon as they are ready.
+    """
+    appdata = None
+    doc_files = None
+    pool = None
+    tasks = None
+    finished = None
+    results = None
+    temp_files = None
+    errors = None
+
+    def __init__(self, appdata, doc_files):
+        self.appdata = appdata
+        self.doc_files = doc_files
+        self.results = Queue.Queue()
+        self.tasks = {}
+        self.finished = set()
+        self.temp_files = []
+        self.errors = []
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def start(self):
+        foreign = set(item for item in self.doc_files
+                      if is_async_supported(item))
+        if foreign:
+            processes = config.batch_open_workers or None
+            self.pool = app_pool.WorkerPool(processes, init_batch_worker,
+                                            (self.appdata,),
+                                            config.batch_open_timeout)
+        for doc_file in self.doc_files:
+            if doc_file in foreign:
+                sk2_file = get_temp_name(self.appdata)
+                self.temp_files.append(sk2_file)
+                key = self.pool.submit(convert_batch_file,
+                                       (doc_file, sk2_file),
+                                       self.results.put)
+                self.tasks[key] = (doc_file, sk2_file)
+            else:
+                self.results.put((doc_file, None, ''))
+        if self.pool is not None:
+            self.pool.close()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.destroy()
+            self.pool = None
+        for item in self.temp_files:
+            if fsutils.exists(item):
+                fsutils.remove(item)
+        self.temp_files = []
+
+    def load(self, pd, callback):
+        """
+        Progress dialog callback. Calls callback(doc_presenter) for
+        each loaded document, failed files are collected in errors list.
+        Raises LoadingCancelled if dialog is cancelled.
+        """
+        self.start()
+        total = len(self.doc_files)
+        done = 0
+        try:
+            while done < total:
+                try:
+                    item = self.results.get(True, POLL_INTERVAL)
+                except Queue.Empty:
+                    item = None
+                    self.check_tasks()
+                if item is not None and item[1] not in self.finished:
+                    if item[1]:
+                        self.finished.add(item[1])
+                    done += 1
+                    self.load_item(callback, *item)
+                msg = _('Opening %d of %d files...') % (done, total)
+                pd.update_data(int(round(done * 100.0 / total)), msg)
+                if pd.cancelled:
+                    LOG.info('Batch loading is cancelled')
+                    raise LoadingCancelled()
+        finally:
+            self.stop()
+
+    def check_tasks(self):
+        """
+        Reports conversion tasks which cannot be finished as failed,
+        i.e. tasks of terminated process or all pending tasks if
+        no file is converted till timeout.
+        """
+        if self.pool is None:
+            return
+        lost = self.pool.check()
+        if self.pool.expired:
+            error = _('Conversion timeout is expired')
+        else:
+            error = _('Conversion process is terminated')
+        for key in lost:
+            doc_file, sk2_file = self.tasks.pop(key)
+            self.results.put((doc_file, sk2_file, error))
+
+    def load_item(self, callback, doc_file, sk2_file, error):
+        try:
+            if error:
+                raise IOError(error)
+            if sk2_file:
+                doc_presenter = load_sk2(self.appdata, doc_file, sk2_file)
+            else:
+                doc_presenter = get_loader(doc_file)(self.appdata, doc_file)
+            callback(doc_presenter)
+        except Exception as e:
+            LOG.error('Cannot open file <%s> %s', doc_file, e)
+            self.errors.append(doc_file)
+        finally:
+            if sk2_file and fsutils.exists(sk2_file):
+                fsutils.remove(sk2_file)
@@ -22,9 +22,9 @@ import logging
 from sk1 import events, modes, config
 from sk1.appconst import PAGEFIT, ZOOM_IN, ZOOM_OUT
 from sk1.document import controllers
+from sk1.document.hittest import HitTester
 from sk1.document.renderer import PDRenderer
 from sk1.pwidgets import Painter
-from uc2 import libcairo, libgeom
 from uc2.libcairo import normalize_bbox
 from uc2.sk2const import DOC_ORIGIN_LL, DOC_ORIGIN_LU
 from uc2.uc2const import mm_to_pt
@@ -76,17 +76,19 @@ class AppCanvas(Painter):
         self.dc = self.app.mw.mdi.canvas
         self.timer = self.dc.timer
         Painter.__init__(self)
-        self.hit_surface = HitSurface(self)
+        self.hit_surface = HitTester(self)
         self.zoom_stack = []
 
         self.ctrls = self.init_controllers()
         # ----- Application eventloop bindings
         self.eventloop.connect(self.eventloop.DOC_MODIFIED, self.doc_modified)
-        self.eventloop.connect(self.eventloop.PAGE_CHANGED, self.doc_modified)
+        self.eventloop.connect(self.eventloop.PAGE_CHANGED, self.page_changed)
         self.eventloop.connect(self.eventloop.SELECTION_CHANGED,
                                self.selection_redraw)
+        events.connect(events.CMS_CHANGED, self.cms_changed)
 
     def destroy(self):
+        events.disconnect(events.CMS_CHANGED, self.cms_changed)
         self.timer.stop()
         self.renderer.destroy()
         self.hit_surface.destroy()
@@ -213,8 +215,9 @@ class AppCanvas(Painter):
 
     def _set_center(self, center):
         x, y = center
-        _dx = self.width / 2.0 - x
-        _dy = self.height / 2.0 - y
+        # integer shift keeps cached tiles valid
+        _dx = round(self.width / 2.0 - x)
+        _dy = round(self.height / 2.0 - y)
         m11, m12, m21, m22, dx, dy = self.trafo
         dx += _dx
         dy += _dy
@@ -421,9 +424,20 @@ class AppCanvas(Painter):
         self.force_redraw()
 
     def doc_modified(self):
+        self.renderer.invalidate_tiles(self.presenter.api.pop_damage())
         self.full_repaint = True
         self.force_redraw()
 
+    def page_changed(self):
+        self.presenter.api.pop_damage()
+        self.renderer.invalidate_tiles()
+        self.full_repaint = True
+        self.force_redraw()
+
+    def cms_changed(self):
+        self.renderer.invalidate_tiles()
+        self.full_repaint = True
+
     def force_redraw(self):
         if self.presenter == self.app.current_doc:
             self.dc.force_redraw()
@@ -472,122 +486,3 @@ class AppCanvas(Painter):
             self.renderer.finalize()
         except Exception as e:
             LOG.error('Painting error %s', e, exc_info=True)
-
-
-class HitSurface:
-    surface = None
-    ctx = None
-    canvas = None
-
-    def __init__(self, canvas):
-        self.canvas = canvas
-        self.surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 1, 1)
-        self.ctx = cairo.Context(self.surface)
-
-    def destroy(self):
-        items = self.__dict__.keys()
-        for item in items:
-            self.__dict__[item] = None
-
-    def clear(self):
-        self.ctx.set_source_rgb(1, 1, 1)
-        self.ctx.paint()
-        self.ctx.set_source_rgb(0, 0, 0)
-
-    def get_context_trafo(self, win_point):
-        dx, dy = win_point
-        trafo = [] + self.canvas.trafo
-        trafo[4] -= dx
-        trafo[5] -= dy
-        return trafo
-
-    def is_point_into_object(self, win_point, obj, fill_anyway=False):
-        self.clear()
-        self._draw_object(obj, self.get_context_trafo(win_point), fill_anyway)
-        return not libcairo.check_surface_whiteness(self.surface)
-
-    def _draw_object(self, obj, trafo, fill_anyway=False):
-        if obj.childs:
-            for child in obj.childs:
-                self._draw_object(child, trafo)
-        else:
-            path = obj.cache_cpath
-
-            if obj.is_text:
-                path = libcairo.convert_bbox_to_cpath(obj.cache_bbox)
-                fill_anyway = True
-            if obj.is_curve and len(obj.paths) > 100:
-                path = libcairo.convert_bbox_to_cpath(obj.cache_bbox)
-                fill_anyway = True
-            if obj.is_pixmap:
-                fill_anyway = True
-
-            self.ctx.set_matrix(libcairo.get_matrix_from_trafo(trafo))
-            self.ctx.new_path()
-            self.ctx.append_path(path)
-            stroke_width = config.stroke_sensitive_size
-            if not self.canvas.stroke_view and obj.style[0]:
-                self.ctx.fill_preserve()
-            if fill_anyway:
-                self.ctx.fill_preserve()
-            if obj.style[1]:
-                stroke = obj.style[1]
-                width = stroke[1] * trafo[0]
-                stroke_width /= trafo[0]
-                if width < stroke_width:
-                    width = stroke_width
-                self.ctx.set_line_width(width)
-                self.ctx.stroke()
-            if obj.style[1] and obj.cache_arrows:
-                for pair in obj.cache_arrows:
-                    for item in pair:
-                        if item:
-                            self.ctx.new_path()
-                            self.ctx.append_path(item)
-                            if self.canvas.stroke_view:
-                                self.ctx.stroke()
-                            else:
-                                self.ctx.fill()
-
-    def is_point_on_path(self, win_point, path):
-        self.clear()
-        trafo = self.get_context_trafo(win_point)
-        self.ctx.set_matrix(libcairo.get_matrix_from_trafo(trafo))
-        stroke_width = config.stroke_sensitive_size
-        stroke_width /= trafo[0]
-        cpath = libgeom.create_cpath([path, ])
-        self.ctx.new_path()
-        self.ctx.append_path(cpath)
-        self.ctx.set_line_width(stroke_width)
-        self.ctx.stroke()
-        return not libcairo.check_surface_whiteness(self.surface)
-
-    def is_point_on_segment(self, win_point, start_point, end_point):
-        self.clear()
-        trafo = self.get_context_trafo(win_point)
-        self.ctx.set_matrix(libcairo.get_matrix_from_trafo(trafo))
-        stroke_width = config.stroke_sensitive_size
-        stroke_width /= trafo[0]
-        if len(start_point) > 2:
-            start_point = start_point[2]
-        self.ctx.move_to(*start_point)
-        if len(end_point) == 2:
-            self.ctx.line_to(*end_point)
-        else:
-            p1, p2, p3 = end_point[:-1]
-            self.ctx.curve_to(*(p1 + p2 + p3))
-        self.ctx.set_line_width(stroke_width)
-        self.ctx.stroke()
-        return not libcairo.check_surface_whiteness(self.surface)
-
-    def get_t_parameter(self, win_point, start, end, t=0.5, dt=0.5):
-        dt /= 2.0
-        new, new_end = libgeom.split_bezier_curve(start, end, t)
-        ret1 = self.is_point_on_segment(win_point, start, new)
-        ret2 = self.is_point_on_segment(win_point, new, new_end)
-        if ret1 and ret2:
-            return t
-        elif ret1:
-            return self.get_t_parameter(win_point, start, end, t - dt, dt)
-        elif ret2:
-            return self.get_t_parameter(win_point, start, end, t + dt, dt)
@@ -16,6 +16,7 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import bisect
 from copy import deepcopy
 
 from uc2 import libgeom
@@ -32,7 +33,7 @@ NON_WORD_CHARS = NON_WORD_CHARS.decode('utf-8')
 class TextEditController(AbstractController):
     mode = modes.TEXT_EDIT_MODE
     target = None
-    text = ()
+    text = []
     trafos = {}
     markup = []
 
@@ -40,8 +41,10 @@ class TextEditController(AbstractController):
     line_num = 0
     line_pos = 0
     lines = []
+    line_ends = []
 
     selected = []
+    updating = False
     drag = False
     prev_pos = 0
     prev_sel = []
@@ -68,7 +71,8 @@ class TextEditController(AbstractController):
         self.target = None
 
     def doc_modified(self, *args):
-        if self.canvas.mode == modes.TEXT_EDIT_MODE:
+        # own changes are already reflected by controller
+        if self.canvas.mode == modes.TEXT_EDIT_MODE and not self.updating:
             pos = self.text_cursor
             self.update_from_target()
             self.set_text_cursor(pos)
@@ -88,58 +92,46 @@ class TextEditController(AbstractController):
         self.set_text_cursor(len(self.text))
 
     def text_to_seq(self, text, clusters):
-        if clusters:
-            index = 0
-            text_seq = ()
-            for item in clusters:
-                if text[index:item[0]]:
-                    text_seq += tuple(text[index:item[0]])
-                text_seq += (text[item[0]:item[1]],)
-                index = item[1]
-            if text[index:]:
-                text_seq += tuple(text[index:])
-            return text_seq
-        else:
-            return tuple(text)
+        text_seq = []
+        index = 0
+        for item in clusters or []:
+            text_seq.extend(text[index:item[0]])
+            text_seq.append(text[item[0]:item[1]])
+            index = item[1]
+        text_seq.extend(text[index:])
+        return text_seq
 
     def seq_to_text(self, seq):
         return ''.join(seq)
 
-    def update_target(self):
-        self.presenter.api.change_text(self.target, self.seq_to_text(self.text),
-                                       deepcopy(self.trafos),
-                                       deepcopy(self.markup))
+    def update_target(self, coalesce=False):
+        # trafos are replaced, not changed in place, markup items are
+        # changed in place by range shifting only
+        self.updating = True
+        try:
+            self.presenter.api.change_text(
+                self.target, self.seq_to_text(self.text), dict(self.trafos),
+                [list(item) for item in self.markup], coalesce)
+        finally:
+            self.updating = False
         self.text = self.text_to_seq(self.target.get_text(),
                                      self.target.cache_clusters)
         self.update_lines()
+        self.set_text_cursor(self.text_cursor, True)
 
     def update_lines(self):
-        self.lines = []
-        i = 0
-        indexes = [0, ]
-        for item in self.text:
-            i += 1
-            if item == '\n':
-                indexes.append(i)
-                indexes.append(i)
-        indexes.append(len(self.text))
-        i = 0
-        while i < len(indexes):
-            self.lines.append((indexes[i], indexes[i + 1]))
-            i += 2
+        ends = [i + 1 for i, item in enumerate(self.text) if item == '\n']
+        starts = [0, ] + ends
+        self.line_ends = ends + [len(self.text), ]
+        self.lines = zip(starts, self.line_ends)
 
     def set_line_pos(self):
-        index = 0
         if self.text_cursor == len(self.text):
             self.line_num = len(self.lines) - 1
-            self.line_pos = self.text_cursor - self.lines[-1][0]
         else:
-            for line in self.lines:
-                if not self.text_cursor >= line[1]:
-                    self.line_num = index
-                    break
-                index += 1
-            self.line_pos = self.text_cursor - line[0]
+            self.line_num = bisect.bisect_right(self.line_ends,
+                                                self.text_cursor)
+        self.line_pos = self.text_cursor - self.lines[self.line_num][0]
 
     def get_line_width(self, num):
         return self.lines[num][1] - self.lines[num][0]
@@ -477,23 +469,15 @@ class TextEditController(AbstractController):
                 chars = []
             else:
                 chars = chars[:-1]
-            self.text = self.text[:index] + tuple(chars) + self.text[index + 1:]
+            self.text[index:index + 1] = list(chars)
             if not chars:
                 self._delete_trafos_range((index, index + 1))
         else:
-            if index == len(self.text) - 1:
-                self.text = self.text[:-1]
-            else:
-                self.text = self.text[:index] + self.text[index + 1:]
+            del self.text[index]
             self._delete_trafos_range((index, index + 1))
 
     def _delete_text_range(self, text_range):
-        if text_range[1] == len(self.text):
-            self.text = self.text[:text_range[0]]
-        elif not text_range[0]:
-            self.text = self.text[text_range[1]:]
-        else:
-            self.text = self.text[:text_range[0]] + self.text[text_range[1]:]
+        del self.text[text_range[0]:text_range[1]]
         self._delete_trafos_range(text_range)
 
     def _insert_markup_range(self, index, size):
@@ -524,20 +508,20 @@ class TextEditController(AbstractController):
             index = self.selected[0]
             self._delete_text_range(self.selected)
             self.set_text_cursor(self.selected[0])
-        if index == len(self.text):
-            self.text += tuple(text)
-        else:
-            self.text = self.text[:index] + tuple(text) + self.text[index:]
+        self.text[index:index] = list(text)
         self._insert_trafos_range(index, len(text))
 
     def delete_char(self, forward=True):
         if self.text_cursor < len(self.text):
             self._delete_char(self.text_cursor, forward)
-            self.update_target()
+            self.update_target(True)
 
     def insert_text(self, text):
+        # typed characters are coalesced in undo history,
+        # replacements and drops are separate transactions
+        coalesce = len(text) == 1 and not self.selected
         self._insert_text(text, self.text_cursor)
-        self.update_target()
+        self.update_target(coalesce)
         self.set_text_cursor(self.text_cursor + len(text))
 
     # --- Markup functionality
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import Counter
+
+from uc2 import uc2const, sk2const
+
+from sk1.document.geometry import get_top_object
+
+OBJECT_TYPES = ('is_curve', 'is_rect', 'is_circle', 'is_polygon',
+                'is_text', 'is_pixmap', 'is_group', 'is_container',
+                'is_primitive')
+
+# uncompressed size of pixel, in bytes
+PIXEL_SIZE = {
+    uc2const.IMAGE_MONO: 0.125,
+    uc2const.IMAGE_GRAY: 1,
+    uc2const.IMAGE_RGB: 3,
+    uc2const.IMAGE_LAB: 3,
+    uc2const.IMAGE_CMYK: 4,
+}
+
+
+def get_color_key(color):
+    # spot colors have nested values
+    return color[0], repr(color[1]), color[2]
+
+
+class Statistics(object):
+    """
+    Additive statistics of objects. Counters are updated with
+    add() and sub(), so statistics of changed objects can be
+    replaced without walking others.
+    """
+    counts = None
+    fonts = None
+    fill_spaces = None
+    stroke_spaces = None
+    colors = None
+    path_points = None
+    pixmaps = None
+    fields = ('counts', 'fonts', 'fill_spaces', 'stroke_spaces',
+              'colors', 'path_points', 'pixmaps')
+
+    def __init__(self):
+        for name in self.fields:
+            setattr(self, name, Counter())
+
+    def __getitem__(self, item):
+        return self.counts[item]
+
+    def add(self, other):
+        for name in self.fields:
+            getattr(self, name).update(getattr(other, name))
+
+    def sub(self, other):
+        for name in self.fields:
+            counter = getattr(self, name)
+            for key, value in getattr(other, name).iteritems():
+                counter[key] -= value
+                if not counter[key]:
+                    del counter[key]
+
+    def get_max_path_points(self):
+        return max(self.path_points) if self.path_points else 0
+
+    def get_fonts(self):
+        return sorted(self.fonts)
+
+    def get_pixmaps(self):
+        return self.pixmaps.keys()
+
+    def analyze(self, obj):
+        counts = self.counts
+        for name in OBJECT_TYPES:
+            if getattr(obj, name):
+                counts[name] += 1
+        if obj.is_group:
+            for child in obj.childs:
+                self.analyze(child)
+            return
+        if obj.is_pixmap:
+            self.analyze_pixmap(obj)
+            return
+        if obj.is_curve:
+            self.analyze_path(obj)
+        elif obj.is_text and obj.is_textblock:
+            self.analyze_text(obj)
+        self.analyze_style(obj)
+
+    def analyze_path(self, obj):
+        counts = self.counts
+        counts['subpaths'] += len(obj.paths)
+        # number of nodes does not depend on trafo
+        for path in obj.paths:
+            if path[2] == sk2const.CURVE_CLOSED:
+                counts['path_closed'] += 1
+                nodes = len(path[1])
+            else:
+                counts['path_opened'] += 1
+                nodes = len(path[1]) + 1
+            counts['node'] += nodes
+            self.path_points[nodes] += 1
+
+    def analyze_text(self, obj):
+        counts = self.counts
+        lines = obj.get_text().split('\n')
+        words = [word for line in lines for word in line.split()]
+        counts['textblock'] += 1
+        counts['line'] += len(lines)
+        counts['word'] += len(words)
+        counts['char'] += sum(len(word) for word in words)
+        self.fonts[obj.style[2][0]] += 1
+        # markup item is [tag or list of tags, (start, end)]
+        for markup in obj.markup:
+            tags = markup[0] if isinstance(markup[0], list) else [markup[0]]
+            for tag in tags:
+                if isinstance(tag, tuple) and tag[0] == 'font':
+                    self.fonts[tag[1]] += 1
+
+    def analyze_pixmap(self, obj):
+        w, h = obj.get_size()
+        size = PIXEL_SIZE.get(obj.colorspace, 4) + obj.has_alpha()
+        self.counts['pixmap_memory'] += int(w * h * size)
+        self.pixmaps[obj] += 1
+
+    def analyze_style(self, obj):
+        counts = self.counts
+        fill_style = obj.style[0]
+        if not fill_style:
+            counts['no_fill'] += 1
+        elif fill_style[1] == sk2const.FILL_SOLID:
+            counts['fill_solid'] += 1
+            self.fill_spaces[fill_style[2][0]] += 1
+            self.colors[get_color_key(fill_style[2])] += 1
+        elif fill_style[1] == sk2const.FILL_GRADIENT:
+            counts['fill_gradient'] += 1
+            stops = fill_style[2][2]
+            self.fill_spaces[stops[0][1][0]] += 1
+            for stop in stops:
+                self.colors[get_color_key(stop[1])] += 1
+        elif fill_style[1] == sk2const.FILL_PATTERN:
+            counts['fill_pattern'] += 1
+            self.fill_spaces[fill_style[2][2][0][0]] += 1
+        stroke_style = obj.style[1]
+        if not stroke_style:
+            counts['no_stroke'] += 1
+        else:
+            counts['stroke_solid'] += 1
+            self.stroke_spaces[stroke_style[2][0]] += 1
+            self.colors[get_color_key(stroke_style[2])] += 1
+
+
+class LayerStatistics(object):
+    """
+    Statistics of layer top level objects. Changed objects are
+    collected as dirty ones and reanalyzed on next query.
+    """
+    layer = None
+    childs = None
+    items = None
+    total = None
+    dirty = None
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.rebuild()
+
+    def rebuild(self):
+        self.childs = self.layer.childs
+        self.dirty = set()
+        self.items = {}
+        self.total = Statistics()
+        for obj in self.childs:
+            self.insert(obj)
+
+    def insert(self, obj):
+        info = Statistics()
+        info.analyze(obj)
+        self.items[obj] = info
+        self.total.add(info)
+
+    def remove(self, obj):
+        info = self.items.pop(obj, None)
+        if info is not None:
+            self.total.sub(info)
+
+    def sync(self):
+        if self.layer.childs is not self.childs:
+            self.rebuild()
+            return
+        if not self.dirty:
+            return
+        members = set(self.childs)
+        for obj in self.dirty:
+            self.remove(obj)
+            if obj in members:
+                self.insert(obj)
+        self.dirty = set()
+
+
+class DocStatistics(object):
+    """
+    Document statistics (object types, nodes, text, bitmaps and colors)
+    of page and master layers. Statistics are collected on first query
+    and maintained incrementally using changes reported by PresenterAPI,
+    so query cost depends on changed objects only.
+    """
+    presenter = None
+    layers = None
+    total = None
+
+    def __init__(self, presenter):
+        self.presenter = presenter
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def invalidate(self):
+        self.layers = None
+        self.total = None
+
+    def update(self, objs):
+        """
+        Marks changed (inserted, deleted or modified) objects
+        for reanalyzing.
+        """
+        if self.layers is None:
+            return
+        for obj in objs:
+            top = get_top_object(obj)
+            if top is None:
+                self.invalidate()
+                return
+            stats = self.layers.get(id(top.parent))
+            if stats is not None:
+                stats.dirty.add(top)
+
+    def get_layers(self):
+        presenter = self.presenter
+        layers = [layer for page in presenter.get_pages()
+                  for layer in presenter.get_layers(page)]
+        return layers + list(presenter.methods.get_master_layers())
+
+    def build(self):
+        self.layers = {}
+        self.total = Statistics()
+        for layer in self.get_layers():
+            stats = LayerStatistics(layer)
+            self.layers[id(layer)] = stats
+            self.total.add(stats.total)
+
+    def get_statistics(self):
+        """
+        Returns Statistics object of whole document. Returned object
+        is shared, so it should not be modified by caller.
+        """
+        if self.total is None:
+            self.build()
+            return self.total
+        for stats in self.layers.values():
+            if stats.dirty or stats.layer.childs is not stats.childs:
+                self.total.sub(stats.total)
+                stats.sync()
+                self.total.add(stats.total)
+        return self.total
+
+    def get_layers_count(self):
+        if self.layers is None:
+            self.build()
+        return len(self.layers)
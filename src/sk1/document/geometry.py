@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+
+from uc2 import libgeom, sk2const
+
+SQRT2 = math.sqrt(2.0)
+
+
+def get_top_object(obj):
+    """
+    Returns layer child which contains provided object or None
+    for detached objects.
+    """
+    parent = obj.parent
+    while parent is not None and not parent.is_layer:
+        obj = parent
+        parent = obj.parent
+    return obj if parent is not None else None
+
+
+def enlarge_bbox(bbox, margin):
+    x0, y0, x1, y1 = bbox
+    return [x0 - margin, y0 - margin, x1 + margin, y1 + margin]
+
+
+def get_stroke_width(obj):
+    """
+    Returns painted stroke width in document units.
+    """
+    style = getattr(obj, 'style', None)
+    stroke = style[1] if style else []
+    if not stroke:
+        return 0.0
+    width = stroke[1]
+    stroke_trafo = getattr(obj, 'stroke_trafo', [])
+    if stroke_trafo:
+        m11, m21, m12, m22 = stroke_trafo[:4]
+        width *= math.sqrt(abs(m11 * m22 - m12 * m21))
+    return width
+
+
+def get_stroke_margin(obj):
+    """
+    Returns half of the painted stroke width (in document units)
+    including miter and square cap overhead.
+    """
+    width = get_stroke_width(obj)
+    if not width:
+        return 0.0
+    stroke = obj.style[1]
+    coef = SQRT2
+    if len(stroke) > 6 and stroke[5] == sk2const.JOIN_MITER:
+        coef = max(coef, stroke[6])
+    return width * coef / 2.0
+
+
+def get_visual_bbox(obj):
+    """
+    Returns object bbox which covers painted area of the object
+    (stroke and arrows included). cache_bbox covers geometry only.
+    """
+    cache_bbox = getattr(obj, 'cache_bbox', None)
+    bbox = [] + cache_bbox if cache_bbox else []
+    childs = getattr(obj, 'childs', None)
+    if childs:
+        for child in childs:
+            child_bbox = get_visual_bbox(child)
+            if child_bbox:
+                bbox = libgeom.sum_bbox(bbox, child_bbox) \
+                    if bbox else child_bbox
+        return bbox
+    if not bbox:
+        return bbox
+    margin = get_stroke_margin(obj)
+    if margin:
+        bbox = enlarge_bbox(bbox, margin)
+    if obj.is_curve and getattr(obj, 'cache_arrows', None):
+        for pair in obj.cache_arrows:
+            for item in pair:
+                if item:
+                    arrow_bbox = libgeom.get_cpath_bbox(item)
+                    bbox = libgeom.sum_bbox(bbox, arrow_bbox)
+    return bbox
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import cairo
+import math
+from collections import OrderedDict
+
+from sk1 import config
+from sk1.document.geometry import get_stroke_width
+from uc2 import sk2const
+
+# flattening tolerance in pixels
+FLATNESS = 0.25
+MAX_STEPS = 256
+# number of flattened paths kept in cache
+CACHE_SIZE = 1024
+# initial samples and refinement steps of nearest point search
+T_SAMPLES = 16
+T_ITERATIONS = 8
+
+
+def flatten_curve(p0, p1, p2, p3, tolerance, points):
+    """
+    Appends flattened cubic bezier (excluding start point) to points list.
+    Number of steps is estimated by Wang's formula.
+    """
+    ddx = max(abs(p0[0] - 2.0 * p1[0] + p2[0]),
+              abs(p1[0] - 2.0 * p2[0] + p3[0]))
+    ddy = max(abs(p0[1] - 2.0 * p1[1] + p2[1]),
+              abs(p1[1] - 2.0 * p2[1] + p3[1]))
+    dd = math.sqrt(ddx * ddx + ddy * ddy)
+    steps = int(math.ceil(math.sqrt(0.75 * dd / tolerance))) if dd else 1
+    steps = min(max(steps, 1), MAX_STEPS)
+    for i in range(1, steps):
+        points.append(get_curve_point(p0, p1, p2, p3, float(i) / steps))
+    points.append((p3[0], p3[1]))
+
+
+def get_curve_point(p0, p1, p2, p3, t):
+    s = 1.0 - t
+    a = s * s * s
+    b = 3.0 * s * s * t
+    c = 3.0 * s * t * t
+    d = t * t * t
+    return (a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0],
+            a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1])
+
+
+def _make_polyline(points, closed):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return points, closed, [min(xs), min(ys), max(xs), max(ys)]
+
+
+def flatten_cpath(cpath, tolerance):
+    """
+    Converts cairo path into list of polylines. Each polyline is
+    (points, closed flag, bbox) tuple.
+    """
+    polylines = []
+    points = []
+    for item_type, coords in cpath:
+        if item_type == cairo.PATH_MOVE_TO:
+            if len(points) > 1:
+                polylines.append(_make_polyline(points, False))
+            points = [coords]
+        elif item_type == cairo.PATH_LINE_TO:
+            points.append(coords)
+        elif item_type == cairo.PATH_CURVE_TO:
+            flatten_curve(points[-1], coords[0:2], coords[2:4], coords[4:6],
+                          tolerance, points)
+        elif item_type == cairo.PATH_CLOSE_PATH:
+            if points:
+                polylines.append(_make_polyline(points, True))
+                points = [points[0]]
+    if len(points) > 1:
+        polylines.append(_make_polyline(points, False))
+    return polylines
+
+
+def flatten_path(path, tolerance):
+    """
+    Converts sk2 path into list of polylines.
+    """
+    start, nodes, closed = path[:3]
+    points = [tuple(start)]
+    for node in nodes:
+        if len(node) == 2:
+            points.append(tuple(node))
+        else:
+            flatten_curve(points[-1], node[0], node[1], node[2],
+                          tolerance, points)
+    if len(points) < 2:
+        return []
+    return [_make_polyline(points, closed == sk2const.CURVE_CLOSED)]
+
+
+def is_point_in_bbox(point, bbox, margin=0.0):
+    x, y = point
+    return bbox[0] - margin <= x <= bbox[2] + margin and \
+           bbox[1] - margin <= y <= bbox[3] + margin
+
+
+def is_point_in_polylines(point, polylines):
+    """
+    Checks point against area filled with nonzero winding rule.
+    Polylines are closed implicitly as cairo does on filling.
+    """
+    x, y = point
+    winding = 0
+    for points, closed, bbox in polylines:
+        if not is_point_in_bbox(point, bbox):
+            continue
+        x0, y0 = points[-1]
+        for x1, y1 in points:
+            if y0 <= y:
+                if y1 > y and (x1 - x0) * (y - y0) - (x - x0) * (y1 - y0) > 0:
+                    winding += 1
+            elif y1 <= y and \
+                    (x1 - x0) * (y - y0) - (x - x0) * (y1 - y0) < 0:
+                winding -= 1
+            x0, y0 = x1, y1
+    return winding != 0
+
+
+def get_segment_distance2(point, start, end):
+    x, y = point
+    x0, y0 = start
+    dx = end[0] - x0
+    dy = end[1] - y0
+    length2 = dx * dx + dy * dy
+    t = 0.0
+    if length2:
+        t = min(max(((x - x0) * dx + (y - y0) * dy) / length2, 0.0), 1.0)
+    px = x0 + t * dx - x
+    py = y0 + t * dy - y
+    return px * px + py * py
+
+
+def is_point_near_polylines(point, polylines, distance):
+    """
+    Checks that point is not farther than distance from polyline
+    outlines. Closed polylines include closing segment.
+    """
+    distance2 = distance * distance
+    for points, closed, bbox in polylines:
+        if not is_point_in_bbox(point, bbox, distance):
+            continue
+        start = points[-1] if closed else points[0]
+        for end in points if closed else points[1:]:
+            if get_segment_distance2(point, start, end) <= distance2:
+                return True
+            start = end
+    return False
+
+
+def get_nearest_t(point, p0, p1, p2, p3):
+    """
+    Returns parameter of the curve point nearest to provided point.
+    Coarse sampling is refined by Newton iterations on
+    (B(t) - P) . B'(t) = 0.
+    """
+    x, y = point
+    t = 0.0
+    min_dist = None
+    for i in range(T_SAMPLES + 1):
+        ti = float(i) / T_SAMPLES
+        cx, cy = get_curve_point(p0, p1, p2, p3, ti)
+        dist = (cx - x) ** 2 + (cy - y) ** 2
+        if min_dist is None or dist < min_dist:
+            t, min_dist = ti, dist
+    for _i in range(T_ITERATIONS):
+        s = 1.0 - t
+        cx, cy = get_curve_point(p0, p1, p2, p3, t)
+        # first derivative
+        d1x = 3.0 * (s * s * (p1[0] - p0[0]) + 2.0 * s * t * (p2[0] - p1[0]) +
+                     t * t * (p3[0] - p2[0]))
+        d1y = 3.0 * (s * s * (p1[1] - p0[1]) + 2.0 * s * t * (p2[1] - p1[1]) +
+                     t * t * (p3[1] - p2[1]))
+        # second derivative
+        d2x = 6.0 * (s * (p2[0] - 2.0 * p1[0] + p0[0]) +
+                     t * (p3[0] - 2.0 * p2[0] + p1[0]))
+        d2y = 6.0 * (s * (p2[1] - 2.0 * p1[1] + p0[1]) +
+                     t * (p3[1] - 2.0 * p2[1] + p1[1]))
+        numerator = (cx - x) * d1x + (cy - y) * d1y
+        denominator = d1x * d1x + d1y * d1y + (cx - x) * d2x + (cy - y) * d2y
+        if not denominator:
+            break
+        new_t = min(max(t - numerator / denominator, 0.0), 1.0)
+        if abs(new_t - t) < 1e-6:
+            t = new_t
+            break
+        t = new_t
+    return t
+
+
+class HitTester(object):
+    """
+    Geometric hit testing of document objects. Object paths are
+    flattened into polylines (with zoom dependent tolerance) and
+    cached, so repeated queries do not construct any cairo paths.
+    """
+    canvas = None
+    cache = None
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.cache = OrderedDict()
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def get_tolerance(self):
+        return FLATNESS / self.canvas.zoom
+
+    def get_doc_point(self, win_point):
+        # center of the pixel under cursor
+        x, y = win_point
+        return self.canvas.win_to_doc([x + 0.5, y + 0.5])
+
+    def get_sensitive_width(self):
+        return config.stroke_sensitive_size / self.canvas.zoom
+
+    def get_gap(self):
+        # half pixel gap for antialiased edges
+        return 0.5 / self.canvas.zoom
+
+    def get_polylines(self, cpath):
+        key = id(cpath)
+        tolerance = self.get_tolerance()
+        item = self.cache.pop(key, None)
+        if item is None or item[0] is not cpath or item[1] != tolerance:
+            item = (cpath, tolerance, flatten_cpath(cpath, tolerance))
+        self.cache[key] = item
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return item[2]
+
+    def is_point_into_object(self, win_point, obj, fill_anyway=False):
+        point = self.get_doc_point(win_point)
+        return self._hit_object(point, obj, fill_anyway)
+
+    def _hit_object(self, point, obj, fill_anyway=False):
+        if obj.childs:
+            for child in obj.childs:
+                if self._hit_object(point, child):
+                    return True
+            return False
+
+        if obj.is_text:
+            x0, y0, x1, y1 = obj.cache_bbox
+            points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+            polylines = [_make_polyline(points, True)]
+            fill_anyway = True
+        else:
+            polylines = self.get_polylines(obj.cache_cpath)
+        if obj.is_pixmap:
+            fill_anyway = True
+
+        gap = self.get_gap()
+        if fill_anyway or (not self.canvas.stroke_view and obj.style[0]):
+            if is_point_in_polylines(point, polylines):
+                return True
+        width = 0.0
+        if obj.style[1]:
+            width = max(get_stroke_width(obj), self.get_sensitive_width())
+            if is_point_near_polylines(point, polylines, width / 2.0 + gap):
+                return True
+        if obj.style[1] and obj.cache_arrows:
+            for pair in obj.cache_arrows:
+                for item in pair:
+                    if not item:
+                        continue
+                    arrow = self.get_polylines(item)
+                    if self.canvas.stroke_view:
+                        if is_point_near_polylines(point, arrow,
+                                                   width / 2.0 + gap):
+                            return True
+                    elif is_point_in_polylines(point, arrow):
+                        return True
+        return False
+
+    def is_point_on_path(self, win_point, path):
+        point = self.get_doc_point(win_point)
+        polylines = flatten_path(path, self.get_tolerance())
+        distance = self.get_sensitive_width() / 2.0 + self.get_gap()
+        return is_point_near_polylines(point, polylines, distance)
+
+    def is_point_on_segment(self, win_point, start_point, end_point):
+        point = self.get_doc_point(win_point)
+        if len(start_point) > 2:
+            start_point = start_point[2]
+        points = [tuple(start_point)]
+        if len(end_point) == 2:
+            points.append(tuple(end_point))
+        else:
+            p1, p2, p3 = end_point[:3]
+            flatten_curve(start_point, p1, p2, p3,
+                          self.get_tolerance(), points)
+        polylines = [_make_polyline(points, False)]
+        distance = self.get_sensitive_width() / 2.0 + self.get_gap()
+        return is_point_near_polylines(point, polylines, distance)
+
+    def get_t_parameter(self, win_point, start, end):
+        point = self.get_doc_point(win_point)
+        if len(start) > 2:
+            start = start[2]
+        return get_nearest_t(point, start, *end[:3])
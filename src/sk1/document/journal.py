@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import StringIO
+import Queue
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+import wal
+from uc2 import uc2const
+from uc2.formats import get_saver_by_id, get_loader_by_id
+from uc2.formats.sk2.sk2_presenter import SK2_Presenter
+from uc2.utils import fsutils
+
+from sk1 import config
+from sk1.document.geometry import get_top_object
+
+LOG = logging.getLogger(__name__)
+
+MAGIC = 'SK1J'
+VERSION = 2
+HEADER = struct.Struct('>4sH')
+# record tag, payload size, payload crc32
+RECORD = struct.Struct('>4sII')
+
+META = 'META'
+CHECKPOINT = 'SNAP'
+TRANSACTION = 'TRAN'
+
+EXTENSION = '.sk1j'
+# polling interval of pending checkpoint, in ms
+CHECKPOINT_DELAY = 1000
+
+
+def pack_record(tag, payload):
+    crc = zlib.crc32(payload) & 0xffffffff
+    return RECORD.pack(tag, len(payload), crc) + payload
+
+
+def read_records(path):
+    """
+    Returns list of (tag, payload) journal records. Reading stops
+    on the first incomplete or corrupted record (crash tail).
+    """
+    records = []
+    with open(fsutils.get_sys_path(path), 'rb') as fileptr:
+        header = fileptr.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return records
+        magic, version = HEADER.unpack(header)
+        if not magic == MAGIC or not version == VERSION:
+            return records
+        while True:
+            data = fileptr.read(RECORD.size)
+            if len(data) < RECORD.size:
+                break
+            tag, size, crc = RECORD.unpack(data)
+            payload = fileptr.read(size)
+            if len(payload) < size or \
+                    not zlib.crc32(payload) & 0xffffffff == crc:
+                break
+            records.append((tag, payload))
+    return records
+
+
+def read_journal(path):
+    """
+    Returns (metainfo, sk2 document data, transaction records after
+    checkpoint) for the latest journal checkpoint. Document data is None
+    if journal has no checkpoint.
+    """
+    meta = {}
+    data = None
+    transactions = []
+    for tag, payload in read_records(path):
+        if tag == META:
+            meta = json.loads(payload)
+        elif tag == CHECKPOINT:
+            data = zlib.decompress(payload)
+            transactions = []
+        elif tag == TRANSACTION:
+            transactions.append(payload)
+    return meta, data, transactions
+
+
+def get_layer_keys(methods):
+    """
+    Returns {key: layer} of document page and master layers. Keys are
+    positions of layers, so they are stable between checkpoints.
+    """
+    keys = {}
+    for page_index, page in enumerate(methods.get_pages()):
+        for index, layer in enumerate(methods.get_layers(page)):
+            keys['%d:%d' % (page_index, index)] = layer
+    for index, layer in enumerate(methods.get_master_layers()):
+        keys['m:%d' % index] = layer
+    return keys
+
+
+def get_splice(old, new, dirty):
+    """
+    Returns (start, number of replaced items, items) of changed middle
+    part of layer childs. Unchanged items are referred by index in old
+    list, changed and inserted items are returned as is.
+    """
+    size = min(len(old), len(new))
+    start = 0
+    while start < size and old[start] is new[start] and \
+            new[start] not in dirty:
+        start += 1
+    end = 0
+    while end < size - start and old[-end - 1] is new[-end - 1] and \
+            new[-end - 1] not in dirty:
+        end += 1
+    indexes = dict((id(obj), start + index) for index, obj in
+                   enumerate(old[start:len(old) - end]))
+    items = []
+    for obj in new[start:len(new) - end]:
+        index = indexes.get(id(obj))
+        items.append(obj if index is None or obj in dirty else index)
+    return start, len(old) - end - start, items
+
+
+class JournalBuffer(StringIO.StringIO):
+    # savers close file object after writing
+    def close(self):
+        pass
+
+
+def save_objects(appdata, objs):
+    """
+    Returns SK2 data of document which page contains provided objects.
+    """
+    doc = SK2_Presenter(appdata)
+    try:
+        doc.methods.get_layer(doc.methods.get_page()).childs = objs
+        fileptr = JournalBuffer()
+        get_saver_by_id(uc2const.SK2)(doc, fileptr=fileptr)
+        return fileptr.getvalue()
+    finally:
+        doc.close()
+
+
+def save_model(appdata, model):
+    """
+    Returns SK2 data of document model (detached copy of document).
+    """
+    doc = SK2_Presenter(appdata)
+    try:
+        doc.model = model
+        fileptr = JournalBuffer()
+        get_saver_by_id(uc2const.SK2)(doc, fileptr=fileptr)
+        return fileptr.getvalue()
+    finally:
+        doc.close()
+
+
+def load_document(appdata, data):
+    loader = get_loader_by_id(uc2const.SK2)
+    return loader(appdata, None, StringIO.StringIO(data))
+
+
+def apply_transaction(appdata, layers, payload):
+    """
+    Replays transaction record on layers {key: layer} of document.
+    """
+    header, data = payload.split('\n', 1)
+    info = json.loads(header)
+    objs = []
+    if data:
+        doc = load_document(appdata, zlib.decompress(data))
+        objs = doc.methods.get_layer(doc.methods.get_page()).childs
+    objs = iter(objs)
+    for key, start, count, items in info['layers']:
+        layer = layers[key]
+        old = layer.childs
+        middle = []
+        for item in items:
+            if item is None:
+                obj = next(objs)
+                obj.parent = layer
+            else:
+                obj = old[item]
+            middle.append(obj)
+        layer.childs = old[:start] + middle + old[start + count:]
+
+
+def restore_document(appdata, data, transactions, doc_file):
+    """
+    Replays transaction records on checkpoint document and saves
+    result into doc_file. Returns number of transactions which
+    cannot be replayed.
+    """
+    doc = load_document(appdata, data)
+    try:
+        layers = get_layer_keys(doc.methods)
+        for index, payload in enumerate(transactions):
+            try:
+                apply_transaction(appdata, layers, payload)
+            except Exception as e:
+                LOG.error('Cannot replay journal transaction %s', e)
+                return len(transactions) - index
+        get_saver_by_id(uc2const.SK2)(doc, doc_file)
+    finally:
+        doc.close()
+    return 0
+
+
+def is_process_alive(pid):
+    if os.name == 'nt':
+        return pid == os.getpid()
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def get_orphan_journals(journal_dir):
+    """
+    Returns journals left by terminated application instances.
+    """
+    result = []
+    if not fsutils.isdir(journal_dir):
+        return result
+    for name in sorted(os.listdir(fsutils.get_sys_path(journal_dir))):
+        if not name.endswith(EXTENSION):
+            continue
+        try:
+            pid = int(name.split('-')[0])
+        except ValueError:
+            continue
+        if not is_process_alive(pid):
+            result.append(os.path.join(journal_dir, name))
+    return result
+
+
+class JournalWriter(threading.Thread):
+    """
+    Background journal writer. Document copies of checkpoints and objects
+    of transactions are serialized and compressed by writer thread,
+    records are appended to the file as they come, fsync is batched by
+    sync interval. Transactions are dropped after failed record until
+    next checkpoint, so broken flag requests new checkpoint.
+    """
+    path = ''
+    appdata = None
+    queue = None
+    sync_interval = 5.0
+    snap_size = 0
+    delta_size = 0
+    broken = False
+
+    def __init__(self, path, appdata, sync_interval=5.0):
+        threading.Thread.__init__(self, name='JournalWriter')
+        self.daemon = True
+        self.path = path
+        self.appdata = appdata
+        self.sync_interval = sync_interval
+        self.queue = Queue.Queue()
+
+    def write(self, data):
+        self.queue.put(data)
+
+    def write_checkpoint(self, model):
+        self.queue.put((CHECKPOINT, model))
+
+    def write_transaction(self, info, objs):
+        self.queue.put((TRANSACTION, info, objs))
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def pack(self, item):
+        if not isinstance(item, tuple):
+            return item
+        if item[0] == CHECKPOINT:
+            try:
+                data = zlib.compress(save_model(self.appdata, item[1]), 1)
+            except Exception as e:
+                LOG.error('Cannot make journal checkpoint %s', e)
+                self.broken = True
+                return ''
+            self.snap_size = len(data)
+            self.delta_size = 0
+            self.broken = False
+            return pack_record(CHECKPOINT, data)
+        if self.broken:
+            return ''
+        info, objs = item[1:]
+        try:
+            data = ''
+            if objs:
+                data = zlib.compress(save_objects(self.appdata, objs), 1)
+        except Exception as e:
+            LOG.error('Cannot write journal transaction %s', e)
+            self.broken = True
+            return ''
+        payload = json.dumps(info) + '\n' + data
+        self.delta_size += len(payload)
+        return pack_record(TRANSACTION, payload)
+
+    def run(self):
+        fileptr = open(fsutils.get_sys_path(self.path), 'wb')
+        fileptr.write(HEADER.pack(MAGIC, VERSION))
+        dirty = True
+        last_sync = 0.0
+        try:
+            while True:
+                timeout = max(self.sync_interval -
+                              (time.time() - last_sync), 0.0)
+                try:
+                    item = self.queue.get(True, timeout) \
+                        if dirty else self.queue.get()
+                except Queue.Empty:
+                    item = ''
+                if item is None:
+                    break
+                data = self.pack(item)
+                if data:
+                    fileptr.write(data)
+                    dirty = True
+                if dirty and time.time() - last_sync >= self.sync_interval:
+                    fileptr.flush()
+                    os.fsync(fileptr.fileno())
+                    last_sync = time.time()
+                    dirty = False
+        except Exception as e:
+            LOG.error('Cannot write journal <%s> %s', self.path, e)
+        finally:
+            fileptr.close()
+
+
+class DocumentJournal(object):
+    """
+    Append-only crash recovery journal of the document. Each document
+    transaction adds record with changed parts of layers childs lists
+    (copies of changed objects and indexes of kept ones), so journal
+    is replayed from checkpoint (SK2 data) on recovery. Checkpoints are
+    requested on first change, on changes outside of layers childs and
+    when transaction records outgrow previous checkpoint. Requested
+    checkpoint is taken by timer not often than checkpoint interval,
+    changes meanwhile are covered by it. Checkpoint is a document copy
+    which is serialized by writer thread. Changes are reported by
+    PresenterAPI. Journal is removed on document closing and restarted
+    on saving.
+    """
+    presenter = None
+    journal_dir = ''
+    path = ''
+    writer = None
+    seq = 0
+    last_checkpoint = 0.0
+    layers = None
+    dirty = None
+    dirty_layers = None
+    full = False
+    pending = False
+    timer = None
+
+    def __init__(self, presenter, journal_dir):
+        self.presenter = presenter
+        self.journal_dir = journal_dir
+        self.timer = wal.CanvasTimer(presenter.app.mw.mdi,
+                                     delay=CHECKPOINT_DELAY,
+                                     on_timer=self.on_timer)
+        self.start()
+        eventloop = self.presenter.eventloop
+        eventloop.connect(eventloop.DOC_MODIFIED, self.on_modified)
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def start(self):
+        name = '%d-%s%s' % (os.getpid(), uuid.uuid4().hex[:8], EXTENSION)
+        self.path = os.path.join(self.journal_dir, name)
+        self.writer = JournalWriter(self.path, self.presenter.app.appdata,
+                                    config.journal_sync_interval)
+        self.writer.start()
+        meta = {'doc_name': self.presenter.doc_name,
+                'doc_file': self.presenter.doc_file}
+        self.writer.write(pack_record(META, json.dumps(meta)))
+        self.seq = 0
+        # first change requests checkpoint
+        self.layers = None
+        self.last_checkpoint = 0.0
+        self.dirty = set()
+        self.dirty_layers = {}
+        self.full = False
+        self.pending = False
+
+    def close(self):
+        self.timer.stop()
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+        if fsutils.exists(self.path):
+            fsutils.remove(self.path)
+
+    def reset(self):
+        """
+        Restarts journal when document is saved.
+        """
+        self.close()
+        self.start()
+
+    def update(self, objs):
+        """
+        Marks changed (inserted, deleted or modified) objects.
+        """
+        for obj in objs:
+            top = get_top_object(obj)
+            if top is None:
+                self.full = True
+                continue
+            self.dirty.add(top)
+            self.dirty_layers[id(top.parent)] = top.parent
+
+    def update_layers(self, layers):
+        """
+        Marks layers which childs lists are replaced.
+        """
+        for layer in layers:
+            self.dirty_layers[id(layer)] = layer
+
+    def invalidate(self):
+        self.full = True
+
+    def on_modified(self, *args):
+        self.seq += 1
+        if self.pending or self.layers is None or self.full or \
+                self.writer.broken or not self.dirty_layers:
+            # document is changed outside of layers childs
+            self.request_checkpoint()
+        elif not self.write_transaction():
+            self.request_checkpoint()
+        elif self.writer.delta_size > self.writer.snap_size:
+            # transaction records outgrow checkpoint
+            self.request_checkpoint()
+
+    def request_checkpoint(self):
+        # changes are covered by requested checkpoint
+        self.dirty = set()
+        self.dirty_layers = {}
+        self.full = False
+        self.pending = True
+        if not self.timer.is_running():
+            self.timer.start()
+
+    def on_timer(self):
+        if not self.pending:
+            self.timer.stop()
+        elif time.time() - self.last_checkpoint >= \
+                config.journal_checkpoint_interval:
+            self.timer.stop()
+            self.checkpoint()
+
+    def write_transaction(self):
+        """
+        Writes changes of dirty layers. Returns False if changed layer
+        is unknown since last checkpoint.
+        """
+        for layer in self.dirty_layers.values():
+            if id(layer) not in self.layers:
+                return False
+        records = []
+        copies = []
+        for layer in self.dirty_layers.values():
+            key, old = self.layers[id(layer)]
+            new = [] + layer.childs
+            start, count, items = get_splice(old, new, self.dirty)
+            for index, item in enumerate(items):
+                if not isinstance(item, int):
+                    copies.append(item.copy())
+                    items[index] = None
+            records.append([key, start, count, items])
+            self.layers[id(layer)] = (key, new)
+        info = {'seq': self.seq, 'time': time.time(), 'layers': records}
+        self.writer.write_transaction(info, copies)
+        self.dirty = set()
+        self.dirty_layers = {}
+        return True
+
+    def checkpoint(self):
+        self.dirty = set()
+        self.dirty_layers = {}
+        self.full = False
+        self.pending = False
+        try:
+            model = self.presenter.model.copy()
+        except Exception as e:
+            LOG.error('Cannot make journal checkpoint %s', e)
+            self.layers = None
+            return
+        # copy is serialized by writer
+        self.writer.write_checkpoint(model)
+        keys = get_layer_keys(self.presenter.methods)
+        self.layers = dict((id(layer), (key, [] + layer.childs))
+                           for key, layer in keys.items())
+        self.last_checkpoint = time.time()
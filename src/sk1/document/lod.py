@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+from collections import OrderedDict
+
+from sk1.document.hittest import flatten_cpath, get_segment_distance2
+
+# simplification tolerance in pixels
+LOD_TOLERANCE = 0.5
+# paths with less flattened points are rendered as is
+LOD_MIN_POINTS = 64
+# paths are simplified when their nodes are denser than
+# one per this number of bbox perimeter pixels (zoomed out)
+LOD_NODE_SPACING = 2.0
+# number of zoom buckets per zoom doubling
+LOD_BUCKETS = 2
+# number of simplified paths kept in cache
+CACHE_SIZE = 4096
+
+
+def simplify_polyline(points, tolerance):
+    """
+    Douglas-Peucker simplification of polyline. Returns list of points
+    which deviates from original polyline not more than tolerance.
+    """
+    if len(points) < 3:
+        return list(points)
+    tolerance2 = tolerance * tolerance
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist = 0.0
+        index = 0
+        start, end = points[first], points[last]
+        for i in range(first + 1, last):
+            dist = get_segment_distance2(points[i], start, end)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if max_dist > tolerance2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, flag in zip(points, keep) if flag]
+
+
+def get_zoom_bucket(zoom):
+    return int(math.floor(math.log(zoom, 2) * LOD_BUCKETS))
+
+
+def is_zoomed_out(obj, zoom):
+    """
+    Checks whether path nodes are denser than screen pixels can show.
+    """
+    bbox = obj.cache_bbox
+    perimeter = 2.0 * (abs(bbox[2] - bbox[0]) + abs(bbox[3] - bbox[1]))
+    nodes = sum(len(path[1]) + 1 for path in obj.paths)
+    return nodes * LOD_NODE_SPACING > perimeter * zoom
+
+
+class LODCache(object):
+    """
+    Simplified variants of complex object paths. Paths are flattened
+    and simplified for zoom bucket with tolerance of its highest zoom,
+    so simplification is valid for whole bucket. Paths are simplified
+    only if they are zoomed out at highest zoom of bucket. Entries are
+    bound to object cache_cpath and become stale when object is updated.
+    """
+    cache = None
+
+    def __init__(self):
+        self.cache = OrderedDict()
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def clear(self):
+        self.cache = OrderedDict()
+
+    def get_polylines(self, obj, zoom):
+        """
+        Returns list of (points, closed flag) simplified polylines
+        of object path or None if path is too simple for simplification
+        or is not zoomed out.
+        """
+        cpath = obj.cache_cpath
+        bucket = get_zoom_bucket(zoom)
+        key = id(obj)
+        item = self.cache.pop(key, None)
+        if item is None or item[0] is not cpath or item[1] != bucket:
+            zoom = 2.0 ** (float(bucket + 1) / LOD_BUCKETS)
+            item = (cpath, bucket, self.simplify(obj, zoom))
+        self.cache[key] = item
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return item[2]
+
+    @staticmethod
+    def simplify(obj, zoom):
+        if not is_zoomed_out(obj, zoom):
+            return None
+        tolerance = LOD_TOLERANCE / zoom
+        polylines = flatten_cpath(obj.cache_cpath, tolerance / 2.0)
+        if sum(len(item[0]) for item in polylines) < LOD_MIN_POINTS:
+            return None
+        return [(simplify_polyline(points, tolerance / 2.0), closed)
+                for points, closed, bbox in polylines]
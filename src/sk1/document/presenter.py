@@ -19,14 +19,18 @@ import logging
 import os
 from copy import deepcopy
 
-from sk1 import _, events, modes
+from sk1 import _, config, events, modes
 from sk1.dialogs import ProgressDialog
 from sk1.document.api import PresenterAPI
+from sk1.document.asyncload import AsyncLoader, is_async_supported
 from sk1.document.canvas import AppCanvas
+from sk1.document.docstats import DocStatistics
 from sk1.document.eventloop import EventLoop
+from sk1.document.journal import DocumentJournal
 from sk1.document.ruler import RulerCorner, Ruler
 from sk1.document.selection import Selection
 from sk1.document.snapping import SnapManager
+from sk1.document.spatial import SpatialIndex
 from uc2 import uc2const
 from uc2.formats import get_loader, get_saver
 from uc2.formats.sk2.sk2_presenter import SK2_Presenter
@@ -53,28 +57,47 @@ class SK1Presenter:
     eventloop = None
     canvas = None
     selection = None
+    spatial = None
+    stats = None
     traced_objects = None
     snap = None
+    journal = None
     text_obj_style = None
 
-    def __init__(self, app, doc_file='', silent=False, template=False):
+    def __init__(self, app, doc_file='', silent=False, template=False,
+                 doc_presenter=None):
         self.app = app
 
         self.eventloop = EventLoop(self)
         self.selection = Selection(self)
+        self.spatial = SpatialIndex(self)
+        self.stats = DocStatistics(self)
 
         loader = None
-        if doc_file:
+        if doc_file and doc_presenter is None:
             loader = get_loader(doc_file)
             if not loader:
                 raise IOError(_('Loader is not found for <%s>') % doc_file)
 
-        if loader and silent:
+        if doc_presenter is not None:
+            # document is already loaded by batch loader
+            self.doc_presenter = doc_presenter
+            self.doc_file = self.doc_presenter.doc_file
+            self.doc_name = self.get_doc_name(self.doc_file)
+        elif loader and silent:
             self.doc_presenter = loader(app.appdata, doc_file)
         elif doc_file and not silent:
-            pd = ProgressDialog(_('Opening file...'), self.app.mw)
+            async_loader = None
+            if config.async_loading and is_async_supported(doc_file):
+                async_loader = AsyncLoader(app.appdata, doc_file)
+            pd = ProgressDialog(_('Opening file...'), self.app.mw,
+                                cancelable=async_loader is not None)
             try:
-                self.doc_presenter = pd.run(loader, [app.appdata, doc_file])
+                if async_loader:
+                    self.doc_presenter = pd.run(async_loader.load, [pd])
+                else:
+                    self.doc_presenter = pd.run(loader,
+                                                [app.appdata, doc_file])
                 if not self.doc_presenter:
                     LOG.error('Cannot load <%s>', doc_file)
                     raise IOError(_('Cannot load <%s>') % doc_file)
@@ -82,12 +105,12 @@ class SK1Presenter:
                 raise
             finally:
                 pd.destroy()
+                if async_loader:
+                    async_loader.destroy()
 
             if not template:
                 self.doc_file = self.doc_presenter.doc_file
-                self.doc_name = os.path.basename(self.doc_file)
-                ext = uc2const.FORMAT_EXTENSION[uc2const.SK2][0]
-                self.doc_name = change_file_extension(self.doc_name, ext)
+                self.doc_name = self.get_doc_name(self.doc_file)
             else:
                 self.doc_name = self.app.get_new_docname()
                 self.doc_presenter.doc_file = ''
@@ -110,6 +133,15 @@ class SK1Presenter:
         self.canvas.set_mode()
         self.eventloop.connect(self.eventloop.DOC_MODIFIED, self.modified)
         self.snap = SnapManager(self)
+        if config.undo_journal:
+            journal_dir = self.app.appdata.app_journal_dir
+            self.journal = DocumentJournal(self, journal_dir)
+
+    @staticmethod
+    def get_doc_name(doc_file):
+        doc_name = os.path.basename(doc_file)
+        ext = uc2const.FORMAT_EXTENSION[uc2const.SK2][0]
+        return change_file_extension(doc_name, ext)
 
     def set_title(self):
         title = self.doc_name
@@ -170,11 +202,14 @@ class SK1Presenter:
 
     def close(self):
         # self.app.default_cms.unregistry_cm(self.cms)
+        if self.journal:
+            self.journal.close()
+            self.journal.destroy()
         self.eventloop.destroy()
         self.api.destroy()
         self.doc_presenter.close()
         for item in [self.canvas, self.corner, self.vruler, self.hruler,
-                     self.selection, self.snap]:
+                     self.selection, self.spatial, self.stats, self.snap]:
             item.destroy()
 
         items = self.__dict__.keys()
@@ -244,6 +279,8 @@ class SK1Presenter:
         self.saved = True
         self.set_title()
         self.api.save_mark()
+        if self.journal:
+            self.journal.reset()
         events.emit(events.DOC_SAVED, self)
 
     def set_active_page(self, page_num=0):
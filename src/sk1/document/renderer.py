@@ -17,9 +17,15 @@
 
 import cairo
 import math
+import wal
 from copy import deepcopy
 
 from sk1 import config
+from sk1.document.geometry import enlarge_bbox, get_stroke_width, \
+    get_visual_bbox
+from sk1.document.lod import LODCache
+from sk1.document.tiles import DRAFT, FULL, Tile, TileCache, TileJob, \
+    TileWorker
 from uc2 import libcairo, libgeom
 from uc2 import uc2const, sk2const
 from uc2.formats.sk2.crenderer import CairoRenderer
@@ -28,6 +34,20 @@ CAIRO_BLACK = [0.0, 0.0, 0.0]
 CAIRO_GRAY = [0.0, 0.0, 0.0, 0.5]
 CAIRO_WHITE = [1.0, 1.0, 1.0]
 
+# polling interval of background tile rendering, in ms
+RENDER_POLL_DELAY = 30
+
+LOD_CAPS = {
+    sk2const.CAP_BUTT: cairo.LINE_CAP_BUTT,
+    sk2const.CAP_ROUND: cairo.LINE_CAP_ROUND,
+    sk2const.CAP_SQUARE: cairo.LINE_CAP_SQUARE,
+}
+LOD_JOINS = {
+    sk2const.JOIN_MITER: cairo.LINE_JOIN_MITER,
+    sk2const.JOIN_ROUND: cairo.LINE_JOIN_ROUND,
+    sk2const.JOIN_BEVEL: cairo.LINE_JOIN_BEVEL,
+}
+
 
 class PDRenderer(CairoRenderer):
     direct_matrix = None
@@ -41,6 +61,20 @@ class PDRenderer(CairoRenderer):
     doc_methods = None
     for_display = True
     temp_surface = None
+    tiles = None
+    cull_bbox = None
+    layer_bboxes = None
+    layers = None
+    job_layers = None
+    lod = None
+    checker_pattern = None
+    draft = False
+    drawn_count = 0
+    culled_count = 0
+    worker = None
+    jobs = None
+    render_timer = None
+    polling = False
 
     frame = []
     snap = []
@@ -53,8 +87,19 @@ class PDRenderer(CairoRenderer):
         CairoRenderer.__init__(self, cms)
         self.canvas = canvas
         self.direct_matrix = cairo.Matrix(1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+        self.tiles = TileCache(config.tile_size, config.tile_cache_size)
+        self.layer_bboxes = {}
+        self.lod = LODCache()
+        self.jobs = {}
 
     def destroy(self):
+        if self.worker is not None:
+            self.render_timer.stop()
+            self.cancel_jobs()
+            self.worker.stop()
+            self.worker.renderer.destroy()
+        self.tiles.destroy()
+        self.lod.destroy()
         items = self.__dict__.keys()
         for item in items:
             self.__dict__[item] = None
@@ -122,8 +167,16 @@ class PDRenderer(CairoRenderer):
         self.doc_methods = self.presenter.methods
         self.cms = self.presenter.cms
         self.start()
-        self.paint_page()
-        self.render_doc()
+        self.drawn_count = self.culled_count = 0
+        if config.tiled_rendering:
+            self.paint_tiles()
+        else:
+            self.cull_bbox = self.get_view_bbox()
+            try:
+                self.paint_page()
+                self.render_doc()
+            finally:
+                self.cull_bbox = None
         self.render_grid()
         self.render_guides()
 
@@ -141,6 +194,367 @@ class PDRenderer(CairoRenderer):
     def finalize(self):
         self.canvas.dc.draw_surface(self.temp_surface, 0, 0, False)
 
+    # ------TILED RENDERING
+
+    def invalidate_tiles(self, damage=None):
+        """
+        Drops all cached tiles or marks tiles damaged by provided
+        list of (object, visual bbox) pairs.
+        """
+        self.layers = None
+        if damage is None:
+            self.layer_bboxes = {}
+            self.tiles.invalidate()
+            self.cancel_jobs()
+            return
+        for obj, bbox in damage:
+            layer = obj
+            while layer is not None and not layer.is_layer:
+                layer = layer.parent
+            if layer is None:
+                self.layer_bboxes = {}
+            else:
+                self.layer_bboxes.pop(id(layer), None)
+            if bbox:
+                self.tiles.invalidate(bbox)
+                self.cancel_jobs(bbox)
+
+    def paint_tiles(self):
+        canvas = self.canvas
+        self.tiles.set_view(canvas.trafo, id(self.presenter.active_page),
+                            canvas.draft_view, canvas.stroke_view)
+        threaded = config.threaded_rendering
+        if threaded:
+            self.collect_tiles()
+        ctx = self.ctx
+        ctx.set_matrix(self.direct_matrix)
+        keys = self.tiles.get_visible_keys(self.width, self.height)
+        for key in keys:
+            tile = self.tiles.get(key)
+            if tile is None:
+                if not threaded:
+                    tile = self.render_tile(key)
+                    self.tiles.put(key, tile)
+                else:
+                    if key not in self.jobs:
+                        self.request_tile(key)
+                    continue
+            elif tile.damage:
+                self.repair_tile(key, tile)
+            if threaded and tile.draft and key not in self.jobs:
+                self.request_tile(key, FULL)
+            x, y = self.tiles.get_tile_position(key)
+            ctx.set_source_surface(tile.surface, x, y)
+            ctx.paint()
+        ctx.set_matrix(canvas.matrix)
+        if self.jobs:
+            # jobs out of the view are stale
+            keys = set(keys)
+            for key in self.jobs.keys():
+                if key not in keys:
+                    self.jobs.pop(key).cancelled = True
+
+    # ------BACKGROUND RENDERING
+
+    def get_worker(self):
+        if self.worker is None:
+            renderer = PDRenderer(self.canvas, self.presenter.cms)
+            renderer.presenter = self.presenter
+            renderer.doc_methods = self.doc_methods
+            self.worker = TileWorker(renderer)
+            self.worker.start()
+            self.render_timer = wal.CanvasTimer(self.canvas.app.mw.mdi,
+                                                delay=RENDER_POLL_DELAY,
+                                                on_timer=self.check_jobs)
+        return self.worker
+
+    def request_tile(self, key, stage=DRAFT):
+        """
+        Queues tile for background rendering. Missing tiles are
+        rendered as draft first, draft tiles are refined.
+        """
+        job = TileJob(key, self.tiles.generation, self.get_page_layers(),
+                      self.tiles.get_tile_matrix(key),
+                      self.tiles.get_tile_bbox(key), stage)
+        self.jobs[key] = job
+        self.get_worker().submit(job)
+        if not self.polling:
+            self.polling = True
+            self.render_timer.start()
+
+    def cancel_jobs(self, bbox=None):
+        """
+        Cancels all jobs or jobs of tiles overlapped by document bbox.
+        """
+        for key, job in self.jobs.items():
+            if bbox is None or libgeom.is_bbox_overlap(job.bbox, bbox):
+                job.cancelled = True
+                del self.jobs[key]
+
+    def collect_tiles(self):
+        if self.worker is None:
+            return
+        generation = self.tiles.generation
+        for key, job in self.jobs.items():
+            if not job.generation == generation:
+                job.cancelled = True
+                del self.jobs[key]
+        for job, stage, surface in self.worker.get_results():
+            if job.cancelled or self.jobs.get(job.key) is not job:
+                continue
+            if surface is None:
+                # fallback to synchronous rendering
+                del self.jobs[job.key]
+                self.tiles.put(job.key, self.render_tile(job.key))
+                continue
+            self.tiles.put(job.key, Tile(surface, job.bbox, stage == DRAFT))
+            if stage == FULL:
+                del self.jobs[job.key]
+
+    def check_jobs(self):
+        if self.presenter is not self.canvas.app.current_doc:
+            self.polling = False
+        elif self.worker.has_results():
+            self.canvas.force_redraw()
+        elif not self.jobs:
+            self.polling = False
+        if not self.polling:
+            self.render_timer.stop()
+
+    def render_job(self, job):
+        """
+        Renders tile job into new surface. Called from worker thread
+        on worker's own renderer instance.
+        """
+        surface = self.tiles.create_surface()
+        self.draft = job.stage == DRAFT
+        self.job_layers = job.layers
+        try:
+            self._render_into(cairo.Context(surface), job.matrix, job.bbox)
+        finally:
+            self.draft = False
+            self.job_layers = None
+        return surface
+
+    def _render_into(self, ctx, matrix, cull_bbox):
+        self.ctx, ctx = ctx, self.ctx
+        self.ctx.set_matrix(matrix)
+        # one pixel gap for antialiased edges
+        self.cull_bbox = enlarge_bbox(cull_bbox, 1.0 / self.canvas.zoom)
+        try:
+            self.paint_page()
+            self.render_doc()
+        finally:
+            self.cull_bbox = None
+            self.ctx = ctx
+
+    def render_tile(self, key):
+        tile = self.tiles.create_tile(key)
+        self._render_into(cairo.Context(tile.surface),
+                          self.tiles.get_tile_matrix(key), tile.bbox)
+        return tile
+
+    def repair_tile(self, key, tile):
+        """
+        Repaints damaged areas of the tile only. Damaged areas are
+        clipped in device space with pixel aligned rectangles.
+        """
+        matrix = self.tiles.get_tile_matrix(key)
+        size = self.tiles.tile_size
+        ctx = cairo.Context(tile.surface)
+        cull_bbox = []
+        for bbox in tile.damage:
+            x0, y0 = matrix.transform_point(bbox[0], bbox[1])
+            x1, y1 = matrix.transform_point(bbox[2], bbox[3])
+            x0, x1 = min(x0, x1), max(x0, x1)
+            y0, y1 = min(y0, y1), max(y0, y1)
+            x0 = max(int(math.floor(x0)) - 1, 0)
+            y0 = max(int(math.floor(y0)) - 1, 0)
+            x1 = min(int(math.ceil(x1)) + 1, size)
+            y1 = min(int(math.ceil(y1)) + 1, size)
+            if x1 > x0 and y1 > y0:
+                ctx.rectangle(x0, y0, x1 - x0, y1 - y0)
+                cull_bbox = libgeom.sum_bbox(cull_bbox, bbox) \
+                    if cull_bbox else [] + bbox
+        tile.damage = []
+        if not cull_bbox:
+            ctx.new_path()
+            return
+        ctx.clip()
+        ctx.set_operator(cairo.OPERATOR_CLEAR)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        self._render_into(ctx, matrix, cull_bbox)
+
+    def get_layer_bboxes(self, layer):
+        childs, bboxes = self.layer_bboxes.get(id(layer), (None, None))
+        if childs is not layer.childs or len(bboxes) != len(childs):
+            childs = layer.childs
+            bboxes = [get_visual_bbox(obj) for obj in childs]
+            self.layer_bboxes[id(layer)] = (childs, bboxes)
+        return bboxes
+
+    def get_page_layers(self):
+        """
+        Returns (layer, childs, bboxes) snapshot of active page layers.
+        Snapshot is shared by tile jobs until next document change,
+        worker renders snapshot of its job.
+        """
+        if self.job_layers is not None:
+            return self.job_layers
+        page = self.presenter.active_page
+        if self.layers is None or self.layers[0] is not page:
+            layers = tuple((layer, tuple(layer.childs),
+                            self.get_layer_bboxes(layer))
+                           for layer in page.childs)
+            self.layers = (page, layers)
+        return self.layers[1]
+
+    def get_visible_childs(self, childs, bboxes):
+        if self.cull_bbox is None:
+            return childs
+        cull_bbox = self.cull_bbox
+        visible = [obj for obj, bbox in zip(childs, bboxes)
+                   if bbox and libgeom.is_bbox_overlap(bbox, cull_bbox)]
+        self.culled_count += len(childs) - len(visible)
+        return visible
+
+    def get_view_bbox(self):
+        """
+        Returns document bbox of canvas window with one pixel gap.
+        """
+        x0, y0 = self.canvas.win_to_doc([0.0, 0.0])
+        x1, y1 = self.canvas.win_to_doc([self.width, self.height])
+        bbox = [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+        return enlarge_bbox(bbox, 1.0 / self.canvas.zoom)
+
+    def render_object(self, ctx, obj):
+        """
+        Culls invisible objects recursively. Top level objects are
+        already culled by layer bboxes, childs of groups and containers
+        are checked unless parent is entirely visible. Container clip
+        object is never culled.
+        """
+        cull_bbox = self.cull_bbox
+        parent = obj.parent
+        if cull_bbox is None or (parent.is_container and
+                                 parent.childs[0] is obj):
+            self.draw_object(ctx, obj)
+            return
+        bbox = None
+        if not parent.is_layer:
+            bbox = get_visual_bbox(obj)
+            if not bbox or not libgeom.is_bbox_overlap(bbox, cull_bbox):
+                self.culled_count += 1
+                return
+        if obj.childs and libgeom.is_bbox_in_rect(
+                cull_bbox, bbox or get_visual_bbox(obj)):
+            self.cull_bbox = None
+            try:
+                self.draw_object(ctx, obj)
+            finally:
+                self.cull_bbox = cull_bbox
+        else:
+            self.draw_object(ctx, obj)
+
+    def draw_object(self, ctx, obj):
+        self.drawn_count += 1
+        if config.lod_rendering and obj.is_primitive and \
+                not obj.is_pixmap and not self.contour_flag and \
+                obj.parent is not None and not (
+                obj.parent.is_container and obj.parent.childs[0] is obj):
+            if self.render_lod(ctx, obj):
+                return
+        CairoRenderer.render_object(self, ctx, obj)
+
+    # ------LEVEL OF DETAIL
+
+    def get_lod_color(self, obj):
+        fill, stroke = obj.style[:2]
+        if fill and fill[1] == sk2const.FILL_SOLID:
+            return fill[2]
+        if fill and fill[1] == sk2const.FILL_GRADIENT:
+            return fill[2][2][0][1]
+        if stroke:
+            return stroke[2]
+        return None
+
+    def render_lod(self, ctx, obj):
+        """
+        Renders object with reduced level of detail. Objects smaller
+        than lod_object_size pixels are drawn as filled bbox, complex
+        paths of simply styled curves are drawn simplified. Returns False
+        if object should be rendered as is.
+        """
+        zoom = self.canvas.zoom
+        bbox = obj.cache_bbox
+        if not bbox:
+            return False
+        w = abs(bbox[2] - bbox[0])
+        h = abs(bbox[3] - bbox[1])
+        if max(w, h) * zoom < config.lod_object_size:
+            color = self.get_lod_color(obj)
+            if color is None:
+                return False
+            # at least one pixel
+            size = 1.0 / zoom
+            cx = (bbox[0] + bbox[2]) / 2.0
+            cy = (bbox[1] + bbox[3]) / 2.0
+            w, h = max(w, size), max(h, size)
+            ctx.rectangle(cx - w / 2.0, cy - h / 2.0, w, h)
+            ctx.set_source_rgba(*self.get_color(color))
+            ctx.fill()
+            return True
+
+        if not obj.is_curve:
+            return False
+        if obj.cache_arrows and \
+                any(item for pair in obj.cache_arrows for item in pair):
+            return False
+        fill, stroke = obj.style[:2]
+        if fill and not fill[1] == sk2const.FILL_SOLID:
+            return False
+        if stroke and stroke[3]:
+            # dashed stroke
+            return False
+        polylines = self.lod.get_polylines(obj, zoom)
+        if polylines is None:
+            return False
+
+        def append_path(closed_only=False):
+            ctx.new_path()
+            for points, closed in polylines:
+                if closed_only and not closed:
+                    continue
+                ctx.move_to(*points[0])
+                for point in points[1:]:
+                    ctx.line_to(*point)
+                if closed:
+                    ctx.close_path()
+
+        def stroke_path():
+            append_path()
+            ctx.set_line_width(get_stroke_width(obj))
+            ctx.set_line_cap(LOD_CAPS.get(stroke[4], cairo.LINE_CAP_BUTT))
+            ctx.set_line_join(LOD_JOINS.get(stroke[5], cairo.LINE_JOIN_MITER))
+            ctx.set_miter_limit(stroke[6])
+            ctx.set_source_rgba(*self.get_color(stroke[2]))
+            ctx.stroke()
+
+        if stroke and stroke[7]:
+            # stroke behind fill
+            stroke_path()
+        if fill:
+            append_path(fill[0] & sk2const.FILL_CLOSED_ONLY)
+            ctx.set_fill_rule(cairo.FILL_RULE_EVEN_ODD
+                              if fill[0] & sk2const.FILL_EVENODD
+                              else cairo.FILL_RULE_WINDING)
+            ctx.set_source_rgba(*self.get_color(fill[2]))
+            ctx.fill()
+        if stroke and not stroke[7]:
+            stroke_path()
+        return True
+
     def paint_page(self):
         self.ctx.set_line_width(1.0 / self.canvas.zoom)
         offset = 5.0 / self.canvas.zoom
@@ -169,40 +583,47 @@ class PDRenderer(CairoRenderer):
                 sy = dx - (h / 2.0 - float(int(h / (2.0 * dx))) * dx)
                 sx = dx - (w / 2.0 - float(int(w / (2.0 * dx))) * dx)
 
-            self.ctx.save()
-            self.ctx.rectangle(-w / 2.0, -h / 2.0, w, h)
-            self.ctx.clip()
-
+            # each pattern pixel is scaled to checker cell
+            pattern = self.get_checker_pattern(*page_fill[1])
+            scale = 1.0 / dx
+            pattern.set_matrix(cairo.Matrix(
+                scale, 0.0, 0.0, scale,
+                (w / 2.0 + sx) * scale, (h / 2.0 + sy) * scale))
             self.ctx.rectangle(-w / 2.0, -h / 2.0, w, h)
-            self.ctx.set_source_rgb(*page_fill[1][1])
+            self.ctx.set_source(pattern)
             self.ctx.fill()
 
-            self.ctx.set_source_rgb(*page_fill[1][0])
-
-            ypos = ystart = -h / 2.0 - sy
-            j = 0
-            while ypos < h / 2.0:
-                ypos = ystart + j * dx
-                xpos = xstart = -w / 2.0 - sx
-                i = 0
-                if j % 2:
-                    xpos = xstart = -w / 2.0 + dx - sx
-                while xpos < w / 2.0:
-                    xpos = xstart + i * dx * 2.0
-                    self.ctx.rectangle(xpos, ypos, dx, dx)
-                    self.ctx.fill()
-                    i += 1
-                j += 1
-            self.ctx.restore()
-
         if border:
             self.ctx.rectangle(-w / 2.0, -h / 2.0, w, h)
             self.ctx.set_source_rgb(*CAIRO_BLACK)
             self.ctx.stroke()
         self.ctx.set_antialias(cairo.ANTIALIAS_DEFAULT)
 
+    def get_checker_pattern(self, fg, bg):
+        """
+        Returns cached repeating 2x2 pixel checker pattern.
+        Pattern is recreated when page fill colors are changed.
+        """
+        colors = (tuple(fg), tuple(bg))
+        if self.checker_pattern is None or \
+                not self.checker_pattern[0] == colors:
+            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, 2, 2)
+            ctx = cairo.Context(surface)
+            ctx.set_source_rgb(*bg)
+            ctx.paint()
+            ctx.set_source_rgb(*fg)
+            ctx.rectangle(0, 0, 1, 1)
+            ctx.rectangle(1, 1, 1, 1)
+            ctx.fill()
+            pattern = cairo.SurfacePattern(surface)
+            pattern.set_extend(cairo.EXTEND_REPEAT)
+            pattern.set_filter(cairo.FILTER_NEAREST)
+            self.checker_pattern = (colors, pattern)
+        return self.checker_pattern[1]
+
     def render_doc(self):
-        if self.canvas.draft_view:
+        draft_view = self.canvas.draft_view or self.draft
+        if draft_view:
             self.antialias_flag = False
         else:
             self.antialias_flag = True
@@ -212,17 +633,16 @@ class PDRenderer(CairoRenderer):
         else:
             self.contour_flag = False
 
-        page = self.presenter.active_page
-        for layer in page.childs:
+        for layer, childs, bboxes in self.get_page_layers():
             if layer.properties[0]:
                 if self.canvas.stroke_view:
                     self.stroke_style = deepcopy(layer.style)
                     stroke = self.stroke_style[1]
                     stroke[1] = 1.0 / self.canvas.zoom
-                if not layer.properties[3] and not self.canvas.draft_view:
+                if not layer.properties[3] and not draft_view:
                     self.antialias_flag = False
-                self.render(self.ctx, layer.childs)
-                if not layer.properties[3] and not self.canvas.draft_view:
+                self.render(self.ctx, self.get_visible_childs(childs, bboxes))
+                if not layer.properties[3] and not draft_view:
                     self.antialias_flag = True
 
     # ------GUIDES RENDERING
@@ -297,34 +717,44 @@ class PDRenderer(CairoRenderer):
         x, y, gdx, gdy = grid_layer.grid
         x0, y0, dx, dy, sx, sy = self.calc_grid(x, y, gdx, gdy)
 
-        i = pos = 0
-        nul_i = round((x0 - sx) / dx)
-        while pos < self.width:
-            pos = sx + i * dx
-            i += 1
-            self.ctx.move_to(pos, 0)
-            self.ctx.line_to(pos, self.height)
-            self.ctx.stroke()
-            if dx == gdx * self.canvas.zoom and not (i - nul_i - 1) % 5:
-                self.ctx.move_to(pos, 0)
-                self.ctx.line_to(pos, self.height)
+        # every 5th line is stroked twice, so lines are collected
+        # into one path per direction and one for doubled lines
+        vlines, vmajor = self.get_grid_lines(
+            x0, sx, dx, self.width, dx == gdx * self.canvas.zoom)
+        hlines, hmajor = self.get_grid_lines(
+            y0, sy, dy, self.height, dy == gdy * self.canvas.zoom)
+        for lines in (vlines, vmajor):
+            if lines:
+                for pos in lines:
+                    self.ctx.move_to(pos, 0)
+                    self.ctx.line_to(pos, self.height)
                 self.ctx.stroke()
-
-        i = pos = 0
-        nul_i = round((y0 - sy) / dy)
-        while pos < self.height:
-            pos = sy + i * dy
-            i += 1
-            self.ctx.move_to(0, pos)
-            self.ctx.line_to(self.width, pos)
-            self.ctx.stroke()
-            if dy == gdy * self.canvas.zoom and not (i - nul_i - 1) % 5:
-                self.ctx.move_to(0, pos)
-                self.ctx.line_to(self.width, pos)
+        for lines in (hlines, hmajor):
+            if lines:
+                for pos in lines:
+                    self.ctx.move_to(0, pos)
+                    self.ctx.line_to(self.width, pos)
                 self.ctx.stroke()
 
         self.ctx.set_antialias(cairo.ANTIALIAS_DEFAULT)
 
+    @staticmethod
+    def get_grid_lines(start, shift, step, size, major_flag):
+        """
+        Returns window positions of grid lines and of every 5th line.
+        """
+        lines = []
+        major = []
+        i = pos = 0
+        nul_i = round((start - shift) / step)
+        while pos < size:
+            pos = shift + i * step
+            i += 1
+            lines.append(pos)
+            if major_flag and not (i - nul_i - 1) % 5:
+                major.append(pos)
+        return lines, major
+
     # ------MARKER RENDERING
 
     def start_soft_repaint(self):
@@ -27,6 +27,9 @@ from uc2.utils import fsutils
 HFONT = {}
 VFONT = {}
 
+# length of pre-rendered ruler strip in ruler lengths
+RULER_STRIP = 3
+
 
 def load_font(color=(0, 0, 0)):
     fntdir = 'ruler-font%dpx' % config.ruler_font_size
@@ -126,6 +129,12 @@ class Ruler(Painter):
     height = 0
     pointer = []
 
+    strip = None
+    strip_key = None
+    strip_origin = 0.0
+    strip_start = 0
+    strip_length = 0
+
     def __init__(self, presenter, vertical=True):
         self.presenter = presenter
         self.eventloop = presenter.eventloop
@@ -147,6 +156,8 @@ class Ruler(Painter):
     def check_config(self, *args):
         if args[0] in ('ruler_font_size', 'ruler_fg'):
             load_font(config.ruler_fg)
+        if args[0].startswith('ruler_'):
+            self.strip_key = None
 
     def calc_ruler(self):
         canvas = self.presenter.canvas
@@ -182,20 +193,22 @@ class Ruler(Painter):
         sy = (y0 / dy - math.floor(y0 / dy)) * dy
         return x0, y0, dx, dy, sx, sy
 
-    def get_ticks(self):
+    def get_ticks(self, start, end):
+        """
+        Returns ticks for window coordinates range from start to end.
+        """
         canvas = self.presenter.canvas
         pw, ph = self.presenter.get_page_size()
         origin = self.presenter.model.doc_origin
         unit = uc2const.unit_dict[self.presenter.model.doc_units]
-        w, h = self.dc.get_size()
         x0, y0, dx, dy, sx, sy = self.calc_ruler()
         small_ticks = []
         text_ticks = []
 
         if not self.vertical:
-            i = -1
-            pos = 0
-            while pos < w:
+            i = int(math.floor((start - sx) / dx))
+            pos = start
+            while pos < end:
                 pos = sx + i * dx
                 small_ticks.append(sx + i * dx)
                 if dx > 10:
@@ -209,10 +222,10 @@ class Ruler(Painter):
             unit_dx = dxt / (unit * canvas.zoom)
             float_flag = True if unit_dx < 1.0 else False
 
-            i = -1
-            pos = 0
+            i = int(math.floor((start - sxt) / dxt))
+            pos = start
             shift = 0.0 if origin == sk2const.DOC_ORIGIN_CENTER else pw / 2.0
-            while pos < w:
+            while pos < end:
                 pos = sxt + i * dxt
                 doc_pos = canvas.point_win_to_doc((pos, 0))[0] + shift
                 doc_pos *= uc2const.point_dict[self.presenter.model.doc_units]
@@ -224,9 +237,9 @@ class Ruler(Painter):
                 i += 1
 
         else:
-            i = -1
-            pos = 0
-            while pos < h:
+            i = int(math.floor((start - sy) / dy))
+            pos = start
+            while pos < end:
                 pos = sy + i * dy
                 small_ticks.append(sy + i * dy)
                 if dy > 10:
@@ -240,12 +253,12 @@ class Ruler(Painter):
             unit_dy = dyt / (unit * canvas.zoom)
             float_flag = True if unit_dy < 1.0 else False
 
-            i = -1
-            pos = 0
+            i = int(math.floor((start - syt) / dyt))
+            pos = start
             shift = 0.0 if origin == sk2const.DOC_ORIGIN_CENTER else ph / 2.0
             shift = -shift if origin == sk2const.DOC_ORIGIN_LU else shift
 
-            while pos < h:
+            while pos < end:
                 pos = syt + i * dyt
                 doc_pos = canvas.point_win_to_doc((0, pos))[1] + shift
                 if origin == sk2const.DOC_ORIGIN_LU:
@@ -260,6 +273,11 @@ class Ruler(Painter):
         return small_ticks, text_ticks
 
     def paint(self):
+        """
+        Blits slice of pre-rendered ruler strip. Strip is re-rendered
+        on zoom, units or origin change, or when scrolling goes out
+        of the strip or by non integer shift.
+        """
         if self.presenter is None:
             return
         w, h = self.dc.get_size()
@@ -267,25 +285,61 @@ class Ruler(Painter):
         if self.surface is None or self.width != w or self.height != h:
             self.surface = cairo.ImageSurface(fmt, w, h)
             self.width, self.height = w, h
-        self.ctx = cairo.Context(self.surface)
-        self.ctx.set_matrix(cairo.Matrix(1.0, 0.0, 0.0, 1.0, 0.0, 0.0))
+        length = h if self.vertical else w
+        x0, y0, dx, dy = self.calc_ruler()[:4]
+        origin, step = (y0, dy) if self.vertical else (x0, dx)
+        model = self.presenter.model
+        key = (self.presenter.canvas.zoom, step,
+               model.doc_units, model.doc_origin, w, h)
+        shift = origin - self.strip_origin
+        offset = self.strip_start + int(round(shift))
+        if not key == self.strip_key or abs(shift - round(shift)) > 1e-6 \
+                or offset > 0 or offset + self.strip_length < length:
+            self.render_strip(w, h, origin)
+            self.strip_key = key
+            offset = self.strip_start
+        ctx = cairo.Context(self.surface)
+        if self.vertical:
+            ctx.set_source_surface(self.strip, 0, offset)
+        else:
+            ctx.set_source_surface(self.strip, offset, 0)
+        ctx.paint()
+        self.dc.draw_surface(self.surface, 0, 0)
+
+    def render_strip(self, w, h, origin):
+        length = h if self.vertical else w
+        start = -length
+        end = start + RULER_STRIP * length
+        if self.vertical:
+            self.strip = cairo.ImageSurface(cairo.FORMAT_RGB24, w, end - start)
+        else:
+            self.strip = cairo.ImageSurface(cairo.FORMAT_RGB24, end - start, h)
+        self.strip_origin = origin
+        self.strip_start = start
+        self.strip_length = end - start
+
+        self.ctx = cairo.Context(self.strip)
         self.ctx.set_source_rgb(*config.ruler_bg)
         self.ctx.paint()
+        # strip is drawn in window coordinates
+        if self.vertical:
+            self.ctx.translate(0, -start)
+        else:
+            self.ctx.translate(-start, 0)
         self.ctx.set_antialias(cairo.ANTIALIAS_NONE)
         self.ctx.set_line_width(1.0)
         self.ctx.set_dash([])
         self.ctx.set_source_rgb(*config.ruler_fg)
         if self.vertical:
-            self.vrender(w, h)
+            self.vrender(w, start, end)
         else:
-            self.hrender(w, h)
-        self.dc.draw_surface(self.surface, 0, 0)
+            self.hrender(h, start, end)
 
-    def hrender(self, w, h):
-        self.ctx.move_to(0, h)
-        self.ctx.line_to(w, h)
+    def hrender(self, h, start, end):
+        self.ctx.move_to(start, h)
+        self.ctx.line_to(end, h)
 
-        small_ticks, text_ticks = self.get_ticks()
+        small_ticks, text_ticks = self.get_ticks(start, end)
         for item in small_ticks:
             self.ctx.move_to(item, h - config.ruler_small_tick)
             self.ctx.line_to(item, h - 1)
@@ -306,11 +360,11 @@ class Ruler(Painter):
                 self.ctx.paint()
                 pos += data[0]
 
-    def vrender(self, w, h):
-        self.ctx.move_to(w, 0)
-        self.ctx.line_to(w, h)
+    def vrender(self, w, start, end):
+        self.ctx.move_to(w, start)
+        self.ctx.line_to(w, end)
 
-        small_ticks, text_ticks = self.get_ticks()
+        small_ticks, text_ticks = self.get_ticks(start, end)
         for item in small_ticks:
             self.ctx.move_to(w - config.ruler_small_tick, item)
             self.ctx.line_to(w - 1, item)
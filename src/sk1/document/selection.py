@@ -110,8 +110,9 @@ class Selection:
         layers = self.presenter.get_editable_layers()
         rule = libgeom.is_bbox_overlap if overlap_flag \
             else libgeom.is_bbox_in_rect
+        spatial = self.presenter.spatial
         for layer in layers:
-            for obj in layer.childs:
+            for obj in spatial.get_objs_in_rect(layer, rect):
                 if rule(rect, obj.cache_bbox):
                     result.append(obj)
         self.add(result, True) if add_flag else self.set(result)
@@ -141,11 +142,12 @@ class Selection:
         layers.reverse()
         win_point = doc.canvas.doc_to_win(point)
         hit_surface = doc.canvas.hit_surface
+        # minimal size of fixed bbox in window coordinates
+        tolerance = 4.0 / doc.canvas.zoom
         for layer in layers:
             if result:
                 break
-            objs = [] + layer.childs
-            objs.reverse()
+            objs = doc.spatial.get_objs_at_point(layer, point, tolerance)
             for obj in objs:
                 bbox = self._get_fixed_bbox(obj)
                 d = 0.0
@@ -191,9 +193,10 @@ class Selection:
     def invert_selection(self):
         result = []
         layers = self.presenter.get_editable_layers()
+        selected = set(self.objs)
         for layer in layers:
             for child in layer.childs:
-                if child not in self.objs:
+                if child not in selected:
                     result.append(child)
         self.set(result)
 
@@ -216,9 +219,8 @@ class Selection:
         return result
 
     def remove(self, objs):
-        for obj in objs:
-            if obj in self.objs:
-                self.objs.remove(obj)
+        removed = set(objs)
+        self.objs = [obj for obj in self.objs if obj not in removed]
         self.center_offset = [0.0, 0.0]
         self.update()
 
@@ -226,20 +228,27 @@ class Selection:
         sorted_objs = []
         page = self.presenter.active_page
         layers = self.presenter.methods.get_active_layers(page)
+        selected = set(self.objs)
         for layer in layers:
             for child in layer.childs:
-                if child in self.objs:
+                if child in selected:
                     sorted_objs.append(child)
         self.objs = sorted_objs
 
     def add(self, objs, xor=False):
         added = False
+        selected = set(self.objs)
+        removed = set()
         for obj in objs:
-            if obj not in self.objs:
+            if obj not in selected:
                 self.objs.append(obj)
+                selected.add(obj)
                 added = True
             elif xor:
-                self.objs.remove(obj)
+                selected.discard(obj)
+                removed.add(obj)
+        if removed:
+            self.objs = [obj for obj in self.objs if obj not in removed]
         if added:
             self._sort_objs_by_zorder()
         self.center_offset = [0.0, 0.0]
@@ -16,12 +16,37 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import math
+from bisect import bisect_left, insort
 
 from uc2 import libgeom, uc2const, sk2const
 
 from sk1 import config
 from sk1.appconst import SNAP_TO_GRID, SNAP_TO_GUIDES, SNAP_TO_OBJECTS, \
     SNAP_TO_PAGE
+from sk1.document.geometry import get_top_object
+
+# membership of few changed objects is checked by layer scan
+MEMBER_SCAN = 16
+
+
+def get_nearest_value(values, value, distance):
+    """
+    Returns the nearest to value item of sorted values list if it is
+    closer than distance, otherwise None.
+    """
+    index = bisect_left(values, value)
+    result = None
+    for item in values[max(index - 1, 0):index + 1]:
+        if abs(item - value) < distance:
+            if result is None or abs(item - value) < abs(result - value):
+                result = item
+    return result
+
+
+def remove_value(values, value):
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
 
 
 class SnapManager:
@@ -48,10 +73,21 @@ class SnapManager:
     page_grid = []
     objects_grid = []
     guides_grid = []
+    objects_points = {}
+    objects_layers = None
+    dirty_objs = None
+    objects_valid = False
+
+    doc_version = 0
+    view_version = 0
+    versions = {}
 
     def __init__(self, presenter):
 
         self.active_snap = [None, None]
+        self.objects_points = {}
+        self.dirty_objs = set()
+        self.versions = {}
 
         self.presenter = presenter
         self.doc = self.presenter.doc_presenter
@@ -66,23 +102,50 @@ class SnapManager:
                                 SNAP_TO_OBJECTS: self.snap_point_to_objects,
                                 SNAP_TO_PAGE: self.snap_point_to_page, }
         el = self.presenter.eventloop
-        el.connect(el.VIEW_CHANGED, self.update)
-        el.connect(el.DOC_MODIFIED, self.update)
-        el.connect(el.PAGE_CHANGED, self.update)
+        el.connect(el.VIEW_CHANGED, self.view_changed)
+        el.connect(el.DOC_MODIFIED, self.doc_modified)
+        el.connect(el.PAGE_CHANGED, self.page_changed)
 
     def destroy(self):
         items = self.__dict__.keys()
         for item in items:
             self.__dict__[item] = None
 
+    def view_changed(self, *args):
+        self.view_version += 1
+
+    def doc_modified(self, *args):
+        self.doc_version += 1
+
+    def page_changed(self, *args):
+        self.doc_version += 1
+        self.invalidate_objects()
+
+    def _check_version(self, target, version):
+        if self.versions.get(target) == version:
+            return True
+        self.versions[target] = version
+        return False
+
     def update(self, *args):
-        if self.snap_to_guides:
+        """
+        Recalculates outdated snap data of enabled snap targets.
+        Grid depends on document and view, guides and page depend on
+        document only. Object snap points are stored in document
+        coordinates and are updated for changed objects.
+        """
+        doc_version = self.doc_version
+        view_version = (self.doc_version, self.view_version)
+        if self.snap_to_guides and \
+                not self._check_version(SNAP_TO_GUIDES, doc_version):
             self.update_guides_grid()
-        if self.snap_to_grid:
+        if self.snap_to_grid and \
+                not self._check_version(SNAP_TO_GRID, view_version):
             self.update_grid()
         if self.snap_to_objects:
             self.update_objects_grid()
-        if self.snap_to_page:
+        if self.snap_to_page and \
+                not self._check_version(SNAP_TO_PAGE, doc_version):
             self.update_page_grid()
 
     def update_grid(self):
@@ -99,16 +162,79 @@ class SnapManager:
                     self.guides_grid[1].append(child.position)
                 else:
                     self.guides_grid[0].append(child.position)
+        self.guides_grid[0].sort()
+        self.guides_grid[1].sort()
+
+    def update_objects(self, objs):
+        """
+        Marks changed objects for snap points recalculation.
+        """
+        for obj in objs:
+            top = get_top_object(obj)
+            if top is None:
+                self.invalidate_objects()
+                return
+            self.dirty_objs.add(top)
+
+    def invalidate_objects(self):
+        self.objects_valid = False
+        self.dirty_objs = set()
 
     def update_objects_grid(self):
+        if not self.objects_valid:
+            self._build_objects_grid()
+        elif self.dirty_objs:
+            self._sync_objects_grid()
+
+    def _build_objects_grid(self):
         self.objects_grid = [[], []]
+        self.objects_points = {}
+        self.dirty_objs = set()
         layers = self.presenter.get_visible_layers()
+        self.objects_layers = dict((id(layer), layer) for layer in layers)
         for layer in layers:
             for obj in layer.childs:
                 points = libgeom.bbox_middle_points(obj.cache_bbox)
+                self.objects_points[obj] = points
                 for point in points:
                     self.objects_grid[0].append(point[0])
                     self.objects_grid[1].append(point[1])
+        self.objects_grid[0].sort()
+        self.objects_grid[1].sort()
+        self.objects_valid = True
+
+    def _get_members(self, objs):
+        """
+        Returns changed objects which are childs of visible layers.
+        Only layers of changed objects are checked.
+        """
+        layer_objs = {}
+        for obj in objs:
+            layer = self.objects_layers.get(id(obj.parent))
+            if layer is not None and layer is obj.parent:
+                layer_objs.setdefault(id(layer), (layer, []))[1].append(obj)
+        members = set()
+        for layer, items in layer_objs.values():
+            if len(items) <= MEMBER_SCAN:
+                members.update(obj for obj in items if obj in layer.childs)
+            else:
+                members.update(set(items).intersection(layer.childs))
+        return members
+
+    def _sync_objects_grid(self):
+        members = self._get_members(self.dirty_objs)
+        xs, ys = self.objects_grid
+        for obj in self.dirty_objs:
+            for x, y in self.objects_points.pop(obj, []):
+                remove_value(xs, x)
+                remove_value(ys, y)
+            if obj in members:
+                points = libgeom.bbox_middle_points(obj.cache_bbox)
+                self.objects_points[obj] = points
+                for x, y in points:
+                    insort(xs, x)
+                    insort(ys, y)
+        self.dirty_objs = set()
 
     def update_page_grid(self):
         self._calc_page_grid()
@@ -155,7 +281,8 @@ class SnapManager:
 
     def _calc_page_grid(self):
         w, h = self.presenter.get_page_size()
-        self.page_grid = [[-w / 2.0, 0.0, w / 2.0], [-h / 2.0, 0.0, h / 2.0]]
+        self.page_grid = [sorted([-w / 2.0, 0.0, w / 2.0]),
+                          sorted([-h / 2.0, 0.0, h / 2.0])]
 
     def _snap_point_to_dict(self, point, doc_point, snap_dict):
         ret = False
@@ -167,22 +294,20 @@ class SnapManager:
         snap_dist = config.snap_distance / self.canvas.zoom
 
         if self.snap_x:
-            for item in snap_dict[0]:
-                if abs(item - doc_point[0]) < snap_dist:
-                    ret = True
-                    x = self.canvas.point_doc_to_win([item, doc_point[1]])[0]
-                    x_doc = item
-                    self.active_snap[0] = x_doc
-                    break
+            item = get_nearest_value(snap_dict[0], doc_point[0], snap_dist)
+            if item is not None:
+                ret = True
+                x = self.canvas.point_doc_to_win([item, doc_point[1]])[0]
+                x_doc = item
+                self.active_snap[0] = x_doc
 
         if self.snap_y:
-            for item in snap_dict[1]:
-                if abs(item - doc_point[1]) < snap_dist:
-                    ret = True
-                    y = self.canvas.point_doc_to_win([doc_point[0], item])[1]
-                    y_doc = item
-                    self.active_snap[1] = y_doc
-                    break
+            item = get_nearest_value(snap_dict[1], doc_point[1], snap_dist)
+            if item is not None:
+                ret = True
+                y = self.canvas.point_doc_to_win([doc_point[0], item])[1]
+                y_doc = item
+                self.active_snap[1] = y_doc
 
         return ret, [x, y], [x_doc, y_doc]
 
@@ -197,6 +322,7 @@ class SnapManager:
         self.snap_x = snap_x
         self.snap_y = snap_y
         self.active_snap = [None, None]
+        self.update()
 
         if win_point:
             result = [] + point
@@ -256,6 +382,7 @@ class SnapManager:
     def is_over_guide(self, point):
         doc_point = self.canvas.point_win_to_doc(point)
         ret = False
+        self.update()
         snap_dict = self.guides_grid
         if not snap_dict:
             return False, None
@@ -264,19 +391,17 @@ class SnapManager:
         orient = 0
         snap_dist = config.snap_distance / (2.0 * self.canvas.zoom)
 
-        for item in snap_dict[0]:
-            if abs(item - doc_point[0]) < snap_dist:
-                ret = True
-                pos = item
-                orient = uc2const.VERTICAL
-                break
-
-        for item in snap_dict[1]:
-            if abs(item - doc_point[1]) < snap_dist:
-                ret = True
-                pos = item
-                orient = uc2const.HORIZONTAL
-                break
+        item = get_nearest_value(snap_dict[0], doc_point[0], snap_dist)
+        if item is not None:
+            ret = True
+            pos = item
+            orient = uc2const.VERTICAL
+
+        item = get_nearest_value(snap_dict[1], doc_point[1], snap_dist)
+        if item is not None:
+            ret = True
+            pos = item
+            orient = uc2const.HORIZONTAL
 
         if ret:
             self.active_guide = self.find_guide(pos, orient)
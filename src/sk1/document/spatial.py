@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+
+from uc2 import libgeom
+
+from sk1.document.geometry import get_top_object, get_visual_bbox
+
+# objects covering more cells are kept out of the grid
+MAX_CELLS = 64
+# average number of objects per grid cell
+CELL_LOAD = 4.0
+# z-order of small candidate sets is resolved by list scan
+ZORDER_SCAN = 16
+# grid is rebuilt when number of items or large items exceeds
+# REBUILD_GROWTH times of built ones plus REBUILD_MIN
+REBUILD_GROWTH = 2
+REBUILD_MIN = 16
+
+
+class GridIndex(object):
+    """
+    Uniform grid over item bboxes. Each item is registered in all
+    cells its bbox overlaps, large items are kept in separate set
+    and are returned for any query.
+    """
+    cell_size = 1.0
+    cells = None
+    items = None
+    large = None
+
+    def __init__(self, cell_size=1.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.items = {}
+        self.large = set()
+
+    def __len__(self):
+        return len(self.items)
+
+    def _get_range(self, bbox):
+        size = self.cell_size
+        return (int(math.floor(bbox[0] / size)),
+                int(math.floor(bbox[1] / size)),
+                int(math.floor(bbox[2] / size)),
+                int(math.floor(bbox[3] / size)))
+
+    def insert(self, item, bbox):
+        if item in self.items:
+            self.remove(item)
+        i0, j0, i1, j1 = self._get_range(bbox)
+        keys = None
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_CELLS:
+            self.large.add(item)
+        else:
+            keys = [(i, j) for i in range(i0, i1 + 1)
+                    for j in range(j0, j1 + 1)]
+            for key in keys:
+                self.cells.setdefault(key, set()).add(item)
+        self.items[item] = (bbox, keys)
+
+    def remove(self, item):
+        if item not in self.items:
+            return
+        keys = self.items.pop(item)[1]
+        if keys is None:
+            self.large.discard(item)
+            return
+        for key in keys:
+            cell = self.cells[key]
+            cell.discard(item)
+            if not cell:
+                del self.cells[key]
+
+    def query(self, bbox):
+        """
+        Returns list of items which bboxes overlap provided bbox.
+        """
+        i0, j0, i1, j1 = self._get_range(bbox)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.items):
+            candidates = self.items.keys()
+        else:
+            candidates = set(self.large)
+            cells = self.cells
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    cell = cells.get((i, j))
+                    if cell:
+                        candidates.update(cell)
+        items = self.items
+        return [item for item in candidates
+                if libgeom.is_bbox_overlap(items[item][0], bbox)]
+
+
+class LayerIndex(object):
+    """
+    Spatial index of layer top level objects. Changed objects are
+    collected as dirty ones and reindexed on next query. Cell size
+    depends on objects at build time, so grid is rebuilt when layer
+    grows enough to overload cells or large items set.
+    """
+    layer = None
+    childs = None
+    grid = None
+    dirty = None
+    built_count = 0
+    built_large = 0
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.rebuild()
+
+    def rebuild(self):
+        self.childs = self.layer.childs
+        self.dirty = set()
+        items = []
+        extent = []
+        for obj in self.childs:
+            bbox = get_visual_bbox(obj)
+            if bbox:
+                items.append((obj, bbox))
+                extent = libgeom.sum_bbox(extent, bbox) if extent else bbox
+        cell_size = 1.0
+        if items:
+            w = extent[2] - extent[0]
+            h = extent[3] - extent[1]
+            area = w * h or max(w, h) ** 2
+            if area:
+                cell_size = math.sqrt(area * CELL_LOAD / len(items))
+        self.grid = GridIndex(cell_size)
+        for obj, bbox in items:
+            self.grid.insert(obj, bbox)
+        self.built_count = len(self.grid)
+        self.built_large = len(self.grid.large)
+
+    def is_outgrown(self):
+        return len(self.grid) > \
+            self.built_count * REBUILD_GROWTH + REBUILD_MIN or \
+            len(self.grid.large) > \
+            self.built_large * REBUILD_GROWTH + REBUILD_MIN
+
+    def sync(self):
+        if self.layer.childs is not self.childs:
+            self.rebuild()
+            return
+        if not self.dirty:
+            return
+        if len(self.dirty) <= ZORDER_SCAN:
+            members = set(obj for obj in self.dirty if obj in self.childs)
+        else:
+            members = self.dirty.intersection(self.childs)
+        for obj in self.dirty:
+            self.grid.remove(obj)
+            if obj in members:
+                bbox = get_visual_bbox(obj)
+                if bbox:
+                    self.grid.insert(obj, bbox)
+        self.dirty = set()
+        if self.is_outgrown():
+            self.rebuild()
+
+    def sort_by_zorder(self, objs, reverse=False):
+        if len(objs) <= ZORDER_SCAN:
+            index = self.childs.index
+            pairs = [(index(obj), obj) for obj in objs]
+        else:
+            objs = set(objs)
+            pairs = [(i, obj) for i, obj in enumerate(self.childs)
+                     if obj in objs]
+        pairs.sort(reverse=reverse)
+        return [obj for i, obj in pairs]
+
+
+class SpatialIndex(object):
+    """
+    Per-layer spatial indexes of document objects. Indexes are built
+    on first query and maintained incrementally using changes reported
+    by PresenterAPI.
+    """
+    presenter = None
+    indexes = None
+
+    def __init__(self, presenter):
+        self.presenter = presenter
+        self.indexes = {}
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def invalidate(self):
+        self.indexes = {}
+
+    def update(self, objs):
+        """
+        Marks changed (inserted, deleted or transformed) objects
+        for reindexing.
+        """
+        for obj in objs:
+            top = get_top_object(obj)
+            if top is None:
+                self.invalidate()
+                return
+            index = self.indexes.get(id(top.parent))
+            if index is not None:
+                index.dirty.add(top)
+
+    def get_layer_index(self, layer):
+        index = self.indexes.get(id(layer))
+        if index is None or index.layer is not layer:
+            index = LayerIndex(layer)
+            self.indexes[id(layer)] = index
+        else:
+            index.sync()
+        return index
+
+    def get_objs_at_point(self, layer, point, tolerance=0.0):
+        """
+        Returns layer objects which visual bboxes contain point,
+        topmost object first.
+        """
+        x, y = point
+        bbox = [x - tolerance, y - tolerance, x + tolerance, y + tolerance]
+        index = self.get_layer_index(layer)
+        return index.sort_by_zorder(index.grid.query(bbox), True)
+
+    def get_objs_in_rect(self, layer, rect):
+        """
+        Returns layer objects which visual bboxes overlap rect
+        in z-order.
+        """
+        index = self.get_layer_index(layer)
+        return index.sort_by_zorder(index.grid.query(rect))
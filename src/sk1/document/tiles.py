@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import Queue
+import cairo
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+from uc2 import libgeom
+
+LOG = logging.getLogger(__name__)
+
+# rendering stages of background tile job
+DRAFT = 0
+FULL = 1
+
+
+class Tile(object):
+    surface = None
+    bbox = []
+    damage = []
+    draft = False
+
+    def __init__(self, surface, bbox, draft=False):
+        self.surface = surface
+        self.bbox = bbox
+        self.damage = []
+        self.draft = draft
+
+
+class TileCache(object):
+    """
+    Backing store of rendered page fragments. Tiles are fixed-size
+    surfaces aligned to zoomed document space, so for the same zoom level
+    scrolling moves tiles as a whole and cached tiles are reused.
+    Tiles are keyed by (column, row) and evicted in LRU order.
+    """
+    tile_size = 256
+    cache_size = 256
+    tiles = None
+    signature = None
+    offset = (0, 0)
+    trafo = None
+    generation = 0
+
+    def __init__(self, tile_size=256, cache_size=256):
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.tiles = OrderedDict()
+        self.trafo = [1.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+
+    def destroy(self):
+        self.clear()
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def clear(self):
+        self.tiles = OrderedDict()
+        self.generation += 1
+
+    @staticmethod
+    def _split_shift(shift):
+        int_part = int(math.floor(shift))
+        frac_part = round(shift - int_part, 3)
+        if frac_part >= 1.0:
+            int_part += 1
+            frac_part = 0.0
+        return int_part, frac_part
+
+    def set_view(self, trafo, *args):
+        """
+        Adjusts cache for canvas trafo. Integer part of trafo shift
+        is applied on tile blitting, fractional part is rendered into
+        tiles. Any change of zoom, fractional shift or provided extra
+        arguments (view flags) drops cached tiles.
+        """
+        m11, m21, m12, m22, dx, dy = trafo
+        ix, fx = self._split_shift(dx)
+        iy, fy = self._split_shift(dy)
+        signature = (m11, m21, m12, m22, fx, fy) + args
+        if not signature == self.signature:
+            self.clear()
+            self.signature = signature
+        self.offset = (ix, iy)
+        self.trafo = [m11, m21, m12, m22, fx, fy]
+
+    def get_visible_keys(self, width, height):
+        size = float(self.tile_size)
+        ox, oy = self.offset
+        i0 = int(math.floor(-ox / size))
+        i1 = int(math.floor((width - ox - 1) / size))
+        j0 = int(math.floor(-oy / size))
+        j1 = int(math.floor((height - oy - 1) / size))
+        return [(i, j) for j in range(j0, j1 + 1) for i in range(i0, i1 + 1)]
+
+    def get_tile_position(self, key):
+        i, j = key
+        ox, oy = self.offset
+        return i * self.tile_size + ox, j * self.tile_size + oy
+
+    def get_tile_matrix(self, key):
+        i, j = key
+        m11, m21, m12, m22, fx, fy = self.trafo
+        return cairo.Matrix(m11, m21, m12, m22,
+                            fx - i * self.tile_size, fy - j * self.tile_size)
+
+    def get_tile_bbox(self, key):
+        """
+        Returns document bbox covered by the tile.
+        """
+        i, j = key
+        m11, m21, m12, m22, fx, fy = self.trafo
+        size = self.tile_size
+        x0 = (i * size - fx) / m11
+        x1 = ((i + 1) * size - fx) / m11
+        y0 = (j * size - fy) / m22
+        y1 = ((j + 1) * size - fy) / m22
+        return [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+
+    def create_surface(self):
+        return cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                  self.tile_size, self.tile_size)
+
+    def create_tile(self, key):
+        return Tile(self.create_surface(), self.get_tile_bbox(key))
+
+    def get(self, key):
+        tile = self.tiles.pop(key, None)
+        if tile is not None:
+            self.tiles[key] = tile
+        return tile
+
+    def put(self, key, tile):
+        self.tiles.pop(key, None)
+        self.tiles[key] = tile
+        while len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+
+    def invalidate(self, bbox=None):
+        """
+        Marks tiles overlapped by document bbox as damaged or drops
+        all tiles if bbox is not provided. Damaged tiles are kept
+        and repainted in damaged areas only.
+        """
+        if not bbox:
+            self.clear()
+            return
+        for tile in self.tiles.values():
+            if libgeom.is_bbox_overlap(tile.bbox, bbox):
+                tile.damage.append(bbox)
+
+
+class TileJob(object):
+    """
+    Tile rendering task. Layers are (layer, childs, bboxes) snapshot
+    of page taken by UI thread, so worker does not read live
+    object lists.
+    """
+    key = None
+    generation = 0
+    layers = None
+    matrix = None
+    bbox = []
+    stage = DRAFT
+    cancelled = False
+
+    def __init__(self, key, generation, layers, matrix, bbox, stage=DRAFT):
+        self.key = key
+        self.generation = generation
+        self.layers = layers
+        self.matrix = matrix
+        self.bbox = bbox
+        self.stage = stage
+
+
+class TileWorker(threading.Thread):
+    """
+    Background tile renderer. Jobs are rendered as draft first and
+    refined to full quality afterwards; drafts of all queued tiles
+    go before any refinement. Rendered surfaces are collected by UI
+    thread, cancelled jobs are skipped.
+    """
+    renderer = None
+    jobs = None
+    results = None
+    seq = 0
+
+    def __init__(self, renderer):
+        threading.Thread.__init__(self, name='TileWorker')
+        self.daemon = True
+        self.renderer = renderer
+        self.jobs = Queue.PriorityQueue()
+        self.results = Queue.Queue()
+
+    def submit(self, job):
+        self.seq += 1
+        self.jobs.put(((job.stage, self.seq), job))
+
+    def stop(self):
+        self.jobs.put(((-1, 0), None))
+        self.join()
+
+    def get_results(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Queue.Empty:
+                return results
+
+    def has_results(self):
+        return not self.results.empty()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()[1]
+            if job is None:
+                break
+            if job.cancelled:
+                continue
+            stage = job.stage
+            try:
+                surface = self.renderer.render_job(job)
+            except Exception as e:
+                # document was changed during rendering,
+                # job is cancelled and requested again
+                LOG.debug('Tile rendering failed %s', e)
+                surface = None
+            self.results.put((job, stage, surface))
+            if surface is not None and stage == DRAFT and not job.cancelled:
+                job.stage = FULL
+                self.submit(job)
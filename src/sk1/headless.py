@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Headless render/export server.
+
+Server listens on Unix domain socket and executes jobs by pool of
+worker processes. Each worker keeps its application data, color manager
+and font map between jobs. Request is JSON object:
+
+{'jobs': [{'action': 'export'|'render'|'pdf', 'input': path,
+           'output': path, 'pages': [1, ...], 'dpi': 72.0}, ...]}
+
+'pages' and 'dpi' are optional. Jobs of one request are executed
+concurrently, reply contains result for each job:
+
+{'results': [{'status': 'ok'|'error', 'output': [path, ...],
+              'message': ''}, ...]}
+
+Pool with job which is not finished till timeout is replaced, so stuck
+worker does not hold pool. Unfinished jobs of other requests are
+resubmitted to new pool.
+
+Request {'command': 'shutdown'} stops the server.
+
+Client sends request by 'sk1 --render-request [json]' command, request
+is read from stdin if it is not provided, reply is printed to stdout.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+import cairo
+
+from uc2 import libpango, uc2const
+from uc2.application import UCApplication
+from uc2.formats import get_loader, get_saver
+from uc2.formats.pdf import pdfconst
+from uc2.formats.sk2.crenderer import CairoRenderer
+from uc2.utils import fsutils
+
+from sk1 import _, app_ipc, app_log, config
+from sk1.app_cms import AppColorManager
+from sk1.app_conf import AppData
+from sk1.printing.pdfchunks import PDFChunkJob
+
+LOG = logging.getLogger(__name__)
+
+SOCKET_NAME = 'render.sock'
+
+EXPORT = 'export'
+RENDER = 'render'
+PDF = 'pdf'
+ACTIONS = (EXPORT, RENDER, PDF)
+
+# resolution of document units (points)
+BASE_DPI = 72.0
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+
+# headless application of worker process
+WORKER = None
+# polling interval of job result, in seconds
+POLL_INTERVAL = 0.5
+
+
+class PoolReplaced(Exception):
+    pass
+
+
+def get_socket_path(cfg_dir):
+    return config.render_server_socket or os.path.join(cfg_dir, SOCKET_NAME)
+
+
+def request_server(cfgdir, request):
+    """
+    Sends request to running render server and returns its reply.
+    Raises socket.error if server is not available.
+    """
+    cfg_dir = os.path.join(cfgdir, '.config', 'sk1-wx')
+    timeout = config.render_server_timeout + app_ipc.TIMEOUT
+    return app_ipc.call(get_socket_path(cfg_dir), request, timeout)
+
+
+def get_page_output(output, index, count):
+    """
+    Returns output file name for page index. Multipage output uses
+    '%d' pattern of file name or page number suffix.
+    """
+    if '%d' in output:
+        return output % (index + 1)
+    if count == 1:
+        return output
+    name, ext = os.path.splitext(output)
+    return '%s-%d%s' % (name, index + 1, ext)
+
+
+def get_utf8(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def make_result(status=STATUS_OK, output=None, message=''):
+    return {'status': status, 'output': output or [], 'message': message}
+
+
+class HeadlessApplication(UCApplication):
+    """
+    Document stack of sK1 without GUI. Instance lives in worker
+    process, so color transforms and font map stay warm between jobs.
+    """
+    appdata = None
+    default_cms = None
+    fonts = None
+
+    def __init__(self, path, cfgdir):
+        UCApplication.__init__(self, path, cfgdir, False)
+        self.appdata = AppData(self, cfgdir)
+        config.app = self
+        self.default_cms = AppColorManager(self)
+        self.default_cms.update()
+        # fontconfig scanning is done once per worker
+        self.fonts = libpango.get_fonts()[0]
+
+    def run_job(self, job):
+        action = job.get('action')
+        doc_file = get_utf8(job.get('input', ''))
+        output = get_utf8(job.get('output', ''))
+        if action not in ACTIONS:
+            return make_result(STATUS_ERROR,
+                               message=_('Unknown action <%s>') % action)
+        if not fsutils.isfile(doc_file) or not output:
+            return make_result(STATUS_ERROR,
+                               message=_('Wrong input or output file'))
+        doc = None
+        try:
+            loader = get_loader(doc_file)
+            if loader is None:
+                raise IOError(_('Loader is not found for <%s>') % doc_file)
+            doc = loader(self.appdata, doc_file)
+            if action == EXPORT:
+                outputs = self.export(doc, output)
+            else:
+                pages = self.get_pages(doc, job.get('pages'))
+                if action == RENDER:
+                    dpi = float(job.get('dpi', BASE_DPI))
+                    outputs = self.render(doc, pages, output, dpi)
+                else:
+                    outputs = self.print_pdf(doc, pages, output)
+        except Exception as e:
+            LOG.error('Job <%s> for <%s> failed %s', action, doc_file, e)
+            return make_result(STATUS_ERROR, message=str(e))
+        finally:
+            if doc is not None:
+                doc.close()
+        LOG.info('Job <%s> for <%s> is done', action, doc_file)
+        return make_result(output=outputs)
+
+    @staticmethod
+    def get_pages(doc, numbers=None):
+        pages = doc.methods.get_pages()
+        if not numbers:
+            return pages
+        return [pages[index - 1] for index in numbers
+                if 0 < index <= len(pages)]
+
+    @staticmethod
+    def export(doc, output):
+        saver = get_saver(output)
+        if saver is None:
+            msg = _('Unknown file format is requested for export <%s>')
+            raise IOError(msg % output)
+        saver(doc, output)
+        return [output]
+
+    def render(self, doc, pages, output, dpi):
+        outputs = []
+        scale = dpi / BASE_DPI
+        rend = CairoRenderer(self.default_cms)
+        for index, page in enumerate(pages):
+            w, h = page.page_format[1]
+            width = max(int(round(w * scale)), 1)
+            height = max(int(round(h * scale)), 1)
+            trafo = (scale, 0.0, 0.0, -scale, width / 2.0, height / 2.0)
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            ctx = cairo.Context(surface)
+            ctx.set_matrix(cairo.Matrix(*trafo))
+            for layer in doc.methods.get_visible_layers(page):
+                rend.antialias_flag = layer.properties[3] == 1
+                rend.render(ctx, layer.childs)
+            filename = get_page_output(output, index, len(pages))
+            surface.write_to_png(fsutils.get_sys_path(filename))
+            outputs.append(filename)
+        return outputs
+
+    def print_pdf(self, doc, pages, output):
+        appdata = self.appdata
+        job = PDFChunkJob(pages, self.default_cms, pdfconst.PDF_X_4,
+                          appdata.app_temp_dir)
+        job.methods = doc.methods
+        job.creator = '%s %s' % (appdata.app_name, appdata.version)
+        job.producer = '%s %s' % ('UniConvertor', appdata.version)
+        job.colorspace = uc2const.COLOR_CMYK
+        try:
+            job.save(output)
+        finally:
+            job.destroy()
+        return [output]
+
+
+def init_worker(path, cfgdir):
+    global WORKER
+    # interruption is handled by server process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app_log.config_worker_logging()
+    WORKER = HeadlessApplication(path, cfgdir)
+
+
+def run_job(job):
+    return WORKER.run_job(job)
+
+
+class RenderServer(object):
+    """
+    Accepts requests on Unix domain socket, each connection is served
+    by separate thread which waits for its jobs in worker pool.
+    """
+    path = ''
+    cfgdir = ''
+    socket_path = ''
+    sock = None
+    pool = None
+    lock = None
+    running = False
+
+    def __init__(self, path, cfgdir):
+        self.path = path
+        self.cfgdir = cfgdir
+        cfg_dir = os.path.join(cfgdir, '.config', 'sk1-wx')
+        self.socket_path = get_socket_path(cfg_dir)
+        self.lock = threading.Lock()
+        app_log.config_logging(os.path.join(cfg_dir, 'sk1-server.log'),
+                               config)
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def bind(self):
+        if fsutils.exists(self.socket_path):
+            if app_ipc.is_listening(self.socket_path):
+                LOG.error('Render server is already running on <%s>',
+                          self.socket_path)
+                return False
+            fsutils.remove(self.socket_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(fsutils.get_sys_path(self.socket_path))
+        os.chmod(fsutils.get_sys_path(self.socket_path), 0o600)
+        self.sock.listen(16)
+        return True
+
+    def run(self):
+        if not app_ipc.is_supported() or not self.bind():
+            return
+        self.pool = self.create_pool()
+        self.running = True
+        LOG.info('Render server is started')
+        try:
+            while self.running:
+                try:
+                    conn = self.sock.accept()[0]
+                except socket.error:
+                    break
+                thread = threading.Thread(target=self.serve, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        LOG.info('Render server is stopped')
+
+    def shutdown(self):
+        """
+        Wakes up accepting loop to stop the server.
+        """
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError):
+            pass
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if fsutils.exists(self.socket_path):
+                fsutils.remove(self.socket_path)
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        app_log.stop_logging()
+
+    def create_pool(self):
+        processes = config.render_server_workers or None
+        return multiprocessing.Pool(processes, init_worker,
+                                    (self.path, self.cfgdir))
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                raise PoolReplaced()
+            return self.pool
+
+    def replace_pool(self, pool):
+        """
+        Replaces pool which worker is stuck in expired job.
+        """
+        with self.lock:
+            if self.pool is not pool:
+                return
+            self.pool = self.create_pool()
+        LOG.warn('Worker pool with expired job is replaced')
+        pool.terminate()
+        pool.join()
+
+    def wait_result(self, task, pool, deadline):
+        """
+        Waits for job result. Raises PoolReplaced if job pool is
+        replaced meanwhile and multiprocessing.TimeoutError on deadline.
+        """
+        while True:
+            task.wait(max(min(deadline - time.time(), POLL_INTERVAL), 0.0))
+            if task.ready():
+                return task.get()
+            if time.time() >= deadline:
+                raise multiprocessing.TimeoutError()
+            if self.pool is not pool:
+                raise PoolReplaced()
+
+    def serve(self, conn):
+        try:
+            reply = self.process(app_ipc.recv_data(conn))
+            conn.sendall(json.dumps(reply))
+        except Exception as e:
+            LOG.warn('Render server connection error %s', e)
+        finally:
+            conn.close()
+
+    def process(self, data):
+        try:
+            request = json.loads(data)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return {'results': [], 'message': _('Malformed request')}
+        if request.get('command') == 'shutdown':
+            self.shutdown()
+            return {'results': []}
+        jobs = [item for item in request.get('jobs', [])
+                if isinstance(item, dict)]
+        results = [None] * len(jobs)
+        pending = range(len(jobs))
+        deadline = time.time() + config.render_server_timeout
+        while pending:
+            try:
+                pool = self.get_pool()
+            except PoolReplaced:
+                # server is stopped
+                break
+            tasks = [(index, pool.apply_async(run_job, (jobs[index],)))
+                     for index in pending]
+            pending = []
+            for index, task in tasks:
+                try:
+                    results[index] = self.wait_result(task, pool, deadline)
+                except PoolReplaced:
+                    pending.append(index)
+                except multiprocessing.TimeoutError:
+                    results[index] = make_result(
+                        STATUS_ERROR, message=_('Job timeout is expired'))
+                    self.replace_pool(pool)
+                except Exception as e:
+                    results[index] = make_result(STATUS_ERROR,
+                                                 message=str(e))
+        for index in pending:
+            results[index] = make_result(
+                STATUS_ERROR, message=_('Render server is stopped'))
+        return {'results': results}
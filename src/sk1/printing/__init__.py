@@ -15,10 +15,9 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import wal
-from printdlg import PrintDialog
-
 
 def print_dlg(parent, presenter):
+    # printing pipeline is used by headless server without GUI
+    from printdlg import PrintDialog
     app = presenter.app
     PrintDialog(parent, app, presenter).show()
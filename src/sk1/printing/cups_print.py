@@ -22,6 +22,7 @@ import wal
 
 from generic import AbstractPrinter, AbstractPS, COLOR_MODE
 from pdf_printer import PDF_Printer
+from pdfchunks import PDFChunkJob
 from printout import Printout
 from propsdlg import CUPS_PrnPropsDialog
 from sk1 import _, config
@@ -29,7 +30,7 @@ from sk1.dialogs import ProgressDialog, error_dialog
 from sk1.printing import prn_events
 from uc2 import uc2const
 from uc2.formats import get_loader
-from uc2.formats.pdf import pdfconst, pdfgen
+from uc2.formats.pdf import pdfconst
 from uc2.utils import fsutils
 
 LOG = logging.getLogger(__name__)
@@ -54,6 +55,7 @@ class CUPS_PS(AbstractPS):
 
 
 CUSTOM_SIZE = _('Custom size')
+PDF_MIME = 'application/pdf'
 
 UNIT_MM = 'mm'
 UNIT_IN = 'in'
@@ -234,40 +236,69 @@ class CUPS_Printer(AbstractPrinter):
 
     def printing(self, printout, media=''):
         appdata = printout.app.appdata
-        path = os.path.join(appdata.app_temp_dir, 'printout.pdf')
-        fileptr = fsutils.get_fileptr(path, True)
-        pages = printout.get_print_pages()
-        renderer = pdfgen.PDFGenerator(fileptr, printout.get_cms(),
-                                       pdfconst.PDF_VERSION_DEFAULT)
-
-        creator = '%s %s' % (appdata.app_name, appdata.version)
-        producer = '%s %s' % ('UniConvertor', appdata.version)
-        renderer.set_creator(creator)
-        renderer.set_producer(producer)
-        title = '%s - [%s]' % (creator, printout.doc.doc_name)
-
-        renderer.set_compression(True)
-        renderer.set_colorspace(self.colorspace)
-        renderer.set_spot_usage(False)
-
-        renderer.set_progress_message(_('Printing in progress...'))
-        renderer.set_num_pages(len(pages))
-
-        w, h = self.get_page_size()
-        for page in pages:
-            renderer.start_page(w, h, self.shifts[0], self.shifts[1])
-            for group in page.childs:
-                renderer.render(group.childs, True)
-            renderer.end_page()
-        renderer.save()
-
-        fileptr.close()
+        job = PDFChunkJob(printout.get_print_pages(), printout.get_cms(),
+                          pdfconst.PDF_VERSION_DEFAULT, appdata.app_temp_dir)
+        job.creator = '%s %s' % (appdata.app_name, appdata.version)
+        job.producer = '%s %s' % ('UniConvertor', appdata.version)
+        job.colorspace = self.colorspace
+        job.page_size = self.get_page_size()
+        job.shifts = self.shifts
+        title = '%s - [%s]' % (job.creator, printout.doc.doc_name)
 
         options = self.get_printing_options()
         if media:
             options['media'] = media
 
-        self.connection.printFile(self.cups_name, path, title, options)
+        try:
+            if config.print_streaming and \
+                    hasattr(self.connection, 'createJob'):
+                self.stream_chunks(job, title, options)
+            else:
+                self.print_chunks(job, title, options)
+        finally:
+            job.destroy()
+
+    def print_chunks(self, job, title, options):
+        """
+        Sends all rendered chunks as single multi-document CUPS job.
+        """
+        paths = []
+
+        def collect_chunk(path, last):
+            paths.append(path)
+            if last:
+                self.connection.printFiles(self.cups_name, paths,
+                                           title, options)
+
+        job.keep_chunks = True
+        job.run(collect_chunk)
+
+    def stream_chunks(self, job, title, options):
+        """
+        Sends rendered chunks as documents of single CUPS job,
+        so printer starts while later pages are still rendering.
+        """
+        job_id = self.connection.createJob(self.cups_name, title, options)
+        chunks = []
+
+        def send_chunk(path, last):
+            chunks.append(path)
+            name = 'chunk-%d' % len(chunks)
+            self.connection.startDocument(self.cups_name, job_id, name,
+                                          PDF_MIME, int(last))
+            with open(fsutils.get_sys_path(path), 'rb') as fileptr:
+                while True:
+                    data = fileptr.read(64 * 1024)
+                    if not data:
+                        break
+                    self.connection.writeRequestData(data, len(data))
+            self.connection.finishDocument(self.cups_name)
+
+        try:
+            job.run(send_chunk)
+        except Exception:
+            self.connection.cancelJob(job_id)
+            raise
 
     def print_calibration(self, app, win, path, media=''):
         pd = ProgressDialog(_('Loading calibration page...'), win)
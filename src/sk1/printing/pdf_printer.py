@@ -18,13 +18,14 @@
 import os
 
 from uc2 import uc2const
-from uc2.formats.pdf import pdfconst, pdfgen
+from uc2.formats.pdf import pdfconst
 
 from sk1 import _, config
 from sk1.printing import prn_events
 from sk1.dialogs import get_save_file_name
 
 from generic import AbstractPrinter, COLOR_MODE
+from pdfchunks import PDFChunkJob
 from propsdlg import PDF_PrnPropsDialog
 
 CUSTOM_SIZE = _('Custom size')
@@ -89,37 +90,26 @@ class PDF_Printer(AbstractPrinter):
         return True
 
     def printing(self, printout):
-        pages = printout.get_print_pages()
-        renderer = pdfgen.PDFGenerator(self.filepath, printout.get_cms(),
-                                       self.pdf_version)
-
-        self.set_meta(renderer, printout.app)
-        renderer.set_compression(self.compressed)
-        renderer.set_colorspace(self.colorspace)
-        renderer.set_spot_usage(self.use_spot)
-
-        renderer.set_progress_message(_('Printing in progress...'))
-        renderer.set_num_pages(len(pages))
-
-        w, h = self.get_page_size()
-        for page in pages:
-            renderer.start_page(w, h)
-            for group in page.childs:
-                renderer.render(group.childs, True)
-            renderer.end_page()
-        renderer.save()
-
-    def set_meta(self, renderer, app):
+        job = PDFChunkJob(printout.get_print_pages(), printout.get_cms(),
+                          self.pdf_version, '')
+        self.set_meta(job, printout.app)
+        job.compressed = self.compressed
+        job.colorspace = self.colorspace
+        job.use_spot = self.use_spot
+        job.page_size = self.get_page_size()
+        try:
+            job.save(self.filepath)
+        finally:
+            job.destroy()
+
+    def set_meta(self, job, app):
         appdata = app.appdata
-        creator = '%s %s' % (appdata.app_name, appdata.version)
-        producer = '%s %s' % ('UniConvertor', appdata.version)
-
-        renderer.set_creator(creator)
-        renderer.set_producer(producer)
-        renderer.set_title(self.meta_title)
-        renderer.set_author(self.meta_author)
-        renderer.set_subject(self.meta_subject)
-        renderer.set_keywords(self.meta_keywords)
+        job.creator = '%s %s' % (appdata.app_name, appdata.version)
+        job.producer = '%s %s' % ('UniConvertor', appdata.version)
+        job.title = self.meta_title
+        job.author = self.meta_author
+        job.subject = self.meta_subject
+        job.keywords = self.meta_keywords
 
     def run_printdlg(self, win, printout):
         if not self.filepath:
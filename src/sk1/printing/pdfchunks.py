@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import Queue
+import logging
+import os
+
+from uc2 import events
+from uc2.formats.pdf import pdfgen
+from uc2.utils import fsutils
+
+from sk1 import _, app_pool, config
+
+LOG = logging.getLogger(__name__)
+
+# polling interval of rendering processes, in seconds
+POLL_INTERVAL = 0.05
+
+# print job of forked rendering processes
+CHUNK_JOB = None
+
+
+def get_chunks(num_pages, chunk_size):
+    """
+    Returns list of (start, end) page ranges.
+    """
+    chunk_size = max(chunk_size, 1)
+    return [(start, min(start + chunk_size, num_pages))
+            for start in range(0, num_pages, chunk_size)]
+
+
+def init_chunk_worker():
+    # receivers inherited from parent process are not valid here
+    events.clean_channel(events.FILTER_INFO)
+
+
+def render_chunk(index, start, end, path):
+    """
+    Rendering process task. Returns (chunk index, path, error message).
+    """
+    try:
+        fileptr = fsutils.get_fileptr(path, True)
+        try:
+            CHUNK_JOB.render(fileptr, CHUNK_JOB.pages[start:end])
+        finally:
+            fileptr.close()
+    except Exception as e:
+        return index, path, str(e) or _('Error while printing!')
+    return index, path, ''
+
+
+class PDFChunkJob(object):
+    """
+    Renders print pages into PDF chunks of several pages. Chunks are
+    rendered concurrently by forked processes, which share document
+    with parent process, and are passed to callback in page order as
+    soon as they are ready. Images and patterns are deduplicated within
+    chunk by its PDF generator. Pages are print pages of printout or
+    document pages if document methods are provided, in such case
+    printable layers are rendered and page size is taken from page.
+    """
+    pages = None
+    cms = None
+    methods = None
+    pdf_version = None
+    page_size = None
+    shifts = (0.0, 0.0)
+    colorspace = None
+    compressed = True
+    use_spot = False
+    creator = ''
+    producer = ''
+    title = ''
+    author = ''
+    subject = ''
+    keywords = ''
+    temp_dir = ''
+    temp_files = None
+    keep_chunks = False
+    results = None
+    pool = None
+
+    def __init__(self, pages, cms, pdf_version, temp_dir):
+        self.pages = pages
+        self.cms = cms
+        self.pdf_version = pdf_version
+        self.temp_dir = temp_dir
+        self.temp_files = []
+        self.results = Queue.Queue()
+
+    def destroy(self):
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def setup(self, renderer):
+        renderer.set_creator(self.creator)
+        renderer.set_producer(self.producer)
+        renderer.set_title(self.title)
+        renderer.set_author(self.author)
+        renderer.set_subject(self.subject)
+        renderer.set_keywords(self.keywords)
+        renderer.set_compression(self.compressed)
+        renderer.set_colorspace(self.colorspace)
+        renderer.set_spot_usage(self.use_spot)
+
+    def get_groups(self, page):
+        if self.methods is None:
+            return page.childs
+        return [layer for layer in page.childs
+                if self.methods.is_layer_printable(layer)]
+
+    def render(self, fileptr, pages):
+        renderer = pdfgen.PDFGenerator(fileptr, self.cms, self.pdf_version)
+        self.setup(renderer)
+        renderer.set_progress_message(_('Printing in progress...'))
+        renderer.set_num_pages(len(pages))
+        for page in pages:
+            w, h = self.page_size or page.page_format[1]
+            renderer.start_page(w, h, self.shifts[0], self.shifts[1])
+            for group in self.get_groups(page):
+                renderer.render(group.childs, True)
+            renderer.end_page()
+        renderer.save()
+
+    def save(self, path):
+        """
+        Renders all pages into single PDF file by current process.
+        """
+        fileptr = fsutils.get_fileptr(path, True)
+        try:
+            self.render(fileptr, self.pages)
+        finally:
+            fileptr.close()
+
+    def get_chunk_path(self, index):
+        name = 'printout-%d-%d.pdf' % (os.getpid(), index)
+        return os.path.join(self.temp_dir, name)
+
+    def remove_chunk(self, path):
+        if fsutils.exists(path):
+            fsutils.remove(path)
+        if path in self.temp_files:
+            self.temp_files.remove(path)
+
+    def run(self, callback):
+        """
+        Calls callback(chunk path, last chunk flag) for each chunk
+        in page order. Chunk files are removed after callback unless
+        keep_chunks flag is set, in such case they are removed when all
+        chunks are processed. Raises IOError if chunk rendering fails.
+        """
+        global CHUNK_JOB
+        chunks = get_chunks(len(self.pages), config.print_chunk_pages)
+        if not chunks:
+            return
+        if len(chunks) == 1:
+            path = self.get_chunk_path(0)
+            self.temp_files.append(path)
+            try:
+                self.save(path)
+                callback(path, True)
+            finally:
+                self.remove_chunk(path)
+            return
+
+        # forked processes get document through module global
+        CHUNK_JOB = self
+        processes = config.print_workers or None
+        self.pool = app_pool.WorkerPool(processes, init_chunk_worker,
+                                        timeout=config.print_chunk_timeout)
+        try:
+            for index, (start, end) in enumerate(chunks):
+                path = self.get_chunk_path(index)
+                self.temp_files.append(path)
+                self.pool.submit(render_chunk, (index, start, end, path),
+                                 self.results.put)
+            self.pool.close()
+            self.collect(chunks, callback)
+        finally:
+            CHUNK_JOB = None
+            self.pool.destroy()
+            self.pool = None
+            for path in list(self.temp_files):
+                self.remove_chunk(path)
+
+    def check_workers(self):
+        """
+        Raises IOError if rendering process is terminated or
+        no chunk is rendered till timeout.
+        """
+        if not self.pool.check():
+            return
+        if self.pool.expired:
+            LOG.error('Print chunk is not rendered in %s sec',
+                      config.print_chunk_timeout)
+            raise IOError(_('Printing timeout is expired'))
+        LOG.error('Print rendering process is terminated')
+        raise IOError(_('Printing process is terminated'))
+
+    def collect(self, chunks, callback):
+        ready = {}
+        next_index = 0
+        msg = _('Printing in progress...')
+        while next_index < len(chunks):
+            try:
+                index, path, error = self.results.get(True, POLL_INTERVAL)
+            except Queue.Empty:
+                index = None
+                self.check_workers()
+            if index is not None:
+                if error:
+                    LOG.error('Cannot render print chunk %d %s', index, error)
+                    raise IOError(error)
+                ready[index] = path
+            while next_index in ready:
+                path = ready.pop(next_index)
+                next_index += 1
+                callback(path, next_index == len(chunks))
+                if not self.keep_chunks:
+                    self.remove_chunk(path)
+            done = next_index + len(ready)
+            events.emit(events.FILTER_INFO, msg,
+                        float(done) / float(len(chunks)))
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import math
+from collections import OrderedDict
+
+import cairo
+import wal
+
+from sk1 import config
+from sk1.document.tiles import FULL, TileJob, TileWorker
+from sk1.printing.printrend import PrintRenderer
+
+# polling interval of background rendering, in ms
+POLL_DELAY = 30
+# pages larger than that (in pixels) are rendered directly
+MAX_PIXELS = 4096 * 4096
+# ARGB32 pixel size, in bytes
+PIXEL_SIZE = 4
+
+
+class PreviewCache(object):
+    """
+    Rendered preview pages keyed by (page index, colorspace, shifts,
+    page size, margins, zoom). Pages zoomed in over fit-to-page zoom
+    are not cached, canvas renders visible part of them directly.
+    Current page is rendered synchronously, neighboring pages are
+    pre-rendered by background worker which uses its own PrintRenderer
+    and color manager. Cache is bounded by total size of surfaces
+    in bytes and is cleared on printout modification.
+    """
+    canvas = None
+    renderer = None
+    worker = None
+    timer = None
+    cache = None
+    size = 0
+    current = None
+    jobs = None
+    generation = 0
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.cache = OrderedDict()
+        self.jobs = {}
+
+    def destroy(self):
+        if self.timer is not None:
+            self.timer.stop()
+        if self.worker is not None:
+            self.worker.stop()
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    def clear(self):
+        self.generation += 1
+        for job in self.jobs.values():
+            job.cancelled = True
+        self.jobs = {}
+        self.cache = OrderedDict()
+        self.size = 0
+
+    def get_key(self, index):
+        printer = self.canvas.printer
+        return (index, printer.colorspace, tuple(printer.shifts),
+                tuple(printer.get_page_size()), tuple(printer.margins),
+                self.canvas.zoom)
+
+    @staticmethod
+    def get_surface_size(key):
+        w, h = key[3]
+        zoom = key[5]
+        return int(math.ceil(w * zoom)), int(math.ceil(h * zoom))
+
+    def is_zoomed(self):
+        return self.canvas.zoom > self.canvas.get_fit_zoom() * 1.001
+
+    def is_cacheable(self, key):
+        w, h = self.get_surface_size(key)
+        return w * h <= MAX_PIXELS and \
+            w * h * PIXEL_SIZE <= config.print_preview_cache_size
+
+    def get_page(self, index):
+        """
+        Returns rendered page surface or None if page is zoomed in
+        or too large for caching at current zoom.
+        """
+        key = self.get_key(index)
+        if self.is_zoomed() or not self.is_cacheable(key):
+            return None
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = self.render_page(self.canvas.renderer, key,
+                                       self.get_groups(index))
+        self.current = key
+        self.add_surface(key, surface)
+        self.prefetch(index)
+        self.check_size()
+        return surface
+
+    def add_surface(self, key, surface):
+        # most recently used surface is the last one
+        if key in self.cache:
+            self.size -= self.get_bytes(self.cache.pop(key))
+        self.cache[key] = surface
+        self.size += self.get_bytes(surface)
+
+    @staticmethod
+    def get_bytes(surface):
+        return surface.get_stride() * surface.get_height()
+
+    def check_size(self):
+        for key in self.cache.keys():
+            if self.size <= config.print_preview_cache_size:
+                break
+            # current page is kept anyway
+            if not key == self.current:
+                self.size -= self.get_bytes(self.cache.pop(key))
+
+    def get_groups(self, index):
+        return [group.childs for group in self.canvas.pages[index].childs]
+
+    def render_page(self, renderer, key, groups):
+        index, colorspace, shifts, page_size, margins, zoom = key
+        w, h = page_size
+        sw, sh = self.get_surface_size(key)
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, sw, sh)
+        ctx = cairo.Context(surface)
+        ctx.set_matrix(cairo.Matrix(zoom, 0.0, 0.0, -zoom,
+                                    sw / 2.0, sh / 2.0))
+        t, r, b, l = margins
+        ctx.rectangle(-w / 2.0 + l, -h / 2.0 + b, w - l - r, h - t - b)
+        ctx.clip()
+        renderer.set_colorspace(colorspace)
+        for childs in groups:
+            renderer.render(ctx, childs)
+        return surface
+
+    # ----- Background rendering
+
+    def get_worker(self):
+        if self.worker is None:
+            # Color transforms are cached by color manager, so worker
+            # gets its copy with own cache. Profile handles are shared,
+            # they are not modified while modal dialog is shown.
+            # Pattern and image surfaces cached by page objects are
+            # the same whichever thread creates them.
+            cms = copy.copy(self.canvas.printout.get_cms())
+            cms.clear_transforms()
+            self.renderer = PrintRenderer(cms)
+            self.worker = TileWorker(self)
+            self.worker.start()
+            self.timer = wal.CanvasTimer(self.canvas, delay=POLL_DELAY,
+                                         on_timer=self.check_jobs)
+        return self.worker
+
+    def prefetch(self, index):
+        """
+        Queues nearest pages around current page for background rendering.
+        Zoomed in pages are not prefetched.
+        """
+        keys = []
+        prefetch = config.print_preview_prefetch
+        if self.is_zoomed():
+            prefetch = 0
+        for shift in range(1, prefetch + 1):
+            for item in (index + shift, index - shift):
+                if 0 <= item < len(self.canvas.pages):
+                    keys.append(self.get_key(item))
+        # pages out of reach (or of previous zoom) are not needed anymore
+        for key, job in self.jobs.items():
+            if key not in keys:
+                job.cancelled = True
+                del self.jobs[key]
+        for key in keys:
+            if key in self.cache or key in self.jobs or \
+                    not self.is_cacheable(key):
+                continue
+            # page is resolved by UI thread, pages can be replaced
+            job = TileJob(key, self.generation, self.get_groups(key[0]),
+                          None, None, FULL)
+            self.jobs[key] = job
+            self.get_worker().submit(job)
+        if self.jobs and not self.timer.is_running():
+            self.timer.start()
+
+    def render_job(self, job):
+        # worker thread side
+        return self.render_page(self.renderer, job.key, job.layers)
+
+    def check_jobs(self):
+        for job, _stage, surface in self.worker.get_results():
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            if surface is None or job.cancelled or \
+                    not job.generation == self.generation:
+                continue
+            self.add_surface(job.key, surface)
+        self.check_size()
+        if not self.jobs:
+            self.timer.stop()
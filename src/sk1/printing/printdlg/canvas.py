@@ -20,6 +20,7 @@ import cairo
 import wal
 
 from sk1.appconst import PAGEFIT, ZOOM_IN, ZOOM_OUT
+from cache import PreviewCache
 from kbd_proc import Kbd_Processor
 
 CAIRO_BLACK = [0.0, 0.0, 0.0]
@@ -32,6 +33,7 @@ class PreviewCanvas(wal.Panel, wal.SensitiveDrawableWidget):
     printer = None
     printout = None
     renderer = None
+    cache = None
     pages = []
     page_index = 0
 
@@ -61,9 +63,11 @@ class PreviewCanvas(wal.Panel, wal.SensitiveDrawableWidget):
         self.set_bg(wal.GRAY)
         self.pages = self.printout.get_print_pages()
         self.renderer = self.printout.renderer
+        self.cache = PreviewCache(self)
         self.set_double_buffered()
 
     def destroy(self):
+        self.cache.destroy()
         items = self.__dict__.keys()
         for item in items:
             self.__dict__[item] = None
@@ -72,6 +76,7 @@ class PreviewCanvas(wal.Panel, wal.SensitiveDrawableWidget):
 
     def update_pages(self):
         self.pages = self.printout.get_print_pages()
+        self.cache.clear()
         self.refresh()
 
     def next_page(self):
@@ -141,14 +146,18 @@ class PreviewCanvas(wal.Panel, wal.SensitiveDrawableWidget):
 
     # ----- ZOOMING
 
-    def _fit_to_page(self):
+    def get_fit_zoom(self):
         width, height = self.printer.get_page_size()
+        w, h = self.get_size()
+        return min(float(w) / width, float(h) / height) * PAGEFIT
+
+    def _fit_to_page(self):
         w, h = self.get_size()
         w = float(w)
         h = float(h)
         self.width = w
         self.height = h
-        zoom = min(w / width, h / height) * PAGEFIT
+        zoom = self.get_fit_zoom()
         dx = w / 2.0
         dy = h / 2.0
         self.trafo = [zoom, 0, 0, -zoom, dx, dy]
@@ -310,13 +319,18 @@ class PreviewCanvas(wal.Panel, wal.SensitiveDrawableWidget):
         w, h = self.printer.get_page_size()
         t, r, b, l = self.printer.margins
         rect = (-w / 2.0 + l, -h / 2.0 + b, w - l - r, h - t - b)
-        self.ctx.rectangle(*rect)
-        self.ctx.clip()
-
-        groups = self.pages[self.page_index].childs
-        for group in groups:
-            self.renderer.render(self.ctx, group.childs)
-
+        surface = self.cache.get_page(self.page_index)
+        if surface is None:
+            self.ctx.rectangle(*rect)
+            self.ctx.clip()
+            groups = self.pages[self.page_index].childs
+            for group in groups:
+                self.renderer.render(self.ctx, group.childs)
+        else:
+            x, y = self.doc_to_win((-w / 2.0, h / 2.0))
+            self.ctx.identity_matrix()
+            self.ctx.set_source_surface(surface, round(x), round(y))
+            self.ctx.paint()
         self.ctx.restore()
         self.ctx.set_antialias(cairo.ANTIALIAS_NONE)
         self.ctx.set_source_rgb(*CAIRO_RED)
@@ -21,15 +21,24 @@ from uc2.formats.sk2.crenderer import CairoRenderer
 
 class PrintRenderer(CairoRenderer):
     colorspace = uc2const.COLOR_RGB
+    color_cache = None
 
     def __init__(self, cms):
         CairoRenderer.__init__(self, cms)
+        self.color_cache = {}
 
     def set_colorspace(self, cs=uc2const.COLOR_RGB):
         if not cs == self.colorspace:
             self.colorspace = cs
 
     def get_color(self, color):
+        # spot color values are nested lists
+        key = (self.colorspace, color[0], repr(color[1]))
+        if key not in self.color_cache:
+            self.color_cache[key] = self.convert_color(color)
+        return self.color_cache[key] + (color[2],)
+
+    def convert_color(self, color):
         if self.colorspace == uc2const.COLOR_RGB:
             r, g, b = self.cms.get_display_color(color)
         elif self.colorspace == uc2const.COLOR_CMYK:
@@ -38,7 +47,7 @@ class PrintRenderer(CairoRenderer):
         else:
             gc = self.cms.get_grayscale_color(color)
             r, g, b = self.cms.get_display_color(gc)
-        return r, g, b, color[2]
+        return r, g, b
 
     def get_surface(self, obj):
         if self.colorspace == uc2const.COLOR_RGB:
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright (C) 2021 by Ihor E. Novikov
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+On-disk atlas of font sample previews.
+
+Atlas consists of data file with raw ARGB32 pixels of samples and
+JSON index {'key': settings key, 'fonts': {family: [fingerprint,
+offset, width, height, stride]}, 'names': {family: [width, height]}}.
+Data file is memory mapped, samples are copied from mapping when
+they are requested. Missing samples are rendered by separate
+process and appended to data file.
+
+Rendering process is started by running this module as script, so it
+does not inherit GUI toolkit state of application. Process reads task
+JSON {'families': [...], 'text': text, 'width': width, 'fontsize': size}
+from stdin and writes samples into stdout as SAMPLE header, family name
+and pixels.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+
+import cairo
+
+from uc2 import libpango
+from uc2.utils import fsutils
+
+LOG = logging.getLogger(__name__)
+
+ATLAS_VERSION = 1
+ATLAS_NAME = 'font_previews'
+# samples are added to atlas by such portions
+BATCH_SIZE = 32
+# family name size, width, height, stride, pixels size
+SAMPLE = struct.Struct('>5I')
+# limit of materialized bitmaps of each preview sequence
+BITMAP_LIMIT = 256
+
+
+def get_utf8_keys(data):
+    # family names are utf-8 strings
+    return dict((key.encode('utf-8'), value) for key, value in data.items())
+
+
+def get_fingerprint(family, faces):
+    return hashlib.md5(repr((family, faces))).hexdigest()
+
+
+def get_settings_key(text, width, fontsize):
+    return hashlib.md5(repr((ATLAS_VERSION, text, width, fontsize))).hexdigest()
+
+
+def render_sample(family, text, width, fontsize):
+    """
+    Renders font sample into cairo surface.
+    """
+    h = libpango.get_sample_size(text, family, fontsize)[1]
+    if not h:
+        h = 10
+        LOG.warn('Incorrect font <%s>: zero font height', family)
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, h)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(0.0, 0.0, 0.0)
+    ctx.set_matrix(cairo.Matrix(1.0, 0.0, 0.0, 1.0, 0.0, 0.0))
+    ctx.set_antialias(cairo.ANTIALIAS_DEFAULT)
+    libpango.render_sample(ctx, text, family, fontsize)
+    ctx.fill()
+    return surface
+
+
+def render_process():
+    """
+    Rendering process entry.
+    """
+    logging.basicConfig()
+    output = os.fdopen(os.dup(1), 'wb')
+    # library messages should not be mixed with samples
+    os.dup2(2, 1)
+    task = json.load(sys.stdin)
+    args = (task['text'], task['width'], task['fontsize'])
+    for index, family in enumerate(task['families']):
+        family = family.encode('utf-8')
+        try:
+            surface = render_sample(family, *args)
+        except Exception as e:
+            LOG.error('Cannot process font <%s> %s', family, e)
+            continue
+        surface.flush()
+        data = str(surface.get_data())
+        output.write(SAMPLE.pack(len(family), surface.get_width(),
+                                 surface.get_height(), surface.get_stride(),
+                                 len(data)))
+        output.write(family + data)
+        if not (index + 1) % BATCH_SIZE:
+            output.flush()
+    output.close()
+
+
+def read_samples(fileptr):
+    """
+    Yields (family, width, height, stride, pixels) samples
+    of rendering process.
+    """
+    while True:
+        header = fileptr.read(SAMPLE.size)
+        if len(header) < SAMPLE.size:
+            return
+        name_size, w, h, stride, size = SAMPLE.unpack(header)
+        family = fileptr.read(name_size)
+        data = fileptr.read(size)
+        if len(data) < size:
+            return
+        yield family, w, h, stride, data
+
+
+class FontAtlas(object):
+    """
+    Font samples of current preview settings. Samples are valid
+    while fingerprint of font family (its faces) is not changed.
+    Methods are called from UI thread and from reader thread
+    of rendering process, so atlas data is guarded by lock. File I/O
+    is done outside of the lock, index saving is serialized by own lock.
+    """
+    cache_dir = ''
+    key = ''
+    text = ''
+    width = 0
+    fontsize = 0
+    fonts = None
+    names = None
+    fileptr = None
+    mm = None
+    mapped = 0
+    process = None
+    reader = None
+    lock = None
+    save_lock = None
+
+    def __init__(self, cache_dir, text, width, fontsize):
+        self.cache_dir = cache_dir
+        self.text = text
+        self.width = width
+        self.fontsize = fontsize
+        self.key = get_settings_key(text, width, fontsize)
+        self.fonts = {}
+        self.names = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.load()
+
+    def destroy(self):
+        self.stop()
+        self.close()
+        items = self.__dict__.keys()
+        for item in items:
+            self.__dict__[item] = None
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, ATLAS_NAME + '.json')
+
+    @property
+    def data_path(self):
+        return os.path.join(self.cache_dir, ATLAS_NAME + '.dat')
+
+    def load(self):
+        if not fsutils.exists(self.cache_dir):
+            fsutils.makedirs(self.cache_dir)
+        index = {}
+        if fsutils.exists(self.index_path):
+            try:
+                with fsutils.get_fileptr(self.index_path) as fileptr:
+                    index = json.load(fileptr)
+            except Exception as e:
+                LOG.warn('Cannot read font preview atlas %s', e)
+        self.names = get_utf8_keys(index.get('names', {}))
+        if index.get('key') == self.key and fsutils.exists(self.data_path):
+            self.fonts = get_utf8_keys(index.get('fonts', {}))
+        else:
+            # preview settings are changed, samples are outdated
+            fsutils.get_fileptr(self.data_path, True).close()
+        self.fileptr = fsutils.get_fileptr(self.data_path)
+        self.remap()
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fileptr is not None:
+            self.fileptr.close()
+            self.fileptr = None
+
+    def remap(self, entries=None):
+        """
+        Maps grown data file and adds entries of appended samples.
+        """
+        size = os.fstat(self.fileptr.fileno()).st_size
+        mm = self.mm
+        if not size == self.mapped:
+            mm = mmap.mmap(self.fileptr.fileno(), size,
+                           access=mmap.ACCESS_READ) if size else None
+        with self.lock:
+            old, self.mm, self.mapped = self.mm, mm, size
+            self.fonts.update(entries or {})
+        if old is not None and old is not mm:
+            old.close()
+
+    def save(self):
+        with self.lock:
+            index = {'key': self.key, 'fonts': dict(self.fonts),
+                     'names': dict(self.names)}
+        tmp_path = self.index_path + '.tmp'
+        with self.save_lock:
+            try:
+                with fsutils.get_fileptr(tmp_path, True) as fileptr:
+                    json.dump(index, fileptr)
+                os.rename(fsutils.get_sys_path(tmp_path),
+                          fsutils.get_sys_path(self.index_path))
+            except Exception as e:
+                LOG.warn('Cannot save font preview atlas %s', e)
+
+    def get_surface(self, family, fingerprint):
+        """
+        Returns sample surface or None if sample is not rendered yet.
+        """
+        with self.lock:
+            entry = self.fonts.get(family)
+            if entry is None or not entry[0] == fingerprint or \
+                    entry[1] + entry[3] * entry[4] > self.mapped:
+                return None
+            offset, w, h, stride = entry[1:]
+            data = bytearray(self.mm[offset:offset + h * stride])
+        return cairo.ImageSurface.create_for_data(
+            data, cairo.FORMAT_ARGB32, w, h, stride)
+
+    def get_missing(self, fingerprints):
+        return [family for family, fingerprint in fingerprints.items()
+                if family not in self.fonts or
+                not self.fonts[family][0] == fingerprint]
+
+    def add_samples(self, samples, fingerprints):
+        # data file is appended by reader thread only
+        entries = {}
+        with fsutils.uopen(self.data_path, 'ab') as fileptr:
+            fileptr.seek(0, 2)
+            offset = fileptr.tell()
+            for family, w, h, stride, data in samples:
+                fileptr.write(data)
+                entries[family] = [fingerprints[family], offset,
+                                   w, h, stride]
+                offset += len(data)
+        self.remap(entries)
+        self.save()
+
+    def set_name_sizes(self, sizes):
+        with self.lock:
+            self.names.update(sizes)
+        self.save()
+
+    def is_running(self):
+        return self.process is not None
+
+    def start(self, fingerprints):
+        """
+        Starts rendering of missing samples by separate process.
+        """
+        families = sorted(self.get_missing(fingerprints))
+        if not families or self.is_running():
+            return
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        script = os.path.splitext(__file__)[0] + '.py'
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, script], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, env=env, close_fds=True)
+        except OSError as e:
+            LOG.error('Cannot start font preview rendering %s', e)
+            return
+        task = {'families': families, 'text': self.text,
+                'width': self.width, 'fontsize': self.fontsize}
+        self.reader = threading.Thread(target=self.read,
+                                       args=(self.process, task, fingerprints),
+                                       name='FontAtlasReader')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def read(self, process, task, fingerprints):
+        """
+        Reader thread. Passes task to rendering process and adds
+        its samples to atlas by portions.
+        """
+        samples = []
+        try:
+            process.stdin.write(json.dumps(task))
+            process.stdin.close()
+            for sample in read_samples(process.stdout):
+                samples.append(sample)
+                if len(samples) == BATCH_SIZE and self.process is process:
+                    self.add_samples(samples, fingerprints)
+                    samples = []
+            if samples and self.process is process:
+                self.add_samples(samples, fingerprints)
+        except Exception as e:
+            LOG.error('Font preview rendering failed %s', e)
+        finally:
+            process.stdout.close()
+            process.wait()
+            if self.process is process:
+                self.process = None
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is not None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        if self.reader is not None:
+            self.reader.join()
+            self.reader = None
+
+
+class LazyBitmaps(object):
+    """
+    Read-only sequence of bitmaps which are created on access
+    by loader(index). Recently used bitmaps are kept, loader can
+    return None for temporary (not cached) placeholder.
+    """
+    size = 0
+    loader = None
+    placeholder = None
+    cache = None
+
+    def __init__(self, size, loader, placeholder=None):
+        self.size = size
+        self.loader = loader
+        self.placeholder = placeholder
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for index in xrange(self.size):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[item] for item in xrange(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        bmp = self.cache.pop(index, None)
+        if bmp is None:
+            bmp = self.loader(index)
+            if bmp is None:
+                return self.placeholder
+        self.cache[index] = bmp
+        while len(self.cache) > BITMAP_LIMIT:
+            self.cache.popitem(last=False)
+        return bmp
+
+    def clear(self):
+        self.cache = OrderedDict()
+
+
+if __name__ == '__main__':
+    render_process()
@@ -20,51 +20,97 @@ import cairo
 
 import wal
 from sk1 import _, config, events
+from sk1.pwidgets.fontatlas import FontAtlas, LazyBitmaps, \
+    get_fingerprint, get_settings_key
 from sk1.resources import icons, get_icon
-from uc2 import libpango, cms
+from uc2 import libpango
 
-FONTNAME_CACHE = []
-FONTSAMPLE_CACHE = []
+FONTNAME_CACHE = None
+FONTSAMPLE_CACHE = None
 MAXSIZE = []
+ATLAS = None
 
 LOG = logging.getLogger(__name__)
 
 
+def get_preview_settings():
+    return (config.font_preview_text.decode('utf-8'),
+            config.font_preview_width, config.font_preview_size)
+
+
+def get_atlas():
+    global ATLAS
+    settings = get_preview_settings()
+    if ATLAS is None or not ATLAS.key == get_settings_key(*settings):
+        if ATLAS is not None:
+            ATLAS.destroy()
+        cache_dir = config.app.appdata.app_font_cache_dir
+        ATLAS = FontAtlas(cache_dir, *settings)
+    return ATLAS
+
+
+def get_blank_bitmap(w, h):
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, max(w, 1), max(h, 1))
+    return wal.copy_surface_to_bitmap(surface)
+
+
 def generate_fontname_cache(fonts):
-    maxwidth = 0
-    height = 0
+    """
+    Creates lazy sequence of font name bitmaps. Sizes of names
+    are measured once and are kept in font preview atlas.
+    """
+    global FONTNAME_CACHE
+    atlas = get_atlas()
+    color = wal.UI_COLORS['text']
+    sizes = {}
     for item in fonts:
+        if item in atlas.names:
+            continue
         try:
-            bmp, size = wal.text_to_bitmap(item, wal.UI_COLORS['text'])
+            sizes[item] = wal.text_to_bitmap(item, color)[1]
         except Exception as e:
             LOG.error('Cannot process font <%s> %s', item, e)
-            continue
-        FONTNAME_CACHE.append(bmp)
-        maxwidth = max(size[0], maxwidth)
-        height = size[1]
-    MAXSIZE.append(maxwidth)
-    MAXSIZE.append(height)
+    if sizes:
+        atlas.set_name_sizes(sizes)
+    sizes = [atlas.names[item] for item in fonts if item in atlas.names]
+    maxwidth = max([size[0] for size in sizes]) if sizes else 0
+    height = sizes[-1][1] if sizes else 0
+    MAXSIZE[:] = [maxwidth, height]
+
+    def load(index):
+        try:
+            return wal.text_to_bitmap(fonts[index], color)[0]
+        except Exception as e:
+            LOG.error('Cannot process font <%s> %s', fonts[index], e)
+        return None
+
+    FONTNAME_CACHE = LazyBitmaps(len(fonts), load,
+                                 get_blank_bitmap(maxwidth, height))
 
 
 def generate_fontsample_cache(fonts):
-    w = config.font_preview_width
-    fontsize = config.font_preview_size
-    color = cms.val_255(config.font_preview_color)
-    text = config.font_preview_text.decode('utf-8')
-    for item in fonts:
-        h = libpango.get_sample_size(text, item, fontsize)[1]
-        if not h:
-            h = 10
-            LOG.warn('Incorrect font <%s>: zero font height', item)
-        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
-        ctx = cairo.Context(surface)
-        ctx.set_source_rgb(0.0, 0.0, 0.0)
-        ctx.set_matrix(cairo.Matrix(1.0, 0.0, 0.0, 1.0, 0.0, 0.0))
-        ctx.set_antialias(cairo.ANTIALIAS_DEFAULT)
-        libpango.render_sample(ctx, text, item, fontsize)
-        ctx.fill()
-        bmp = wal.copy_surface_to_bitmap(surface)
-        FONTSAMPLE_CACHE.append(bmp)
+    """
+    Creates lazy sequence of font sample bitmaps which are read
+    from font preview atlas. Missing samples are rendered in
+    background, blank placeholder is shown meanwhile.
+    """
+    global FONTSAMPLE_CACHE
+    atlas = get_atlas()
+    faces_dict = libpango.get_fonts()[1]
+    fingerprints = dict((item, get_fingerprint(item, faces_dict.get(item)))
+                        for item in fonts)
+
+    def load(index):
+        family = fonts[index]
+        surface = atlas.get_surface(family, fingerprints[family])
+        if surface is None:
+            return None
+        return wal.copy_surface_to_bitmap(surface)
+
+    placeholder = get_blank_bitmap(config.font_preview_width,
+                                   config.font_preview_size)
+    FONTSAMPLE_CACHE = LazyBitmaps(len(fonts), load, placeholder)
+    atlas.start(fingerprints)
 
 
 def font_cache_update():
@@ -78,9 +124,8 @@ class FontChoice(wal.FontBitmapChoice):
 
     def __init__(self, parent, selected_font='Sans', onchange=None):
         self.fonts = libpango.get_fonts()[0]
-        if not FONTNAME_CACHE:
-            generate_fontname_cache(self.fonts)
-            generate_fontsample_cache(self.fonts)
+        if FONTNAME_CACHE is None:
+            font_cache_update()
         if selected_font not in self.fonts:
             selected_font = 'Sans'
         value = self.fonts.index(selected_font)
@@ -92,7 +137,6 @@ class FontChoice(wal.FontBitmapChoice):
 
     def check_config(self, *args):
         if args[0].startswith('font_preview'):
-            FONTSAMPLE_CACHE[:] = []
             generate_fontsample_cache(self.fonts)
             index = self._get_active()
             self._set_bitmaps(self.bitmaps, FONTSAMPLE_CACHE)